@@ -31,6 +31,7 @@ from mercurial import (
     cmdutil,
     commands,
     copies,
+    discovery,
     error,
     extensions,
     mdiff,
@@ -508,6 +509,39 @@ def perfchangegroupchangelog(ui, repo, version='02', rev=None, **opts):
     timer(d)
     fm.end()
 
+@command('perfchangegroup', formatteropts +
+         [('', 'version', '02', 'changegroup version'),
+          ('r', 'rev', [], 'revisions to add to the changegroup'),
+          ('', 'base', [], 'revisions known by the receiver')])
+def perfchangegroup(ui, repo, version='02', rev=None, base=None, **opts):
+    """Benchmark producing a full changegroup.
+
+    This measures the work of a server answering a pull of the ancestors of
+    REV not in the ancestors of BASE, or of a clone by default. The
+    changegroup is produced without and with ``bundle.reusedeltas``, the
+    difference being the time saved by sending the deltas stored in the
+    revlogs instead of computing new ones.
+    """
+    repo = repo.unfiltered()
+    cl = repo.changelog
+    heads = [cl.node(r) for r in repo.revs('heads(%lr)', rev or ['all()'])]
+    common = []
+    if base:
+        common = [cl.node(r) for r in repo.revs('heads(::(%lr))', base)]
+    outgoing = discovery.outgoing(repo, common, heads)
+
+    def d():
+        bundler = changegroup.getbundler(version, repo)
+        for chunk in changegroup.getsubsetraw(repo, outgoing, bundler,
+                                              'perf'):
+            pass
+
+    timer, fm = gettimer(ui, opts)
+    for reuse in (False, True):
+        repo.ui.setconfig('bundle', 'reusedeltas', reuse, 'perf')
+        timer(d, title=reuse and 'reused deltas' or 'computed deltas')
+    fm.end()
+
 @command('perfdirs', formatteropts)
 def perfdirs(ui, repo, **opts):
     timer, fm = gettimer(ui, opts)
@@ -1122,6 +1156,16 @@ def perfrevlogchunks(ui, repo, file_=None, engines=None, startrev=0, **opts):
         # Save chunks as a side-effect.
         chunks[0] = rl._chunks(revs, df=fh)
 
+    def dochainbatch(chain, sparse):
+        rl.clearcaches()
+        fh = rlfh(rl)
+        oldsparse = rl._withsparseread
+        rl._withsparseread = sparse
+        try:
+            rl._chunks(chain, df=fh)
+        finally:
+            rl._withsparseread = oldsparse
+
     def docompress(compressor):
         rl.clearcaches()
 
@@ -1143,6 +1187,15 @@ def perfrevlogchunks(ui, repo, file_=None, engines=None, startrev=0, **opts):
         (lambda: dochunkbatch(), 'chunk batch'),
     ]
 
+    # older revlogs do not support sparse reads
+    if util.safehasattr(rl, '_withsparseread'):
+        # delta chain of the last revision, where sparse reads matter
+        chain = rl._deltachain(revs[-1])[0]
+        benches.extend([
+            (lambda: dochainbatch(chain, False), 'chain batch'),
+            (lambda: dochainbatch(chain, True), 'chain batch w/ sparse read'),
+        ])
+
     for engine in sorted(engines):
         compressor = util.compengines[engine].revlogcompressor()
         benches.append((functools.partial(docompress, compressor),
@@ -1210,6 +1263,11 @@ def perfrevlogrevision(ui, repo, file_, rev=None, cache=None, **opts):
             r.clearcaches()
         r._deltachain(rev)
 
+    def doslicechain(chain):
+        if not cache:
+            r.clearcaches()
+        list(slicechunk(r, chain))
+
     def doread(chain):
         if not cache:
             r.clearcaches()
@@ -1251,6 +1309,11 @@ def perfrevlogrevision(ui, repo, file_, rev=None, cache=None, **opts):
     benches = [
         (lambda: dorevision(), 'full'),
         (lambda: dodeltachain(rev), 'deltachain'),
+    ]
+    slicechunk = getattr(revlog, '_slicechunk', None)
+    if slicechunk is not None and getattr(r, '_withsparseread', False):
+        benches.append((lambda: doslicechain(chain), 'slice-sparse-chain'))
+    benches += [
         (lambda: doread(chain), 'read'),
         (lambda: dorawchunks(data, chain), 'rawchunks'),
         (lambda: dodecompress(rawchunks), 'decompress'),
@@ -0,0 +1,2 @@
+# this file is autogenerated by setup.py
+modulepolicy = b"allow"
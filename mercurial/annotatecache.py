@@ -0,0 +1,224 @@
+# annotatecache.py - persistent cache of the annotations of files
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""persistent cache of the annotations of file revisions
+
+Annotating a file revision walks the history of the file and diffs every
+file revision against its parents. With ``experimental.annotate-cache`` set,
+the annotations computed are stored in ``.hg/cache/annotate``, and the
+annotation of a later revision only diffs the file revisions which are not
+in the cache.
+
+The annotations of the cached revisions of a file are stored as a linelog:
+the list of all the lines they contain, in file order, each line recording
+the revision of the file where it comes from, its line number there, and
+the interval of the cached revisions containing it. The cached revisions are
+numbered in the order they were added, and the annotation of any of them is
+read back without diffing. Adding a revision only diffs its annotation
+against the one of the revision added last.
+
+One cache file exists per file and set of options affecting the annotation
+(following copies and whitespace handling).
+
+File format:
+
+  header: 4 bytes magic, 1 byte version, 3 bytes padding, then the 4 bytes
+          number of origins, of revisions and of lines.
+  origins: the file revisions lines come from, as a 20 bytes node and the 4
+          bytes length of the path, followed by the path.
+  revisions: the 20 bytes nodes of the cached revisions, in order.
+  lines: 4 bytes first and end revisions containing the line, index of the
+          origin and line number in the origin.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import struct
+
+from . import (
+    error,
+    mdiff,
+)
+
+_cachedir = 'annotate'
+
+_magic = 'HGAC'
+_version = 1
+
+_headerstruct = struct.Struct('>4sBxxxIII')
+_originstruct = struct.Struct('>20sI')
+_linestruct = struct.Struct('>IIII')
+
+# end revision of the lines still in the last cached revision
+_alive = 0xffffffff
+
+def enabled(repo):
+    # experimental config: experimental.annotate-cache
+    return repo.ui.configbool('experimental', 'annotate-cache')
+
+def _optionskey(follow, diffopts):
+    """name of the directory of the cache files for the given options"""
+    if diffopts is None:
+        diffopts = mdiff.defaultopts
+    flags = [follow, diffopts.ignorews, diffopts.ignorewsamount,
+             diffopts.ignoreblanklines]
+    return ''.join('%d' % bool(f) for f in flags)
+
+class linelog(object):
+    """the lines of a sequence of annotated file revisions, with the
+    intervals of revisions containing them"""
+
+    def __init__(self, origins=None, nodes=None, lines=None):
+        # (path, node) of the file revisions lines come from
+        self.origins = origins or []
+        self._originmap = dict((o, i) for i, o in enumerate(self.origins))
+        # annotated revisions, in the order they were added
+        self.nodes = nodes or []
+        self._nodemap = dict((n, i) for i, n in enumerate(self.nodes))
+        # [first rev, end rev, origin index, line number]
+        self.lines = lines or []
+
+    def __contains__(self, node):
+        return node in self._nodemap
+
+    def annotate(self, node):
+        """return the annotation of the cached revision node, as a list of
+        (path, node, line number)"""
+        rev = self._nodemap[node]
+        origins = self.origins
+        return [origins[o] + (n,) for first, end, o, n in self.lines
+                if first <= rev < end]
+
+    def _origin(self, path, node):
+        key = (path, node)
+        idx = self._originmap.get(key)
+        if idx is None:
+            idx = self._originmap[key] = len(self.origins)
+            self.origins.append(key)
+        return idx
+
+    def append(self, node, annotation):
+        """add the revision node with annotation, a list of (path, node, line
+        number)"""
+        if node in self._nodemap:
+            return
+        rev = len(self.nodes)
+        new = [(self._origin(p, n), l) for p, n, l in annotation]
+
+        lines = self.lines
+        alive = [i for i, l in enumerate(lines) if l[1] == _alive]
+        oldtext = ''.join('%d %d\n' % tuple(lines[i][2:]) for i in alive)
+        newtext = ''.join('%d %d\n' % l for l in new)
+
+        # new lines to insert before the given index of lines
+        inserts = {}
+        a = b = 0
+        for a1, a2, b1, b2 in mdiff.blocks(oldtext, newtext):
+            for i in alive[a:a1]:
+                lines[i][1] = rev
+            if b < b1:
+                pos = alive[a1] if a1 < len(alive) else len(lines)
+                inserts.setdefault(pos, []).extend(
+                    [rev, _alive, o, l] for o, l in new[b:b1])
+            a, b = a2, b2
+
+        if inserts:
+            merged = []
+            for i, line in enumerate(lines):
+                merged.extend(inserts.get(i, ()))
+                merged.append(line)
+            merged.extend(inserts.get(len(lines), ()))
+            self.lines = merged
+        self._nodemap[node] = rev
+        self.nodes.append(node)
+
+def _parse(data):
+    magic, version, norigins, nnodes, nlines = _headerstruct.unpack_from(data)
+    if magic != _magic or version != _version:
+        raise ValueError('unknown annotate cache format')
+    off = _headerstruct.size
+    origins = []
+    for i in xrange(norigins):
+        node, length = _originstruct.unpack_from(data, off)
+        off += _originstruct.size
+        path = data[off:off + length]
+        off += length
+        origins.append((path, node))
+    nodes = [data[off + i * 20:off + (i + 1) * 20] for i in xrange(nnodes)]
+    off += nnodes * 20
+    if len(data) != off + nlines * _linestruct.size:
+        raise ValueError('truncated annotate cache')
+    unpack = _linestruct.unpack_from
+    lines = [list(unpack(data, off + i * _linestruct.size))
+             for i in xrange(nlines)]
+    return linelog(origins, nodes, lines)
+
+def _serialize(log):
+    chunks = [_headerstruct.pack(_magic, _version, len(log.origins),
+                                 len(log.nodes), len(log.lines))]
+    for path, node in log.origins:
+        chunks.append(_originstruct.pack(node, len(path)))
+        chunks.append(path)
+    chunks.extend(log.nodes)
+    pack = _linestruct.pack
+    chunks.extend(pack(*l) for l in log.lines)
+    return ''.join(chunks)
+
+class annotatecache(object):
+    """the cached annotations of the files of a repository, for a set of
+    annotate options"""
+
+    def __init__(self, repo, follow, diffopts):
+        self._repo = repo
+        self._dir = '%s/%s' % (_cachedir, _optionskey(follow, diffopts))
+        self._logs = {}
+
+    def _filename(self, path):
+        return '%s/%s' % (self._dir, hashlib.sha1(path).hexdigest())
+
+    def _linelog(self, path):
+        log = self._logs.get(path)
+        if log is None:
+            try:
+                data = self._repo.cachevfs.read(self._filename(path))
+                log = _parse(data)
+            except (IOError, OSError):
+                log = linelog()
+            except (ValueError, struct.error) as inst:
+                self._repo.ui.debug('invalid annotate cache for %s: %s\n'
+                                    % (path, inst))
+                log = linelog()
+            self._logs[path] = log
+        return log
+
+    def get(self, fctx):
+        """return the cached annotation of fctx, as a list of (path, node,
+        line number), or None"""
+        log = self._linelog(fctx.path())
+        node = fctx.filenode()
+        if node not in log:
+            return None
+        return log.annotate(node)
+
+    def add(self, fctx, annotation):
+        """add the annotation of fctx, a list of (path, node, line number),
+        to the cache"""
+        path = fctx.path()
+        log = self._linelog(path)
+        node = fctx.filenode()
+        if node in log:
+            return
+        log.append(node, annotation)
+        try:
+            fp = self._repo.cachevfs(self._filename(path), 'w',
+                                     atomictemp=True)
+            fp.write(_serialize(log))
+            fp.close()
+        except (IOError, OSError, error.Abort) as inst:
+            self._repo.ui.debug("couldn't write annotate cache for %s: %s\n"
+                                % (path, inst))
@@ -161,6 +161,7 @@ from . import (
     phases,
     pushkey,
     pycompat,
+    streamclone,
     tags,
     url,
     util,
@@ -1345,6 +1346,10 @@ def getrepocaps(repo, allowpushback=False):
     cpmode = repo.ui.config('server', 'concurrent-push-mode')
     if cpmode == 'check-related':
         caps['checkheads'] = ('related',)
+    # experimental config: experimental.bundle2.stream
+    if (repo.ui.configbool('experimental', 'bundle2.stream')
+        and streamclone.allowservergeneration(repo)):
+        caps['stream'] = ('v2',)
     return caps
 
 def bundle2caps(remote):
@@ -1826,6 +1831,22 @@ def handleobsmarkerreply(op, inpart):
     partid = int(inpart.params['in-reply-to'])
     op.records.add('obsmarkers', {'new': ret}, partid)
 
+@parthandler('stream2', ('requirements', 'filecount', 'bytecount'))
+def handlestreamv2bundle(op, part):
+    """Applies a version 2 stream clone to an empty repository."""
+    requirements = urlreq.unquote(part.params['requirements']).split(',')
+    filecount = int(part.params['filecount'])
+    bytecount = int(part.params['bytecount'])
+
+    repo = op.repo
+    if len(repo):
+        raise error.Abort(_('cannot apply stream clone to non empty '
+                            'repository'))
+
+    repo.ui.debug('applying stream bundle\n')
+    streamclone.applybundlev2(repo, part, filecount, bytecount,
+                              requirements)
+
 @parthandler('hgtagsfnodes')
 def handlehgtagsfnodes(op, inpart):
     """Applies .hgtags fnodes cache entries to the local repo.
@@ -310,60 +310,63 @@ static PyObject *makestat(const struct stat *st)
 	return stat;
 }
 
-static PyObject *_listdir_stat(char *path, int pathlen, int keepstat,
-			       char *skip)
-{
-	PyObject *list, *elem, *stat = NULL, *ret = NULL;
-	char fullpath[PATH_MAX + 10];
-	int kind, err;
+/* an entry read by readentries */
+struct direntry {
+	char *name;
+	int kind;
 	struct stat st;
-	struct dirent *ent;
-	DIR *dir;
-#ifdef AT_SYMLINK_NOFOLLOW
-	int dfd = -1;
-#endif
+};
 
-	if (pathlen >= PATH_MAX) {
-		errno = ENAMETOOLONG;
-		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
-		goto error_value;
-	}
-	strncpy(fullpath, path, PATH_MAX);
-	fullpath[pathlen] = '/';
+static void freeentries(struct direntry *entries, Py_ssize_t count)
+{
+	Py_ssize_t i;
 
-#ifdef AT_SYMLINK_NOFOLLOW
-	dfd = open(path, O_RDONLY);
-	if (dfd == -1) {
-		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
-		goto error_value;
-	}
-	dir = fdopendir(dfd);
-#else
-	dir = opendir(path);
-#endif
-	if (!dir) {
-		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
-		goto error_dir;
-	}
+	for (i = 0; i < count; i++)
+		free(entries[i].name);
+	free(entries);
+}
 
-	list = PyList_New(0);
-	if (!list)
-		goto error_list;
+/* Read the entries of dir, and stat them if keepstat is set or their kind
+   is unknown. Runs without the GIL, the Python objects are built from the
+   entries afterwards.
+
+   Returns the number of entries, or -1 on error with errno set and, if an
+   entry couldn't be stat'ed, its path in fullpath. Sets *skipped if an entry
+   is a directory named skip. */
+static Py_ssize_t readentries(DIR *dir, int dfd, char *fullpath, int pathlen,
+			      int keepstat, char *skip,
+			      struct direntry **entriesp, int *skipped)
+{
+	struct direntry *entries = NULL, *entry, *grown;
+	Py_ssize_t count = 0, alloc = 0;
+	struct dirent *ent;
+	int kind, err;
 
 	while ((ent = readdir(dir))) {
 		if (!strcmp(ent->d_name, ".") || !strcmp(ent->d_name, ".."))
 			continue;
 
+		if (count == alloc) {
+			alloc = alloc ? alloc * 2 : 64;
+			grown = realloc(entries, alloc * sizeof(*entries));
+			if (!grown) {
+				errno = ENOMEM;
+				goto error;
+			}
+			entries = grown;
+		}
+		entry = &entries[count];
+
 		kind = entkind(ent);
 		if (kind == -1 || keepstat) {
 #ifdef AT_SYMLINK_NOFOLLOW
-			err = fstatat(dfd, ent->d_name, &st,
+			err = fstatat(dfd, ent->d_name, &entry->st,
 				      AT_SYMLINK_NOFOLLOW);
 #else
 			strncpy(fullpath + pathlen + 1, ent->d_name,
 				PATH_MAX - pathlen);
 			fullpath[PATH_MAX] = '\0';
-			err = lstat(fullpath, &st);
+			err = lstat(fullpath, &entry->st);
 #endif
 			if (err == -1) {
 				/* race with file deletion? */
@@ -372,29 +375,108 @@ static PyObject *_listdir_stat(char *path, int pathlen, int keepstat,
 				strncpy(fullpath + pathlen + 1, ent->d_name,
 					PATH_MAX - pathlen);
 				fullpath[PATH_MAX] = 0;
-				PyErr_SetFromErrnoWithFilename(PyExc_OSError,
-							       fullpath);
 				goto error;
 			}
-			kind = st.st_mode & S_IFMT;
+			kind = entry->st.st_mode & S_IFMT;
 		}
 
 		/* quit early? */
 		if (skip && kind == S_IFDIR && !strcmp(ent->d_name, skip)) {
-			ret = PyList_New(0);
+			*skipped = 1;
+			break;
+		}
+
+		entry->name = strdup(ent->d_name);
+		if (!entry->name) {
+			errno = ENOMEM;
 			goto error;
 		}
+		entry->kind = kind;
+		count++;
+	}
+
+	*entriesp = entries;
+	return count;
+
+error:
+	err = errno;
+	freeentries(entries, count);
+	errno = err;
+	return -1;
+}
 
+static PyObject *_listdir_stat(char *path, int pathlen, int keepstat,
+			       char *skip)
+{
+	PyObject *list, *elem, *stat, *ret = NULL;
+	char fullpath[PATH_MAX + 10];
+	struct direntry *entries = NULL;
+	Py_ssize_t i, count = 0;
+	int skipped = 0;
+	DIR *dir;
+	int dfd = -1;
+
+	if (pathlen >= PATH_MAX) {
+		errno = ENAMETOOLONG;
+		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+		return NULL;
+	}
+	strncpy(fullpath, path, PATH_MAX);
+	fullpath[pathlen] = '/';
+	fullpath[pathlen + 1] = '\0';
+
+	/* listing and stat'ing may block for a long time on network
+	   filesystems, let other threads run meanwhile */
+	Py_BEGIN_ALLOW_THREADS
+#ifdef AT_SYMLINK_NOFOLLOW
+	dfd = open(path, O_RDONLY);
+	if (dfd == -1)
+		dir = NULL;
+	else {
+		dir = fdopendir(dfd);
+		if (!dir)
+			close(dfd);
+	}
+#else
+	dir = opendir(path);
+#endif
+	if (dir) {
+		count = readentries(dir, dfd, fullpath, pathlen, keepstat,
+				    skip, &entries, &skipped);
+		/* closedir also closes its dirfd */
+		closedir(dir);
+	}
+	Py_END_ALLOW_THREADS
+
+	if (!dir) {
+		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
+		return NULL;
+	}
+	if (count == -1) {
+		PyErr_SetFromErrnoWithFilename(PyExc_OSError, fullpath);
+		return NULL;
+	}
+	if (skipped) {
+		freeentries(entries, count);
+		return PyList_New(0);
+	}
+
+	list = PyList_New(0);
+	if (!list)
+		goto error;
+
+	for (i = 0; i < count; i++) {
 		if (keepstat) {
-			stat = makestat(&st);
+			stat = makestat(&entries[i].st);
 			if (!stat)
 				goto error;
-			elem = Py_BuildValue("siN", ent->d_name, kind, stat);
+			elem = Py_BuildValue("siN", entries[i].name,
+					     entries[i].kind, stat);
 		} else
-			elem = Py_BuildValue("si", ent->d_name, kind);
+			elem = Py_BuildValue("si", entries[i].name,
+					     entries[i].kind);
 		if (!elem)
 			goto error;
-		stat = NULL;
 
 		PyList_Append(list, elem);
 		Py_DECREF(elem);
@@ -404,17 +486,8 @@ static PyObject *_listdir_stat(char *path, int pathlen, int keepstat,
 	Py_INCREF(ret);
 
 error:
-	Py_DECREF(list);
-	Py_XDECREF(stat);
-error_list:
-	closedir(dir);
-	/* closedir also closes its dirfd */
-	goto error_value;
-error_dir:
-#ifdef AT_SYMLINK_NOFOLLOW
-	close(dfd);
-#endif
-error_value:
+	Py_XDECREF(list);
+	freeentries(entries, count);
 	return ret;
 }
 
@@ -487,7 +560,9 @@ static PyObject *_listdir_batch(char *path, int pathlen, int keepstat,
 		goto error_value;
 	}
 
+	Py_BEGIN_ALLOW_THREADS
 	dfd = open(path, O_RDONLY);
+	Py_END_ALLOW_THREADS
 	if (dfd == -1) {
 		PyErr_SetFromErrnoWithFilename(PyExc_OSError, path);
 		goto error_value;
@@ -499,9 +574,11 @@ static PyObject *_listdir_batch(char *path, int pathlen, int keepstat,
 
 	do {
 		count = LISTDIR_BATCH_SIZE;
+		Py_BEGIN_ALLOW_THREADS
 		err = getdirentriesattr(dfd, &requested_attr, &attrbuf,
 					sizeof(attrbuf), &count, &basep_unused,
 					&new_state, 0);
+		Py_END_ALLOW_THREADS
 		if (err < 0) {
 			if (errno == ENOTSUP) {
 				/* We're on a filesystem that doesn't support
@@ -610,10 +687,17 @@ static PyObject *_listdir(char *path, int pathlen, int keepstat, char *skip)
 	return _listdir_stat(path, pathlen, keepstat, skip);
 }
 
+/* number of files stat'ed between two releases of the GIL */
+#define STATFILES_BATCH 1000
+
 static PyObject *statfiles(PyObject *self, PyObject *args)
 {
 	PyObject *names, *stats;
-	Py_ssize_t i, count;
+	PyObject **pypaths = NULL;
+	char **paths = NULL;
+	struct stat *sts = NULL;
+	int *rets = NULL;
+	Py_ssize_t i, j, n, count;
 
 	if (!PyArg_ParseTuple(args, "O:statfiles", &names))
 		return NULL;
@@ -628,43 +712,79 @@ static PyObject *statfiles(PyObject *self, PyObject *args)
 	if (stats == NULL)
 		return NULL;
 
-	for (i = 0; i < count; i++) {
-		PyObject *stat, *pypath;
-		struct stat st;
-		int ret, kind;
-		char *path;
+	pypaths = calloc(STATFILES_BATCH, sizeof(PyObject *));
+	paths = calloc(STATFILES_BATCH, sizeof(char *));
+	sts = calloc(STATFILES_BATCH, sizeof(struct stat));
+	rets = calloc(STATFILES_BATCH, sizeof(int));
+	if (!pypaths || !paths || !sts || !rets) {
+		PyErr_NoMemory();
+		goto bail;
+	}
+
+	for (i = 0; i < count; i += n) {
+		n = count - i;
+		if (n > STATFILES_BATCH)
+			n = STATFILES_BATCH;
+
+		for (j = 0; j < n; j++) {
+			pypaths[j] = PySequence_GetItem(names, i + j);
+			if (!pypaths[j])
+				goto bailbatch;
+			paths[j] = PyBytes_AsString(pypaths[j]);
+			if (paths[j] == NULL) {
+				j++;
+				PyErr_SetString(PyExc_TypeError,
+						"not a string");
+				goto bailbatch;
+			}
+		}
+
+		/* lstat() may block for a long time on network filesystems,
+		   let other threads run meanwhile */
+		Py_BEGIN_ALLOW_THREADS
+		for (j = 0; j < n; j++)
+			rets[j] = lstat(paths[j], &sts[j]);
+		Py_END_ALLOW_THREADS
+
+		for (j = 0; j < n; j++) {
+			PyObject *stat;
+			int kind = sts[j].st_mode & S_IFMT;
+			Py_DECREF(pypaths[j]);
+			pypaths[j] = NULL;
+			if (rets[j] != -1 &&
+			    (kind == S_IFREG || kind == S_IFLNK)) {
+				stat = makestat(&sts[j]);
+				if (stat == NULL) {
+					j = n;
+					goto bailbatch;
+				}
+			} else {
+				Py_INCREF(Py_None);
+				stat = Py_None;
+			}
+			PyList_SET_ITEM(stats, i + j, stat);
+		}
 
 		/* With a large file count or on a slow filesystem,
 		   don't block signals for long (issue4878). */
-		if ((i % 1000) == 999 && PyErr_CheckSignals() == -1)
-			goto bail;
-
-		pypath = PySequence_GetItem(names, i);
-		if (!pypath)
+		if (PyErr_CheckSignals() == -1)
 			goto bail;
-		path = PyBytes_AsString(pypath);
-		if (path == NULL) {
-			Py_DECREF(pypath);
-			PyErr_SetString(PyExc_TypeError, "not a string");
-			goto bail;
-		}
-		ret = lstat(path, &st);
-		Py_DECREF(pypath);
-		kind = st.st_mode & S_IFMT;
-		if (ret != -1 && (kind == S_IFREG || kind == S_IFLNK)) {
-			stat = makestat(&st);
-			if (stat == NULL)
-				goto bail;
-			PyList_SET_ITEM(stats, i, stat);
-		} else {
-			Py_INCREF(Py_None);
-			PyList_SET_ITEM(stats, i, Py_None);
-		}
 	}
 
+	free(pypaths);
+	free(paths);
+	free(sts);
+	free(rets);
 	return stats;
 
+bailbatch:
+	while (j-- > 0)
+		Py_XDECREF(pypaths[j]);
 bail:
+	free(pypaths);
+	free(paths);
+	free(sts);
+	free(rets);
 	Py_DECREF(stats);
 	return NULL;
 }
@@ -794,9 +794,35 @@ class cg2packer(cg1packer):
             # generally doesn't help, so we disable it by default (treating
             # bundle.reorder=auto just like bundle.reorder=False).
             self._reorder = False
+        # experimental config: bundle.reusedeltas
+        self._reusedeltas = repo.ui.configbool('bundle', 'reusedeltas')
+        # revisions known to the receiver
+        self._commonrevs = ()
+        # revlog being sent, and its revisions sent so far
+        self._sentlog = None
+        self._sentrevs = set()
+
+    def generate(self, commonrevs, clnodes, fastpathlinkrev, source):
+        self._commonrevs = commonrevs
+        return super(cg2packer, self).generate(commonrevs, clnodes,
+                                               fastpathlinkrev, source)
+
+    def _knownrev(self, revlog, rev):
+        """Whether the receiver has a revision when it gets to this point
+        of the changegroup.
+
+        It has the revisions introduced by the common changesets, and the
+        ones sent earlier in the group."""
+        return (rev in self._sentrevs
+                or revlog.linkrev(rev) in self._commonrevs)
 
     def deltaparent(self, revlog, rev, p1, p2, prev):
         dp = revlog.deltaparent(rev)
+        if self._reusedeltas:
+            if revlog is not self._sentlog:
+                self._sentlog = revlog
+                self._sentrevs = set()
+            self._sentrevs.add(rev)
         if dp == nullrev and revlog.storedeltachains:
             # Avoid sending full revisions when delta parent is null. Pick prev
             # in that case. It's tempting to pick p1 in this case, as p1 will
@@ -811,6 +837,10 @@ class cg2packer(cg1packer):
             # stick to full snapshot.
             return nullrev
         elif dp not in (p1, p2, prev):
+            if self._reusedeltas and self._knownrev(revlog, dp):
+                # The stored delta can be sent as is, without computing
+                # the full texts of the revisions to diff them.
+                return dp
             # Pick prev when we can't be sure remote has the base revision.
             return prev
         else:
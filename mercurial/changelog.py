@@ -275,7 +275,7 @@ class changelog(revlog.revlog):
 
         datafile = '00changelog.d'
         revlog.revlog.__init__(self, opener, indexfile, datafile=datafile,
-                               checkambig=True)
+                               checkambig=True, persistentnodemap=True)
 
         if self._initempty:
             # changelogs don't benefit from generaldelta
@@ -325,7 +325,7 @@ class changelog(revlog.revlog):
     @util.propertycache
     def nodemap(self):
         # XXX need filtering too
-        self.rev(self.node(0))
+        self._buildnodecache()
         return self._nodecache
 
     def reachableroots(self, minroot, heads, roots, includepath=False):
@@ -33,6 +33,7 @@ from . import (
     match as matchmod,
     obsolete,
     patch,
+    pathindex,
     pathutil,
     phases,
     pycompat,
@@ -2156,6 +2157,9 @@ def walkchangerevs(repo, match, opts, prepare):
             def __init__(self):
                 self.set = set()
                 self.revs = set(revs)
+                candidates = pathindex.matchcandidates(repo, match)
+                if candidates is not None:
+                    self.revs &= candidates
 
             # No need to worry about locality here because it will be accessed
             # in the same order as the increasing window below.
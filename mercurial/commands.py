@@ -57,6 +57,7 @@ from . import (
     templatekw,
     ui as uimod,
     util,
+    worker,
 )
 
 release = lockmod.release
@@ -368,19 +369,26 @@ def annotate(ui, repo, *pats, **opts):
     skiprevs = opts.get('skip')
     if skiprevs:
         skiprevs = scmutil.revrange(repo, skiprevs)
+    annotateopts = {'follow': follow, 'linenumber': linenumber,
+                    'skiprevs': skiprevs, 'diffopts': diffopts}
 
-    for abs in ctx.walk(m):
-        fctx = ctx[abs]
+    # experimental config: experimental.annotate-workers
+    if ui.configbool('experimental', 'annotate-workers'):
+        annotated = _annotateparallel(ui, ctx, list(ctx.walk(m)),
+                                      opts.get('text'), annotateopts)
+    else:
+        annotated = _annotateserial(ctx, ctx.walk(m), opts.get('text'),
+                                    annotateopts)
+
+    for abs, lines in annotated:
         rootfm.startitem()
         rootfm.data(abspath=abs, path=m.rel(abs))
-        if not opts.get('text') and fctx.isbinary():
+        if lines is None:
             rootfm.plain(_("%s: binary file\n")
                          % ((pats and m.rel(abs)) or abs))
             continue
 
         fm = rootfm.nested('lines')
-        lines = fctx.annotate(follow=follow, linenumber=linenumber,
-                              skiprevs=skiprevs, diffopts=diffopts)
         if not lines:
             fm.end()
             continue
@@ -408,6 +416,60 @@ def annotate(ui, repo, *pats, **opts):
 
     rootfm.end()
 
+def _annotateserial(ctx, files, text, annotateopts):
+    """yield (file, annotated lines) pairs, lines being None for binary
+    files"""
+    for abs in files:
+        fctx = ctx[abs]
+        if not text and fctx.isbinary():
+            yield abs, None
+        else:
+            yield abs, fctx.annotate(**annotateopts)
+
+def _annotateworker(ctx, files, text, annotateopts, args):
+    """annotate files in a worker process
+
+    Yields (index, data) pairs, data being the escaped pickle of the path,
+    file node, revision and line number of the origin and the content of
+    each line of a file, or of None for binary files.
+    """
+    for i in args:
+        abs, lines = next(_annotateserial(ctx, [files[i]], text, annotateopts))
+        if lines is not None:
+            lines = [(f.path(), f.filenode(), f.rev(), n, l)
+                     for (f, n), l in lines]
+        yield i, util.escapestr(util.pickle.dumps(lines))
+
+def _annotateparallel(ui, ctx, files, text, annotateopts):
+    """yield (file, annotated lines) pairs for files annotated in worker
+    processes, in the order of files"""
+    repo = ctx.repo()
+    origins = {}
+    def origin(path, filenode, rev):
+        key = (path, filenode, rev)
+        fctx = origins.get(key)
+        if fctx is None:
+            if rev is None:
+                fctx = ctx[path]
+            else:
+                fctx = repo.filectx(path, changeid=rev, fileid=filenode)
+            origins[key] = fctx
+        return fctx
+
+    pending = {}
+    nextidx = 0
+    prog = worker.worker(ui, 0.01, _annotateworker,
+                         (ctx, files, text, annotateopts), range(len(files)))
+    for i, data in prog:
+        pending[i] = util.pickle.loads(util.unescapestr(data))
+        while nextidx in pending:
+            lines = pending.pop(nextidx)
+            if lines is not None:
+                lines = [((origin(path, filenode, rev), n), l)
+                         for path, filenode, rev, n, l in lines]
+            yield files[nextidx], lines
+            nextidx += 1
+
 @command('archive',
     [('', 'no-decode', None, _('do not pass files through decoders')),
     ('p', 'prefix', '', _('directory prefix for files in archive'),
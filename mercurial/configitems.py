@@ -76,6 +76,9 @@ coreconfigitem('bundle', 'mainreporoot',
 coreconfigitem('bundle', 'reorder',
     default='auto',
 )
+coreconfigitem('bundle', 'reusedeltas',
+    default=False,
+)
 coreconfigitem('censor', 'policy',
     default='abort',
 )
@@ -142,6 +145,12 @@ coreconfigitem('email', 'charsets',
 coreconfigitem('email', 'method',
     default='smtp',
 )
+coreconfigitem('experimental', 'annotate-cache',
+    default=False,
+)
+coreconfigitem('experimental', 'annotate-workers',
+    default=False,
+)
 coreconfigitem('experimental', 'bundle-phases',
     default=False,
 )
@@ -154,6 +163,9 @@ coreconfigitem('experimental', 'bundle2-output-capture',
 coreconfigitem('experimental', 'bundle2.pushback',
     default=False,
 )
+coreconfigitem('experimental', 'bundle2.stream',
+    default=False,
+)
 coreconfigitem('experimental', 'bundle2lazylocking',
     default=False,
 )
@@ -166,6 +178,15 @@ coreconfigitem('experimental', 'changegroup3',
 coreconfigitem('experimental', 'clientcompressionengines',
     default=list,
 )
+coreconfigitem('experimental', 'copies-cache',
+    default=False,
+)
+coreconfigitem('experimental', 'copies-cache.maxsize',
+    default='8M',
+)
+coreconfigitem('experimental', 'copies-index',
+    default=False,
+)
 coreconfigitem('experimental', 'crecordtest',
     default=None,
 )
@@ -181,6 +202,9 @@ coreconfigitem('experimental', 'evolution',
 coreconfigitem('experimental', 'evolution.bundle-obsmarker',
     default=False,
 )
+coreconfigitem('experimental', 'evolution.obshashrange',
+    default=False,
+)
 coreconfigitem('experimental', 'evolution.track-operation',
     default=False,
 )
@@ -196,12 +220,21 @@ coreconfigitem('experimental', 'extendedheader.similarity',
 coreconfigitem('experimental', 'format.compression',
     default='zlib',
 )
+coreconfigitem('experimental', 'getbundlecache',
+    default=0,
+)
 coreconfigitem('experimental', 'graphshorten',
     default=False,
 )
+coreconfigitem('experimental', 'hidden-cache',
+    default=False,
+)
 coreconfigitem('experimental', 'hook-track-tags',
     default=False,
 )
+coreconfigitem('experimental', 'http.parallelrequests',
+    default=1,
+)
 coreconfigitem('experimental', 'httppostargs',
     default=False,
 )
@@ -211,9 +244,21 @@ coreconfigitem('experimental', 'manifestv2',
 coreconfigitem('experimental', 'mergedriver',
     default=None,
 )
+coreconfigitem('experimental', 'mmapindexthreshold',
+    default=None,
+)
 coreconfigitem('experimental', 'obsmarkers-exchange-debug',
     default=False,
 )
+coreconfigitem('experimental', 'obsstore-index',
+    default=False,
+)
+coreconfigitem('experimental', 'path-index',
+    default=False,
+)
+coreconfigitem('experimental', 'persistent-nodemap',
+    default=False,
+)
 coreconfigitem('experimental', 'revertalternateinteractivemode',
     default=True,
 )
@@ -223,12 +268,39 @@ coreconfigitem('experimental', 'revlogv2',
 coreconfigitem('experimental', 'spacemovesdown',
     default=False,
 )
+coreconfigitem('experimental', 'sparse-read',
+    default=False,
+)
+coreconfigitem('experimental', 'sparse-read.density-threshold',
+    default=0.25,
+)
+coreconfigitem('experimental', 'sparse-read.min-gap-size',
+    default='256K',
+)
+coreconfigitem('experimental', 'ssh.controldir',
+    default=None,
+)
+coreconfigitem('experimental', 'ssh.controlpersist',
+    default=None,
+)
+coreconfigitem('experimental', 'stat-threads',
+    default=0,
+)
+coreconfigitem('experimental', 'text-index',
+    default=False,
+)
+coreconfigitem('experimental', 'treedirstate',
+    default=False,
+)
 coreconfigitem('experimental', 'treemanifest',
     default=False,
 )
 coreconfigitem('experimental', 'updatecheck',
     default=None,
 )
+coreconfigitem('experimental', 'verify-workers',
+    default=False,
+)
 coreconfigitem('format', 'aggressivemergedeltas',
     default=False,
 )
@@ -238,6 +310,9 @@ coreconfigitem('format', 'chunkcachesize',
 coreconfigitem('format', 'dotencode',
     default=True,
 )
+coreconfigitem('format', 'exhaustivedeltasearch',
+    default=False,
+)
 coreconfigitem('format', 'generaldelta',
     default=False,
 )
@@ -247,6 +322,9 @@ coreconfigitem('format', 'manifestcachesize',
 coreconfigitem('format', 'maxchainlen',
     default=None,
 )
+coreconfigitem('format', 'maxchainspan',
+    default=None,
+)
 coreconfigitem('format', 'obsstore-version',
     default=None,
 )
@@ -581,6 +659,12 @@ coreconfigitem('worker', 'backgroundcloseminfilecount',
 coreconfigitem('worker', 'backgroundclosethreadcount',
     default=4,
 )
+coreconfigitem('worker', 'backgroundwrite',
+    default=dynamicdefault,
+)
+coreconfigitem('worker', 'backgroundwritemaxbytes',
+    default='64 MB',
+)
 coreconfigitem('worker', 'numcpus',
     default=None,
 )
@@ -26,6 +26,7 @@ from .node import (
     wdirrev,
 )
 from . import (
+    annotatecache,
     encoding,
     error,
     fileset,
@@ -941,7 +942,12 @@ class basefilectx(object):
                 return text.count("\n")
             return text.count("\n") + int(bool(text))
 
-        if linenumber:
+        cache = None
+        if not skiprevs and annotatecache.enabled(self._repo):
+            cache = annotatecache.annotatecache(self._repo, follow, diffopts)
+
+        # the cache needs the line numbers to tell the lines apart
+        if linenumber or cache is not None:
             def decorate(text, rev):
                 return ([(rev, i) for i in xrange(1, lines(text) + 1)], text)
         else:
@@ -986,18 +992,51 @@ class basefilectx(object):
                 ac = cl.ancestors([introrev], inclusive=True)
             base._ancestrycontext = ac
 
+        origins = {}
+        def fromcache(f):
+            # annotation of f rebuilt from the cache, or None
+            if cache is None or f.filenode() is None:
+                return None
+            cached = cache.get(f)
+            if cached is None:
+                return None
+            ann = []
+            srcrev = f.rev()
+            for path, node, i in cached:
+                # the changeset introducing an origin depends on the revision
+                # it is reached from, f itself may have introduced it
+                key = (path, node, srcrev)
+                o = origins.get(key)
+                if o is None:
+                    o = filectx(self._repo, path, fileid=node,
+                                filelog=getlog(path))
+                    ac = getattr(f, '_ancestrycontext', None)
+                    if ac is not None:
+                        o._ancestrycontext = ac
+                    o._changeid = o._adjustlinkrev(srcrev, inclusive=True)
+                    origins[key] = o
+                ann.append((o, i))
+            return (ann, f.data())
+
         # This algorithm would prefer to be recursive, but Python is a
         # bit recursion-hostile. Instead we do an iterative
         # depth-first search.
 
-        # 1st DFS pre-calculates pcache and needed
+        # 1st DFS pre-calculates pcache and needed, and takes the
+        # annotations of the revisions in the cache
         visit = [base]
         pcache = {}
         needed = {base: 1}
+        hist = {}
         while visit:
             f = visit.pop()
             if f in pcache:
                 continue
+            cached = fromcache(f)
+            if cached is not None:
+                hist[f] = cached
+                pcache[f] = []
+                continue
             pl = parents(f)
             pcache[f] = pl
             for p in pl:
@@ -1007,7 +1046,6 @@ class basefilectx(object):
 
         # 2nd DFS does the actual annotate
         visit[:] = [base]
-        hist = {}
         while visit:
             f = visit[-1]
             if f in hist:
@@ -1038,7 +1076,14 @@ class basefilectx(object):
                 hist[f] = curr
                 del pcache[f]
 
-        return zip(hist[base][0], hist[base][1].splitlines(True))
+        annotation = hist[base][0]
+        if cache is not None:
+            if base.filenode() is not None and introrev is not None:
+                cache.add(base, [(f.path(), f.filenode(), i)
+                                 for f, i in annotation])
+            if not linenumber:
+                annotation = [(f, False) for f, i in annotation]
+        return zip(annotation, hist[base][1].splitlines(True))
 
     def ancestors(self, followfirst=False):
         visit = {}
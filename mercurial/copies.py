@@ -7,15 +7,278 @@
 
 from __future__ import absolute_import
 
+import errno
 import heapq
+import struct
 
 from . import (
+    error,
     node,
     pathutil,
     scmutil,
     util,
 )
 
+# number of copies mappings kept decoded in memory
+_cachelrusize = 128
+
+class _recordcache(object):
+    """base class for caches stored in an append-only file of records
+
+    Each record is a header, holding the key of the record and the length of
+    its data, then the data. An incomplete record at the end of the file is
+    ignored, and overwritten by the next write. The file is read in memory
+    once and the records are only decoded on demand.
+
+    When _maxsize() returns a positive size, appending records that would
+    take the file over it rewrites the file instead, keeping the most recently
+    used records within half of that size. Records read or added by the
+    current process are the most recently used, followed by the records at
+    the end of the file.
+    """
+
+    # name of the file in the cache directory
+    _filename = None
+    # struct of the header of the records, the key fields then the length
+    _header = None
+
+    def __init__(self, repo):
+        assert repo.filtername is None
+        self._repo = repo
+        self._pending = []
+        # keys of the records read by this process, in order of last use
+        self._used = util.sortdict()
+        data = ''
+        try:
+            data = repo.cachevfs.read(self._filename)
+        except (IOError, OSError) as inst:
+            if inst.errno != errno.ENOENT:
+                repo.ui.debug("couldn't read cache/%s: %s\n"
+                              % (self._filename, inst))
+        self._load(data)
+
+    def _maxsize(self):
+        """return the size the cache file should not exceed, or None if it
+        is unbounded"""
+        return None
+
+    def _load(self, data):
+        self._data = data
+        self._offsets = {}
+        off = 0
+        size = self._header.size
+        while off + size <= len(self._data):
+            fields = self._header.unpack_from(self._data, off)
+            start = off + size
+            end = start + fields[-1]
+            if end > len(self._data):
+                break
+            self._offsets[fields[:-1]] = (start, end)
+            off = end
+        # length of the valid content of the file
+        self._datalen = off
+
+    def _getdata(self, key):
+        """return the data of the record for key, or None"""
+        loc = self._offsets.get(key)
+        if loc is None:
+            return None
+        self._used[key] = True
+        return self._data[loc[0]:loc[1]]
+
+    def _add(self, key, data):
+        """record data for key, unless it is already known"""
+        if key not in self._offsets:
+            self._offsets[key] = None
+            self._pending.append((key, data))
+
+    def write(self):
+        """append the new records to the cache file"""
+        if not self._pending:
+            return
+        repo = self._repo
+        maxsize = self._maxsize()
+        size = self._datalen
+        for key, data in self._pending:
+            size += self._header.size + len(data)
+        wlock = None
+        try:
+            wlock = repo.wlock(wait=False)
+            if maxsize and size > maxsize:
+                self._compact(maxsize // 2)
+                return
+            f = repo.cachevfs.open(self._filename, 'ab')
+            try:
+                if f.tell() != self._datalen:
+                    # changed by someone else, or ends with a partial record
+                    repo.ui.debug("cache/%s changed - truncating it\n"
+                                  % self._filename)
+                    f.seek(self._datalen)
+                    f.truncate()
+                for key, data in self._pending:
+                    fields = key + (len(data),)
+                    f.write(self._header.pack(*fields) + data)
+                self._datalen = f.tell()
+            finally:
+                f.close()
+            self._pending = []
+        except (IOError, OSError, error.Abort, error.LockError) as inst:
+            repo.ui.debug("couldn't write cache/%s: %s\n"
+                          % (self._filename, inst))
+        finally:
+            if wlock is not None:
+                wlock.release()
+
+    def _compact(self, size):
+        """rewrite the cache file with the most recently used records whose
+        total size fits in size"""
+        records = [(key, self._data[loc[0]:loc[1]])
+                   for key, loc in sorted(self._offsets.items(),
+                                          key=lambda x: x[1])
+                   if loc is not None and key not in self._used]
+        for key in self._used:
+            loc = self._offsets[key]
+            records.append((key, self._data[loc[0]:loc[1]]))
+        records.extend(self._pending)
+        kept = []
+        for key, data in reversed(records):
+            size -= self._header.size + len(data)
+            if size < 0:
+                break
+            fields = key + (len(data),)
+            kept.append(self._header.pack(*fields) + data)
+        data = ''.join(reversed(kept))
+        self._repo.ui.debug("compacting cache/%s: %d records dropped\n"
+                            % (self._filename, len(records) - len(kept)))
+        f = self._repo.cachevfs(self._filename, 'w', atomictemp=True)
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        self._load(data)
+        self._pending = []
+
+def _encodecopies(cm, prefix=''):
+    return ['%s%s\0%s' % (prefix, dst, cm[dst]) for dst in sorted(cm)]
+
+class copiescache(_recordcache):
+    """Persistent cache of the copies between two changesets, as computed by
+    _forwardcopies.
+
+    The copies between two changesets never change, so the cache is keyed by
+    the (ancestor, descendant) changeset node pairs and never invalidated;
+    the least recently used records are dropped once the file grows over
+    experimental.copies-cache.maxsize. The data of a record is the
+    "dst\\0src" pairs of the mapping, separated by newlines. The most
+    recently used mappings are kept decoded in an LRU cache.
+    """
+
+    _filename = 'copies-v1'
+    _header = struct.Struct('>20s20sI')
+
+    def __init__(self, repo):
+        super(copiescache, self).__init__(repo)
+        self._lru = util.lrucachedict(_cachelrusize)
+
+    def _maxsize(self):
+        # experimental config: experimental.copies-cache.maxsize
+        return self._repo.ui.configbytes('experimental',
+                                         'copies-cache.maxsize')
+
+    def get(self, a, b):
+        """return the copies from changeset node a to node b, or None"""
+        key = (a, b)
+        try:
+            return self._lru[key]
+        except KeyError:
+            pass
+        data = self._getdata(key)
+        if data is None:
+            return None
+        cm = {}
+        if data:
+            for l in data.split('\n'):
+                dst, src = l.split('\0')
+                cm[dst] = src
+        self._lru[key] = cm
+        return cm
+
+    def set(self, a, b, cm):
+        """record the copies from changeset node a to node b"""
+        self._lru[(a, b)] = cm
+        self._add((a, b), '\n'.join(_encodecopies(cm)))
+
+class copiesindex(_recordcache):
+    """Persistent index of the copies recorded by each changeset.
+
+    Copy information is stored in the filelogs, finding the copies between
+    two changesets from there requires opening the filelog of every file
+    they touched. This index records, for each changeset node, the files the
+    changeset copied from a file of its first or second parent and the files
+    it removed, so copies can be traced by walking the changelog.
+
+    The data of a record is made of lines: "1dst\\0src" and "2dst\\0src"
+    for the copies from the first and second parent, and "-f" for the
+    removed files.
+    """
+
+    _filename = 'copies-index-v1'
+    _header = struct.Struct('>20sI')
+
+    def changesetcopies(self, rev):
+        """return the copies from the first and second parent and the list
+        of removed files of a changeset"""
+        data = self._getdata((self._repo.changelog.node(rev),))
+        if data is None:
+            return self._compute(rev)
+        p1copies = {}
+        p2copies = {}
+        removed = []
+        if data:
+            for l in data.split('\n'):
+                kind = l[0]
+                if kind == '-':
+                    removed.append(l[1:])
+                    continue
+                dst, src = l[1:].split('\0')
+                if kind == '1':
+                    p1copies[dst] = src
+                else:
+                    p2copies[dst] = src
+        return p1copies, p2copies, removed
+
+    def _compute(self, rev):
+        ctx = self._repo[rev]
+        p1 = ctx.p1()
+        p2 = ctx.p2()
+        p1copies = {}
+        p2copies = {}
+        removed = []
+        for f in ctx.files():
+            if f not in ctx:
+                removed.append(f)
+                continue
+            renamed = ctx[f].renamed()
+            if not renamed:
+                continue
+            src, srcnode = renamed
+            if src in p1 and p1[src].filenode() == srcnode:
+                p1copies[f] = src
+            elif src in p2 and p2[src].filenode() == srcnode:
+                p2copies[f] = src
+        lines = (_encodecopies(p1copies, '1') + _encodecopies(p2copies, '2')
+                 + ['-' + f for f in removed])
+        self._add((ctx.node(),), '\n'.join(lines))
+        return p1copies, p2copies, removed
+
+    def update(self, revs):
+        """index the given revisions, and write the new records"""
+        cl = self._repo.changelog
+        for rev in revs:
+            if (cl.node(rev),) not in self._offsets:
+                self._compute(rev)
+        self.write()
+
 def _findlimit(repo, a, b):
     """
     Find the last revision that needs to be checked to ensure that a full
@@ -151,18 +414,9 @@ def _computeforwardmissing(a, b, match=None):
     mb = b.manifest()
     return mb.filesnotin(ma, match=match)
 
-def _forwardcopies(a, b, match=None):
-    '''find {dst@b: src@a} copy mapping where a is an ancestor of b'''
-
-    # check for working copy
-    w = None
-    if b.rev() is None:
-        w = b
-        b = w.p1()
-        if a == b:
-            # short-circuit to avoid issues with merge states
-            return _dirstatecopies(w)
-
+def _filelogforwardcopies(a, b, match):
+    """find the copies from a to b by tracing the ancestry of the files added
+    by b in their filelogs"""
     # files might have to be traced back to the fctx parent of the last
     # one-side-only changeset, but not further back than that
     limit = _findlimit(a._repo, a.rev(), b.rev())
@@ -194,12 +448,103 @@ def _forwardcopies(a, b, match=None):
         if ofctx:
             cm[f] = ofctx.path()
 
-    # combine copies from dirstate if necessary
-    if w is not None:
-        cm = _chain(a, w, cm, _dirstatecopies(w))
+    return cm
 
+def _changesetforwardcopies(a, b, match):
+    """find the copies from a to b by chaining the copies recorded by each
+    changeset in between, as stored in the copies index"""
+    if a.rev() == node.nullrev or a == b:
+        return {}
+    repo = a._repo
+    cl = repo.changelog
+    index = repo.copiesindex()
+    missingrevs = cl.findmissingrevs(common=[a.rev()], heads=[b.rev()])
+    children = {}
+    for r in missingrevs:
+        for p in cl.parentrevs(r):
+            if p != node.nullrev:
+                children.setdefault(p, []).append(r)
+    roots = set(children) - set(missingrevs)
+    # walk the changesets in revision order, with (rev, parent index, copies)
+    # items: copies are the copies from a to the parent of rev
+    work = [(r, 1, {}) for r in roots]
+    heapq.heapify(work)
+    cm = {}
+    while work:
+        r, i, cm = heapq.heappop(work)
+        if work and work[0][0] == r:
+            # both parents are known, the copies of the first one win
+            r, i, cm2 = heapq.heappop(work)
+            for dst, src in cm2.iteritems():
+                cm.setdefault(dst, src)
+        if r == b.rev():
+            break
+        childrevs = children[r]
+        for n, c in enumerate(childrevs):
+            p1copies, p2copies, removed = index.changesetcopies(c)
+            if r == cl.parentrevs(c)[0]:
+                parent, childcopies = 1, p1copies
+            else:
+                parent, childcopies = 2, p2copies
+            # the last child can take over the mapping
+            if n != len(childrevs) - 1:
+                newcopies = cm.copy()
+            else:
+                newcopies = cm
+            for dst, src in childcopies.iteritems():
+                newcopies[dst] = cm.get(src, src)
+            for f in removed:
+                newcopies.pop(f, None)
+            heapq.heappush(work, (c, parent, newcopies))
+
+    # as with the filelogs, only report the copies of files not in a, from
+    # files in a, which are still in b
+    for dst, src in cm.items():
+        if dst in a or src not in a or dst not in b:
+            del cm[dst]
+        elif match and not match(dst):
+            del cm[dst]
     return cm
 
+def _committedforwardcopies(a, b, match=None):
+    """like _forwardcopies(), but b.rev() cannot be None (working copy)"""
+    usecache = a._repo.ui.configbool('experimental', 'copies-cache')
+    if usecache:
+        if match and match.always():
+            match = None
+        cache = a._repo.copiescache()
+        cm = cache.get(a.node(), b.node())
+        if cm is not None:
+            # hand out a copy, callers may alter the mapping
+            if match:
+                return dict((k, v) for k, v in cm.iteritems() if match(k))
+            return cm.copy()
+
+    if a._repo.ui.configbool('experimental', 'copies-index'):
+        cm = _changesetforwardcopies(a, b, match)
+    else:
+        cm = _filelogforwardcopies(a, b, match)
+
+    # only complete mappings can answer queries with any matcher
+    if usecache and not match:
+        cache.set(a.node(), b.node(), cm.copy())
+
+    return cm
+
+def _forwardcopies(a, b, match=None):
+    '''find {dst@b: src@a} copy mapping where a is an ancestor of b'''
+
+    # check for working copy
+    if b.rev() is None:
+        if a == b.p1():
+            # short-circuit to avoid issues with merge states
+            return _dirstatecopies(b)
+
+        cm = _committedforwardcopies(a, b.p1(), match)
+        # combine copies from dirstate if necessary
+        return _chain(a, b, cm, _dirstatecopies(b))
+    return _committedforwardcopies(a, b, match)
+
 def _backwardrenames(a, b):
     if a._repo.ui.configbool('experimental', 'disablecopytrace'):
         return {}
@@ -47,8 +47,10 @@ from . import (
     localrepo,
     lock as lockmod,
     merge as mergemod,
+    obsindex,
     obsolete,
     obsutil,
+    persistentnodemap,
     phases,
     policy,
     pvec,
@@ -1344,6 +1346,43 @@ def debugnamecomplete(ui, repo, *args):
     ui.write('\n'.join(sorted(completions)))
     ui.write('\n')
 
+@command('debugnodemap', [], '')
+def debugnodemap(ui, repo):
+    '''show the state of the persistent nodemaps of the store'''
+    unfi = repo.unfiltered()
+    for rl in (unfi.changelog, unfi.manifestlog._revlog):
+        fname = rl.datafile[:-2] + '.n'
+        nm = persistentnodemap.read(repo.svfs, fname)
+        if nm is None:
+            ui.write(('%s: missing\n') % fname)
+            continue
+        ui.write(('%s: %d revisions (%d sorted, %d appended)\n')
+                 % (fname, nm.count, nm.sortedcount, nm.tailcount))
+        bad = nm.count > len(rl)
+        for r in xrange(min(nm.count, len(rl))):
+            if nm.get(rl.node(r)) != r:
+                bad = True
+                break
+        if bad:
+            ui.write(('%s: out of date\n') % fname)
+
+@command('debugobsindex', [], '')
+def debugobsindex(ui, repo):
+    '''show the state of the index of the obsolescence markers'''
+    idx = obsindex.read(repo.svfs)
+    if idx is None:
+        ui.write(('%s: missing\n') % obsindex.indexfile)
+        return
+    ui.write(('%s: %d entries (%d sorted, %d appended)\n')
+             % (obsindex.indexfile, idx.sortedcount + idx.tailcount,
+                idx.sortedcount, idx.tailcount))
+    data = repo.svfs.tryread('obsstore')
+    if not idx.valid(data):
+        ui.write(('%s: out of date\n') % obsindex.indexfile)
+    elif idx.size < len(data):
+        ui.write(('%s: %d bytes of obsstore not covered\n')
+                 % (obsindex.indexfile, len(data) - idx.size))
+
 @command('debugobsolete',
         [('', 'flags', 0, _('markers flag')),
          ('', 'record-parents', False,
@@ -12,6 +12,7 @@ import contextlib
 import errno
 import os
 import stat
+import threading
 
 from .i18n import _
 from .node import nullid
@@ -23,6 +24,7 @@ from . import (
     policy,
     pycompat,
     scmutil,
+    treedirstate,
     txnutil,
     util,
 )
@@ -54,6 +56,37 @@ def _getfsnow(vfs):
         os.close(tmpfd)
         vfs.unlink(tmpname)
 
+# minimum number of paths stat'ed by each thread
+_minthreadbatch = 64
+
+def _threadedmap(func, items, numthreads):
+    '''Return [func(item) for item in items], calling func from up to
+    numthreads threads.
+
+    This only helps with functions waiting on I/O without holding the GIL,
+    like lstat() and listdir().'''
+    numthreads = min(numthreads, len(items))
+    if numthreads <= 1:
+        return [func(item) for item in items]
+    results = [None] * len(items)
+    errors = []
+    def run(start):
+        try:
+            for i in xrange(start, len(items), numthreads):
+                results[i] = func(items[i])
+        except Exception as inst:
+            errors.append(inst)
+    threads = [threading.Thread(target=run, args=(n,))
+               for n in xrange(numthreads)]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return results
+
 def nonnormalentries(dmap):
     '''Compute the nonnormal dirstate entries from the dmap'''
     try:
@@ -70,12 +103,14 @@ def nonnormalentries(dmap):
 
 class dirstate(object):
 
-    def __init__(self, opener, ui, root, validate, sparsematchfn):
+    def __init__(self, opener, ui, root, validate, sparsematchfn,
+                 treeformat=False):
         '''Create a new dirstate object.
 
         opener is an open()-like callable that can be used to open the
         dirstate file; root is the root of the directory tracked by
-        the dirstate.
+        the dirstate. treeformat tells if the file uses the format of the
+        treedirstate module.
         '''
         self._opener = opener
         self._validate = validate
@@ -99,6 +134,13 @@ class dirstate(object):
         # for consistent view between _pl() and _read() invocations
         self._pendingmode = None
 
+        self._treeformat = treeformat
+        # with the tree format, the number of appended entries in the file
+        # and its stat when it was last read or written by this object, or
+        # None if changes cannot be appended to it
+        self._treeappended = 0
+        self._treestat = None
+
     @contextlib.contextmanager
     def parentchange(self):
         '''Context manager for handling dirstate parents.
@@ -220,8 +262,28 @@ class dirstate(object):
                 raise
             return "default"
 
+    @propertycache
+    def _treereader(self):
+        '''reader for the tree dirstate file, to look entries up without
+        loading the whole map'''
+        try:
+            fp = self._opendirstatefile()
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return None
+        try:
+            return treedirstate.read(fp)
+        finally:
+            fp.close()
+
     @propertycache
     def _pl(self):
+        if self._treeformat:
+            rd = self._treereader
+            if rd is None:
+                return [nullid, nullid]
+            return rd.parents[:20], rd.parents[20:]
         try:
             fp = self._opendirstatefile()
             st = fp.read(40)
@@ -256,6 +318,23 @@ class dirstate(object):
     def _slash(self):
         return self._ui.configbool('ui', 'slash') and pycompat.ossep != '/'
 
+    @propertycache
+    def _statthreads(self):
+        # experimental config: experimental.stat-threads
+        return self._ui.configint('experimental', 'stat-threads')
+
+    def _statfiles(self, files):
+        '''like util.statfiles, but from several threads when
+        experimental.stat-threads is set'''
+        numthreads = self._statthreads
+        if numthreads <= 1 or len(files) < 2 * _minthreadbatch:
+            return util.statfiles(files)
+        size = max(_minthreadbatch, len(files) // numthreads + 1)
+        batches = [files[i:i + size] for i in xrange(0, len(files), size)]
+        stats = _threadedmap(lambda b: list(util.statfiles(b)), batches,
+                             numthreads)
+        return [st for batch in stats for st in batch]
+
     @propertycache
     def _checklink(self):
         return util.checklink(self._root)
@@ -353,10 +432,22 @@ class dirstate(object):
           a  marked for addition
           ?  not tracked
         '''
-        return self._map.get(key, ("?",))[0]
+        return self._get(key, ("?",))[0]
 
     def __contains__(self, key):
-        return key in self._map
+        return self._get(key) is not None
+
+    def _get(self, key, default=None):
+        if self._treeformat and '_map' not in self.__dict__:
+            # only load the directory of key
+            rd = self._treereader
+            if rd is None:
+                return default
+            e = rd.get(key)
+            if e is None:
+                return default
+            return e
+        return self._map.get(key, default)
 
     def __iter__(self):
         for x in sorted(self._map):
@@ -448,6 +539,8 @@ class dirstate(object):
         # ignore HG_PENDING because identity is used only for writing
         self._identity = util.filestat.frompath(
             self._opener.join(self._filename))
+        if self._treeformat:
+            return self._readtree()
         try:
             fp = self._opendirstatefile()
             try:
@@ -491,6 +584,23 @@ class dirstate(object):
         if not self._dirtypl:
             self._pl = p
 
+    def _readtree(self):
+        self._treestat = None
+        rd = self._treereader
+        # the lookup reader is not needed anymore once the map is loaded
+        del self._treereader
+        if rd is None:
+            return
+        if util.safehasattr(parsers, 'dict_new_presized'):
+            self._map = parsers.dict_new_presized(rd.basecount)
+        # see _read about disabling the GC
+        util.nogc(rd.parse)(self._map, self._copymap)
+        if not self._dirtypl:
+            self._pl = rd.parents[:20], rd.parents[20:]
+        self._treeappended = rd.appendedcount
+        if not self._pendingmode and rd.size == len(rd._data):
+            self._treestat = self._identity
+
     def invalidate(self):
         '''Causes the next access to reread the dirstate.
 
@@ -501,7 +611,7 @@ class dirstate(object):
         for a in ("_map", "_copymap", "_identity",
                   "_filefoldmap", "_dirfoldmap", "_branch",
                   "_pl", "_dirs", "_ignore", "_nonnormalset",
-                  "_otherparentset"):
+                  "_otherparentset", "_treereader"):
             if a in self.__dict__:
                 delattr(self, a)
         self._lastnormaltime = 0
@@ -743,6 +853,7 @@ class dirstate(object):
         self._pl = [nullid, nullid]
         self._lastnormaltime = 0
         self._updatedfiles.clear()
+        self._treestat = None
         self._dirty = True
 
     def rebuild(self, parent, allfiles, changedfiles=None):
@@ -802,8 +913,15 @@ class dirstate(object):
                                 self._writedirstate, location='plain')
             return
 
+        if self._canappend():
+            self._appenddirstate()
+            return
+
         st = self._opener(filename, "w", atomictemp=True, checkambig=True)
         self._writedirstate(st)
+        if self._treeformat:
+            self._treestat = util.filestat.frompath(
+                self._opener.join(filename))
 
     def addparentchangecallback(self, category, callback):
         """add a callback to be called when the wd parents are changed
@@ -816,12 +934,56 @@ class dirstate(object):
         """
         self._plchangecallbacks[category] = callback
 
-    def _writedirstate(self, st):
+    def _notifyplchange(self):
         # notify callbacks about parents change
         if self._origpl is not None and self._origpl != self._pl:
             for c, callback in sorted(self._plchangecallbacks.iteritems()):
                 callback(self, self._origpl, self._pl)
             self._origpl = None
+
+    def _canappend(self):
+        '''tell if the changes can be appended to the tree dirstate file'''
+        if (not self._treeformat or self._treestat is None
+            or '_map' not in self.__dict__
+            or self._ui.configint('debug', 'dirstate.delaywrite', 0) > 0):
+            return False
+        if treedirstate.needscompaction(
+                self._treeappended + len(self._updatedfiles), len(self._map)):
+            return False
+        st = util.filestat.frompath(self._opener.join(self._filename))
+        # the file must be the one we know about, and must not be shared
+        # with a backup through a hardlink (see savebackup)
+        return st == self._treestat and st.stat.st_nlink == 1
+
+    def _appenddirstate(self):
+        '''append the changed entries to the tree dirstate file'''
+        self._notifyplchange()
+        # as in write with a transaction, emulate dropping the timestamp of
+        # the entries modified now
+        now = _getfsnow(self._opener)
+        dmap = self._map
+        for f in self._updatedfiles:
+            e = dmap.get(f)
+            if e is not None and e[0] == 'n' and e[3] == now:
+                dmap[f] = dirstatetuple(e[0], e[1], e[2], -1)
+                self._nonnormalset.add(f)
+
+        block = treedirstate.packblock(dmap, self._copymap, self._pl,
+                                       self._updatedfiles)
+        fp = self._opener(self._filename, 'ab')
+        try:
+            fp.write(block)
+        finally:
+            fp.close()
+        self._treeappended += len(self._updatedfiles)
+        self._treestat = util.filestat.frompath(
+            self._opener.join(self._filename))
+        self._updatedfiles.clear()
+        self._lastnormaltime = 0
+        self._dirty = self._dirtypl = False
+
+    def _writedirstate(self, st):
+        self._notifyplchange()
         # use the modification time of the newly created temporary file as the
         # filesystem's notion of 'now'
         now = util.fstat(st).st_mtime & _rangemask
@@ -843,7 +1005,15 @@ class dirstate(object):
                     now = end # trust our estimate that the end is near now
                     break
 
-        st.write(parsers.pack_dirstate(self._map, self._copymap, self._pl, now))
+        if self._treeformat:
+            st.write(treedirstate.pack(self._map, self._copymap, self._pl,
+                                       now))
+            self._treeappended = 0
+            self._treestat = None
+            self._updatedfiles.clear()
+        else:
+            st.write(parsers.pack_dirstate(self._map, self._copymap, self._pl,
+                                           now))
         self._nonnormalset, self._otherparentset = nonnormalentries(self._map)
         st.close()
         self._lastnormaltime = 0
@@ -1052,6 +1222,7 @@ class dirstate(object):
         dmap = self._map
         listdir = util.listdir
         lstat = os.lstat
+        statthreads = self._statthreads
         dirkind = stat.S_IFDIR
         regkind = stat.S_IFREG
         lnkkind = stat.S_IFLNK
@@ -1079,9 +1250,30 @@ class dirstate(object):
         work = [d for d in work if not dirignore(d[0])]
 
         # step 2: visit subdirectories
+        listings = {}
+        def prefetch(work):
+            # list the pending directories from several threads, traverse
+            # then consumes the listings
+            todo = [nd for nd in work
+                    if nd not in listings and match.visitdir(nd)]
+            def dolistdir(nd):
+                skip = None
+                if nd == '.':
+                    nd = ''
+                else:
+                    skip = '.hg'
+                try:
+                    return listdir(join(nd), stat=True, skip=skip)
+                except OSError as inst:
+                    return inst
+            listings.update(zip(todo, _threadedmap(dolistdir, todo,
+                                                   statthreads)))
+
         def traverse(work, alreadynormed):
             wadd = work.append
             while work:
+                if statthreads > 1 and work[-1] not in listings:
+                    prefetch(work)
                 nd = work.pop()
                 if not match.visitdir(nd):
                     continue
@@ -1091,7 +1283,11 @@ class dirstate(object):
                 else:
                     skip = '.hg'
                 try:
-                    entries = listdir(join(nd), stat=True, skip=skip)
+                    entries = listings.pop(nd or '.', None)
+                    if entries is None:
+                        entries = listdir(join(nd), stat=True, skip=skip)
+                    elif isinstance(entries, OSError):
+                        raise entries
                 except OSError as inst:
                     if inst.errno in (errno.EACCES, errno.ENOENT):
                         match.bad(self.pathto(nd), inst.strerror)
@@ -1180,7 +1376,7 @@ class dirstate(object):
                 # We may not have walked the full directory tree above,
                 # so stat and check everything we missed.
                 iv = iter(visit)
-                for st in util.statfiles([join(i) for i in visit]):
+                for st in self._statfiles([join(i) for i in visit]):
                     results[next(iv)] = st
         return results
 
@@ -22,6 +22,7 @@ from . import (
     discovery,
     error,
     lock as lockmod,
+    obsdiscovery,
     obsolete,
     phases,
     pushkey,
@@ -593,9 +594,20 @@ def _pushdiscoveryobsmarkers(pushop):
         and pushop.repo.obsstore
         and 'obsolete' in pushop.remote.listkeys('namespaces')):
         repo = pushop.repo
-        # very naive computation, that can be quite expensive on big repo.
-        # However: evolution is currently slow on them anyway.
-        nodes = (c.node() for c in repo.set('::%ln', pushop.futureheads))
+        if (obsdiscovery.enabled(repo)
+            and pushop.remote.capable('obshashrange')):
+            # only send the markers of the common changesets in the ranges
+            # differing on the remote
+            common = [c.node() for c in repo.set('heads(::%ln and ::%ln)',
+                                                 pushop.futureheads,
+                                                 pushop.outgoing.commonheads)]
+            prefixes = obsdiscovery.findranges(repo, pushop.remote, common)
+            nodes = obsdiscovery.nodesinranges(repo, common, prefixes)
+            nodes.extend(pushop.outgoing.missing)
+        else:
+            # very naive computation, that can be quite expensive on big repo.
+            # However: evolution is currently slow on them anyway.
+            nodes = (c.node() for c in repo.set('::%ln', pushop.futureheads))
         pushop.outobsmarkers = pushop.repo.obsstore.relevantmarkers(nodes)
 
 @pushdiscovery('bookmarks')
@@ -1348,16 +1360,20 @@ def _pullbundle2(pullop):
     For now, the only supported data are changegroup."""
     kwargs = {'bundlecaps': caps20to10(pullop.repo)}
 
-    # At the moment we don't do stream clones over bundle2. If that is
-    # implemented then here's where the check for that will go.
-    streaming = False
+    streaming = streamclone.canperformstreamclone(pullop)[0]
 
     # pulling changegroup
     pullop.stepsdone.add('changegroup')
 
     kwargs['common'] = pullop.common
     kwargs['heads'] = pullop.heads or pullop.rheads
-    kwargs['cg'] = pullop.fetch
+    if streaming:
+        # the stream replaces the changegroup and the obsolescence markers
+        kwargs['cg'] = False
+        kwargs['stream'] = True
+        pullop.stepsdone.add('obsmarkers')
+    else:
+        kwargs['cg'] = pullop.fetch
     if 'listkeys' in pullop.remotebundle2caps:
         kwargs['listkeys'] = ['phases']
         if pullop.remotebookmarks is None:
@@ -1382,11 +1398,19 @@ def _pullbundle2(pullop):
     else:
         if pullop.heads is None and list(pullop.common) == [nullid]:
             pullop.repo.ui.status(_("requesting all changes\n"))
-    if obsolete.isenabled(pullop.repo, obsolete.exchangeopt):
+    if (obsolete.isenabled(pullop.repo, obsolete.exchangeopt)
+        and not streaming):
         remoteversions = bundle2.obsmarkersversion(pullop.remotebundle2caps)
         if obsolete.commonversion(remoteversions) is not None:
             kwargs['obsmarkers'] = True
             pullop.stepsdone.add('obsmarkers')
+            if (obsdiscovery.enabled(pullop.repo)
+                and pullop.remote.capable('obshashrange')):
+                kwargs['obsrange'] = True
+                prefixes = obsdiscovery.findranges(pullop.repo, pullop.remote,
+                                                   pullop.common)
+                if prefixes:
+                    kwargs['obsprefixes'] = prefixes
     _pullbundle2extraprepare(pullop, kwargs)
     bundle = pullop.remote.getbundle('pull', **pycompat.strkwargs(kwargs))
     try:
@@ -1397,7 +1421,9 @@ def _pullbundle2(pullop):
     except error.BundleValueError as exc:
         raise error.Abort(_('missing support for %s') % exc)
 
-    if pullop.fetch:
+    if streaming:
+        pullop.cgresult = 1
+    elif pullop.fetch:
         pullop.cgresult = bundle2.combinechangegroupresults(op)
 
     # processing phases change
@@ -1616,6 +1642,29 @@ def getbundlechunks(repo, source, heads=None, common=None, bundlecaps=None,
 
     return bundler.getchunks()
 
+@getbundle2partsgenerator('stream2')
+def _getbundlestream2(bundler, repo, source, bundlecaps=None,
+                      b2caps=None, **kwargs):
+    """add a version 2 stream clone part to the requested bundle"""
+    if not kwargs.get('stream', False):
+        return
+    if not streamclone.allowservergeneration(repo):
+        raise error.Abort(_('stream data requested but server does not allow '
+                            'this feature'),
+                          hint=_('well-behaved clients should not be '
+                                 'requesting stream data from servers not '
+                                 'advertising it; the client may be buggy'))
+    # the client has no use for the obsstore without obsolescence enabled
+    includeobsmarkers = 'obsmarkers' in (b2caps or {})
+    filecount, bytecount, it = streamclone.generatev2(
+        repo, includeobsmarkers=includeobsmarkers)
+    requirements = repo.requirements & repo.supportedformats
+    part = bundler.newpart('stream2', data=it)
+    part.addparam('bytecount', '%d' % bytecount, mandatory=True)
+    part.addparam('filecount', '%d' % filecount, mandatory=True)
+    part.addparam('requirements', urlreq.quote(','.join(sorted(requirements))),
+                  mandatory=True)
+
 @getbundle2partsgenerator('changegroup')
 def _getbundlechangegrouppart(bundler, repo, source, bundlecaps=None,
                               b2caps=None, heads=None, common=None, **kwargs):
@@ -1662,7 +1711,19 @@ def _getbundleobsmarkerpart(bundler, repo, source, bundlecaps=None,
     if kwargs.get('obsmarkers', False):
         if heads is None:
             heads = repo.heads()
-        subset = [c.node() for c in repo.set('::%ln', heads)]
+        if kwargs.get('obsrange', False):
+            # the client already has the markers of the common changesets,
+            # but for the ranges found differing by the discovery
+            common = kwargs.get('common') or []
+            common = [n for n in common if repo.changelog.hasnode(n)]
+            common = [c.node() for c in repo.set('heads(::%ln and ::%ln)',
+                                                 heads, common)]
+            subset = [c.node() for c in repo.set('::%ln - ::%ln',
+                                                 heads, common)]
+            subset.extend(obsdiscovery.nodesinranges(
+                repo, common, kwargs.get('obsprefixes', [])))
+        else:
+            subset = [c.node() for c in repo.set('::%ln', heads)]
         markers = repo.obsstore.relevantmarkers(subset)
         markers = sorted(markers)
         bundle2.buildobsmarkerspart(bundler, markers)
@@ -0,0 +1,165 @@
+# getbundlecache.py - cache of the bundles sent in reply to getbundle
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""cache of the bundles sent in reply to getbundle requests
+
+Servers of many clients pulling the same changesets generate the same
+bundles over and over. With ``experimental.getbundlecache`` set to a size,
+the generated bundles are stored in ``.hg/cache/getbundle``, in files named
+after a hash of the request arguments and of the state of the repository.
+Later identical requests are answered from these files, without reading the
+revlogs. The least recently used files are removed once their total size
+goes over the configured size.
+
+The state of the repository is given by the size and modification time of
+the files defining the served changesets: changelog, phases, obsolescence
+markers, bookmarks, and what pins hidden changesets. The server
+configuration is part of the key too.
+
+Requests are not cached when outgoing hooks are configured, as they would
+not be run for the bundles served from the cache.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import os
+
+from . import (
+    util,
+)
+
+_cachedir = 'getbundle'
+
+# files defining the changesets served and their phases
+_storefiles = ('00changelog.i', 'phaseroots', 'obsstore')
+_repofiles = ('bookmarks', 'localtags', 'dirstate')
+
+def _maxsize(repo):
+    # experimental config: experimental.getbundlecache
+    return repo.ui.configbytes('experimental', 'getbundlecache')
+
+def _filestate(vfs, name):
+    try:
+        st = vfs.stat(name)
+    except OSError as inst:
+        if inst.errno != errno.ENOENT:
+            raise
+        return '-'
+    return '%d %r' % (st.st_size, st.st_mtime)
+
+def cachekey(repo, opts):
+    """return the key of the cached reply to a getbundle request, or None
+    if the reply should not be cached"""
+    if _maxsize(repo) <= 0:
+        return None
+    if not opts.get('cg', True) or opts.get('stream'):
+        return None
+    ui = repo.ui
+    for name, value in ui.configitems('hooks'):
+        if value and name.split('.', 1)[0] in ('preoutgoing', 'outgoing'):
+            return None
+
+    s = hashlib.sha1()
+    s.update('%s\0' % repo.filtername)
+    for name in _storefiles:
+        s.update('%s %s\0' % (name, _filestate(repo.svfs, name)))
+    for name in _repofiles:
+        s.update('%s %s\0' % (name, _filestate(repo.vfs, name)))
+    for k in sorted(opts):
+        v = opts[k]
+        if isinstance(v, (set, frozenset)):
+            v = sorted(v)
+        s.update('%s=%r\0' % (k, v))
+    for section, name, value in sorted(ui.walkconfig()):
+        s.update('%s.%s=%s\0' % (section, name, value))
+    return s.hexdigest()
+
+def _readchunks(fp):
+    try:
+        for chunk in util.filechunkiter(fp):
+            yield chunk
+    finally:
+        fp.close()
+
+def lookup(repo, key):
+    """return an iterator over the chunks of the cached reply, or None"""
+    path = '%s/%s' % (_cachedir, key)
+    try:
+        fp = repo.cachevfs(path, 'rb')
+    except IOError as inst:
+        if inst.errno != errno.ENOENT:
+            raise
+        return None
+    repo.ui.debug('sending cached bundle %s\n' % key)
+    try:
+        # keep track of the last use, for the eviction
+        os.utime(repo.cachevfs.join(path), None)
+    except OSError:
+        pass
+    return _readchunks(fp)
+
+def _evict(repo, maxsize, key):
+    """remove the least recently used files but the one of key, until the
+    cache fits maxsize"""
+    vfs = repo.cachevfs
+    entries = []
+    for name in vfs.listdir(_cachedir):
+        if name == key:
+            continue
+        try:
+            st = vfs.stat('%s/%s' % (_cachedir, name))
+        except OSError:
+            continue
+        entries.append((st.st_mtime, name, st.st_size))
+    total = sum(e[2] for e in entries) + vfs.stat(
+        '%s/%s' % (_cachedir, key)).st_size
+    for mtime, name, size in sorted(entries):
+        if total <= maxsize:
+            break
+        repo.ui.debug('removing cached bundle %s\n' % name)
+        vfs.tryunlink('%s/%s' % (_cachedir, name))
+        total -= size
+
+def store(repo, key, chunks):
+    """return an iterator over chunks, storing them in the cache once they
+    have all been consumed"""
+    maxsize = _maxsize(repo)
+    try:
+        fp = repo.cachevfs('%s/%s' % (_cachedir, key), 'wb', atomictemp=True)
+    except (IOError, OSError) as inst:
+        repo.ui.debug("couldn't write cached bundle %s: %s\n" % (key, inst))
+        for chunk in chunks:
+            yield chunk
+        return
+    size = 0
+    try:
+        for chunk in chunks:
+            if fp is not None:
+                size += len(chunk)
+                try:
+                    if size > maxsize:
+                        raise IOError(errno.EFBIG, 'bundle larger than cache')
+                    fp.write(chunk)
+                except (IOError, OSError) as inst:
+                    repo.ui.debug("couldn't write cached bundle %s: %s\n"
+                                  % (key, inst))
+                    fp.discard()
+                    fp = None
+            yield chunk
+        if fp is not None:
+            fp.close()
+            fp = None
+            try:
+                _evict(repo, maxsize, key)
+            except OSError as inst:
+                repo.ui.debug("couldn't evict cached bundles: %s\n" % inst)
+    finally:
+        # interrupted generation or transfer
+        if fp is not None:
+            fp.discard()
@@ -50,6 +50,7 @@ perms = {
     'getbundle': 'pull',
     'stream_out': 'pull',
     'listkeys': 'pull',
+    'obshashrange': 'pull',
     'unbundle': 'push',
     'pushkey': 'push',
 }
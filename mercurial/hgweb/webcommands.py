@@ -38,6 +38,7 @@ from .. import (
     smartset,
     templatefilters,
     templater,
+    textindex,
     util,
 )
 
@@ -199,6 +200,19 @@ def _search(web, req, tmpl):
 
         def revgen():
             cl = web.repo.changelog
+            candidates = None
+            for q in qw:
+                revs = textindex.candidates(web.repo, q)
+                if revs is not None:
+                    if candidates is None:
+                        candidates = revs
+                    else:
+                        candidates &= revs
+            if candidates is not None:
+                for r in sorted(candidates, reverse=True):
+                    if r in cl:
+                        yield web.repo[r]
+                return
             for i in xrange(len(web.repo) - 1, 0, -100):
                 l = []
                 for j in cl.revs(max(0, i - 99), i):
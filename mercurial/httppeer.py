@@ -12,7 +12,9 @@ import errno
 import os
 import socket
 import struct
+import sys
 import tempfile
+import threading
 
 from .i18n import _
 from .node import nullid
@@ -297,6 +299,44 @@ class httppeer(wireproto.wirepeer):
 
         return resp
 
+    def _submitbatch(self, req):
+        # experimental config: experimental.http.parallelrequests
+        parallel = self.ui.configint('experimental', 'http.parallelrequests')
+        if parallel <= 1 or len(req) <= 1:
+            return super(httppeer, self)._submitbatch(req)
+        return self._submitparallel(req, parallel)
+
+    def _submitparallel(self, req, parallel):
+        """run batch request <req> as up to <parallel> concurrent requests
+
+        The keepalive handler opens a connection per concurrent request.
+        Returns an iterator of the raw responses, in the order of <req>.
+        """
+        size = (len(req) + parallel - 1) // parallel
+        parts = [req[i:i + size] for i in xrange(0, len(req), size)]
+        results = [None] * len(parts)
+        errors = []
+
+        def submit(i):
+            try:
+                submit = super(httppeer, self)._submitbatch
+                results[i] = list(submit(parts[i]))
+            except Exception:
+                errors.append(sys.exc_info()[1])
+
+        threads = []
+        for i in xrange(1, len(parts)):
+            t = threading.Thread(target=submit, args=(i,),
+                                 name='httppeerbatch')
+            threads.append(t)
+            t.start()
+        submit(0)
+        for t in threads:
+            t.join()
+        if errors:
+            raise errors[0]
+        return iter([r for part in results for r in part])
+
     def _call(self, cmd, **args):
         fp = self._callstream(cmd, **args)
         try:
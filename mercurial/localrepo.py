@@ -29,6 +29,7 @@ from . import (
     changelog,
     color,
     context,
+    copies,
     dirstate,
     dirstateguard,
     encoding,
@@ -43,7 +44,9 @@ from . import (
     merge as mergemod,
     mergeutil,
     namespaces,
+    obsdiscovery,
     obsolete,
+    pathindex,
     pathutil,
     peer,
     phases,
@@ -57,6 +60,7 @@ from . import (
     store,
     subrepo,
     tags as tagsmod,
+    textindex,
     transaction,
     txnutil,
     util,
@@ -184,6 +188,9 @@ class localpeer(peer.peerrepository):
     def known(self, nodes):
         return self._repo.known(nodes)
 
+    def obshashrange(self, heads, prefixes):
+        return obsdiscovery.rangehashes(self._repo, heads, prefixes)
+
     def getbundle(self, source, heads=None, common=None, bundlecaps=None,
                   **kwargs):
         chunks = exchange.getbundlechunks(self._repo, source, heads=heads,
@@ -273,6 +280,10 @@ class locallegacypeer(localpeer):
 # clients.
 REVLOGV2_REQUIREMENT = 'exp-revlogv2.0'
 
+# The working directory state is stored in the format of the treedirstate
+# module.
+TREEDIRSTATE_REQUIREMENT = 'exp-treedirstate'
+
 class localrepository(object):
 
     supportedformats = {
@@ -289,6 +300,7 @@ class localrepository(object):
         'relshared',
         'dotencode',
         'exp-sparse',
+        TREEDIRSTATE_REQUIREMENT,
     }
     openerreqs = {
         'revlogv1',
@@ -447,6 +459,10 @@ class localrepository(object):
 
         self._branchcaches = {}
         self._revbranchcache = None
+        self._copiescache = None
+        self._copiesindex = None
+        self._pathindex = None
+        self._textindex = None
         self.filterpats = {}
         self._datafilters = {}
         self._transref = self._lockref = self._wlockref = None
@@ -543,12 +559,23 @@ class localrepository(object):
     def _writecaches(self):
         if self._revbranchcache:
             self._revbranchcache.write()
+        if self._copiescache:
+            self._copiescache.write()
+        if self._copiesindex:
+            self._copiesindex.write()
+        if self._pathindex:
+            self._pathindex.write()
+        if self._textindex:
+            self._textindex.write()
 
     def _restrictcapabilities(self, caps):
         if self.ui.configbool('experimental', 'bundle2-advertise'):
             caps = set(caps)
             capsblob = bundle2.encodecaps(bundle2.getrepocaps(self))
             caps.add('bundle2=' + urlreq.quote(capsblob))
+        if obsdiscovery.enabled(self):
+            caps = set(caps)
+            caps.add('obshashrange')
         return caps
 
     def _applyopenerreqs(self):
@@ -562,6 +589,10 @@ class localrepository(object):
         maxchainlen = self.ui.configint('format', 'maxchainlen')
         if maxchainlen is not None:
             self.svfs.options['maxchainlen'] = maxchainlen
+        # experimental config: format.maxchainspan
+        maxchainspan = self.ui.configbytes('format', 'maxchainspan')
+        if maxchainspan is not None:
+            self.svfs.options['maxchainspan'] = maxchainspan
         # experimental config: format.manifestcachesize
         manifestcachesize = self.ui.configint('format', 'manifestcachesize')
         if manifestcachesize is not None:
@@ -570,10 +601,31 @@ class localrepository(object):
         aggressivemergedeltas = self.ui.configbool('format',
                                                    'aggressivemergedeltas')
         self.svfs.options['aggressivemergedeltas'] = aggressivemergedeltas
+        # experimental config: format.exhaustivedeltasearch
+        exhaustivedeltasearch = self.ui.configbool('format',
+                                                   'exhaustivedeltasearch')
+        self.svfs.options['exhaustivedeltasearch'] = exhaustivedeltasearch
         self.svfs.options['lazydeltabase'] = not scmutil.gddeltaconfig(self.ui)
         chainspan = self.ui.configbytes('experimental', 'maxdeltachainspan', -1)
         if 0 <= chainspan:
             self.svfs.options['maxdeltachainspan'] = chainspan
+        # experimental config: experimental.mmapindexthreshold
+        mmapindexthreshold = self.ui.configbytes('experimental',
+                                                 'mmapindexthreshold')
+        if mmapindexthreshold is not None:
+            self.svfs.options['mmapindexthreshold'] = mmapindexthreshold
+        # experimental config: experimental.sparse-read
+        withsparseread = self.ui.configbool('experimental', 'sparse-read')
+        srdensitythres = float(self.ui.config('experimental',
+                                              'sparse-read.density-threshold'))
+        srmingapsize = self.ui.configbytes('experimental',
+                                           'sparse-read.min-gap-size')
+        self.svfs.options['with-sparse-read'] = withsparseread
+        self.svfs.options['sparse-read-density-threshold'] = srdensitythres
+        self.svfs.options['sparse-read-min-gap-size'] = srmingapsize
+        # experimental config: experimental.persistent-nodemap
+        if self.ui.configbool('experimental', 'persistent-nodemap'):
+            self.svfs.options['persistent-nodemap'] = True
 
         for r in self.requirements:
             if r.startswith('exp-compression-'):
@@ -689,8 +741,10 @@ class localrepository(object):
     def dirstate(self):
         sparsematchfn = lambda: sparse.matcher(self)
 
+        treeformat = TREEDIRSTATE_REQUIREMENT in self.requirements
         return dirstate.dirstate(self.vfs, self.ui, self.root,
-                                 self._dirstatevalidate, sparsematchfn)
+                                 self._dirstatevalidate, sparsematchfn,
+                                 treeformat=treeformat)
 
     def _dirstatevalidate(self, node):
         try:
@@ -920,6 +974,30 @@ class localrepository(object):
             self._revbranchcache = branchmap.revbranchcache(self.unfiltered())
         return self._revbranchcache
 
+    @unfilteredmethod
+    def copiescache(self):
+        if not self._copiescache:
+            self._copiescache = copies.copiescache(self.unfiltered())
+        return self._copiescache
+
+    @unfilteredmethod
+    def copiesindex(self):
+        if not self._copiesindex:
+            self._copiesindex = copies.copiesindex(self.unfiltered())
+        return self._copiesindex
+
+    @unfilteredmethod
+    def pathindex(self):
+        if not self._pathindex:
+            self._pathindex = pathindex.pathindex(self.unfiltered())
+        return self._pathindex
+
+    @unfilteredmethod
+    def textindex(self):
+        if not self._textindex:
+            self._textindex = textindex.textindex(self.unfiltered())
+        return self._textindex
+
     def branchtip(self, branch, ignoremissing=False):
         '''return the tip node for a given branch
 
@@ -1422,6 +1500,23 @@ class localrepository(object):
             self.ui.debug('updating the branch cache\n')
             branchmap.updatecache(self.filtered('served'))
 
+            # experimental config: experimental.copies-index
+            if self.ui.configbool('experimental', 'copies-index'):
+                self.ui.debug('updating the copies index\n')
+                if tr is None:
+                    revs = self.changelog.revs()
+                else:
+                    revs = tr.changes['revs']
+                self.copiesindex().update(revs)
+
+            if pathindex.enabled(self):
+                self.ui.debug('updating the path index\n')
+                self.pathindex().update()
+
+            if textindex.enabled(self):
+                self.ui.debug('updating the text index\n')
+                self.textindex().update()
+
     def invalidatecaches(self):
 
         if '_tagscache' in vars(self):
@@ -2259,4 +2354,8 @@ def newreporequirements(repo):
         requirements.discard('generaldelta')
         requirements.add(REVLOGV2_REQUIREMENT)
 
+    # experimental config: experimental.treedirstate
+    if ui.configbool('experimental', 'treedirstate'):
+        requirements.add(TREEDIRSTATE_REQUIREMENT)
+
     return requirements
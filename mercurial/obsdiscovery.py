@@ -0,0 +1,185 @@
+# obsdiscovery.py - discovery of the obsolescence markers to exchange
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""discovery of the obsolescence markers to exchange
+
+Without discovery, every pull or push sends all the markers relevant to the
+exchanged changesets, including the ones relevant to the changesets both
+sides already have. With ``experimental.evolution.obshashrange`` set on both
+sides, the markers relevant to the common changesets are only sent for the
+ranges of changesets where the two repositories differ.
+
+The changesets with relevant markers are sorted by node, which gives the
+same order on both sides. A range is the set of these changesets whose
+hexadecimal node starts with a given prefix, and is described by the hash of
+the relevant markers of its changesets and by their number. The client
+compares the ranges of both sides from the empty prefix, and splits the
+differing ranges in the 16 ranges one digit longer until they are small
+enough to be exchanged entirely, or until one side has no changeset in them.
+Each level of ranges takes one round trip, split in several requests when it
+has too many ranges. The ranges of the markers to exchange are merged into
+shorter prefixes once they get too many.
+"""
+
+from __future__ import absolute_import
+
+import bisect
+import hashlib
+
+from .i18n import _
+from .node import (
+    bin,
+    hex,
+)
+from . import (
+    error,
+    obsolete,
+)
+
+# number of changesets of a differing range under which the markers of the
+# whole range are exchanged
+_rangesize = 8
+
+# maximum number of ranges of a request
+_maxprefixes = 128
+
+_hexdigits = '0123456789abcdef'
+
+def enabled(repo):
+    """tell if the markers should be exchanged using range discovery"""
+    # experimental config: experimental.evolution.obshashrange
+    return (obsolete.isenabled(repo, obsolete.exchangeopt)
+            and repo.ui.configbool('experimental', 'evolution.obshashrange'))
+
+def _nodehash(obsstore, node):
+    markers = obsstore.relevantmarkers([node])
+    if not markers:
+        return None
+    s = hashlib.sha1()
+    for data in sorted(obsolete._fm1encodeonemarker(m) for m in markers):
+        s.update(data)
+    return s.digest()
+
+def _candidates(repo, heads):
+    """return the sorted hex nodes of the ancestors of heads having relevant
+    markers, and the hashes of their markers
+
+    The result for the last heads is cached, the server being queried for the
+    same heads at each round trip of a discovery."""
+    unfi = repo.unfiltered()
+    obsstore = unfi.obsstore
+    if not obsstore:
+        return [], []
+    key = frozenset(heads)
+    cached = obsstore.caches.get('obshashrange')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    result = _computecandidates(unfi, heads)
+    obsstore.caches['obshashrange'] = (key, result)
+    return result
+
+def _computecandidates(unfi, heads):
+    obsstore = unfi.obsstore
+    nodemap = unfi.changelog.nodemap
+    nodes = set(obsstore.precursors)
+    nodes.update(obsstore.children)
+    for node, markers in obsstore.successors.iteritems():
+        if any(not m[1] for m in markers):
+            nodes.add(node)
+    revs = [nodemap[n] for n in nodes if n in nodemap]
+    heads = [h for h in heads if h in nodemap]
+    if not revs or not heads:
+        return [], []
+    node = unfi.changelog.node
+    entries = []
+    for rev in unfi.revs('%ld and ::%ln', revs, heads):
+        n = node(rev)
+        h = _nodehash(obsstore, n)
+        if h is not None:
+            entries.append((hex(n), h))
+    entries.sort()
+    return [e[0] for e in entries], [e[1] for e in entries]
+
+def _range(hexnodes, prefix):
+    # 'g' sorts after all the hexadecimal digits
+    return (bisect.bisect_left(hexnodes, prefix),
+            bisect.bisect_left(hexnodes, prefix + 'g'))
+
+def _rangehash(hexnodes, hashes, prefix):
+    lo, hi = _range(hexnodes, prefix)
+    s = hashlib.sha1()
+    for i in xrange(lo, hi):
+        s.update(hexnodes[i])
+        s.update(hashes[i])
+    return s.digest(), hi - lo
+
+def _coarsen(prefixes, limit):
+    """return at most limit prefixes covering the given ones, which don't
+    overlap
+
+    >>> _coarsen(['a1', 'a2', 'b'], 3)
+    ['a1', 'a2', 'b']
+    >>> _coarsen(['a1', 'a2', 'b'], 2)
+    ['a', 'b']
+    >>> _coarsen(['a1', 'b23', 'c'], 2)
+    ['']
+    """
+    prefixes = set(prefixes)
+    while len(prefixes) > limit:
+        longest = max(len(p) for p in prefixes)
+        prefixes = set(p[:longest - 1] for p in prefixes)
+    return sorted(prefixes)
+
+def rangehashes(repo, heads, prefixes):
+    """return the (hash, count) of the ranges of the ancestors of heads
+    having relevant markers, for each node prefix"""
+    if len(prefixes) > _maxprefixes:
+        raise error.Abort(_('too many obsolescence marker ranges requested'))
+    hexnodes, hashes = _candidates(repo, heads)
+    return [_rangehash(hexnodes, hashes, p) for p in prefixes]
+
+def nodesinranges(repo, heads, prefixes):
+    """return the ancestors of heads having relevant markers, whose node
+    starts with one of prefixes"""
+    hexnodes = _candidates(repo, heads)[0]
+    nodes = []
+    for prefix in _coarsen(prefixes, _maxprefixes):
+        lo, hi = _range(hexnodes, prefix)
+        nodes.extend(bin(n) for n in hexnodes[lo:hi])
+    return nodes
+
+def findranges(repo, remote, heads):
+    """return the node prefixes of the ranges of the ancestors of heads
+    whose relevant markers differ between repo and remote
+
+    At most _maxprefixes prefixes are returned."""
+    hexnodes, hashes = _candidates(repo, heads)
+    differing = []
+    pending = ['']
+    roundtrips = requests = 0
+    while pending:
+        roundtrips += 1
+        nextpending = []
+        for i in xrange(0, len(pending), _maxprefixes):
+            requests += 1
+            prefixes = pending[i:i + _maxprefixes]
+            remoteranges = remote.obshashrange(heads, prefixes)
+            for prefix, (rhash, rcount) in zip(prefixes, remoteranges):
+                lhash, lcount = _rangehash(hexnodes, hashes, prefix)
+                if lhash == rhash:
+                    continue
+                if (lcount + rcount <= _rangesize or not lcount or not rcount
+                    or len(prefix) >= 40):
+                    # small enough, or entirely missing on one side
+                    differing.append(prefix)
+                else:
+                    nextpending.extend(prefix + d for d in _hexdigits)
+        pending = nextpending
+    repo.ui.debug('obsmarker discovery: %d differing ranges found in %d '
+                  'roundtrips (%d requests)\n'
+                  % (len(differing), roundtrips, requests))
+    return _coarsen(differing, _maxprefixes)
@@ -0,0 +1,250 @@
+# obsindex.py - on-disk index of the obsolescence markers
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""on-disk index of the markers of the obsstore file
+
+Answering any question about obsolescence markers requires parsing all the
+markers of the obsstore file, and building mappings from nodes to markers.
+This index maps nodes to the location of their markers in the obsstore, so
+the markers of a node can be read without parsing the others. The file is
+mapped in memory and searched in place.
+
+File format:
+
+  header: 4 bytes magic, 1 byte version, 3 bytes padding, 4 bytes number
+          of sorted entries, 4 bytes size of the obsstore covered by the
+          sorted entries, 20 bytes hash of the end of the covered data.
+  sorted block: entries sorted by node and kind.
+  appended blocks: 4 bytes magic, 4 bytes number of entries, 4 bytes size
+          of the obsstore covered, 20 bytes hash of the end of the covered
+          data, followed by the entries for the markers added to the
+          obsstore, in obsstore order.
+
+Each entry is a 20 bytes node, 1 byte kind, telling how the node relates to
+the marker, then the 4 bytes offset and 4 bytes length of the marker in the
+obsstore file. An incomplete block at the end of the file, from an
+interrupted write, is ignored.
+
+The index covers a prefix of the obsstore file. Markers written by clients
+not updating the index are parsed from the uncovered end of the obsstore.
+New entries are appended by later transactions and the whole file is
+rewritten once the appended entries get too many compared to the sorted
+ones.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import struct
+
+from . import (
+    util,
+)
+
+indexfile = 'obsindex'
+
+_magic = 'HGOI'
+_blockmagic = 'HGOB'
+_version = 1
+
+headerstruct = struct.Struct('>4sBxxxII20s')
+blockstruct = struct.Struct('>4sII20s')
+entrystruct = struct.Struct('>20scII')
+_headersize = headerstruct.size
+_entrysize = entrystruct.size
+
+# kinds of entries: the marker has the node as precursor, as successor or as
+# parent of its precursor.
+PRECURSOR = 'p'
+SUCCESSOR = 's'
+PARENT = 'c'
+
+# the file is rewritten as a single sorted block once more than this many
+# entries were appended and they are more than 1/_tailratio of the sorted
+# entries.
+_mintail = 1024
+_tailratio = 32
+
+# size of the end of the covered data checked against the obsstore
+hashedsize = 64
+
+def tailhash(data, size):
+    """hash of the end of the first size bytes of data"""
+    return hashlib.sha1(data[max(0, size - hashedsize):size]).digest()
+
+class obsindex(object):
+    """read-only view over the content of an obsstore index file"""
+
+    def __init__(self, data):
+        self._data = data
+        magic, version, sortedcount, size, hashed = headerstruct.unpack_from(
+            data)
+        if magic != _magic or version != _version:
+            raise ValueError('unknown obsindex format')
+        if len(data) < _headersize + sortedcount * _entrysize:
+            raise ValueError('truncated obsindex')
+        self.sortedcount = sortedcount
+        # size of the covered part of the obsstore
+        self.size = size
+        self._hashed = hashed
+        self._blocks = []
+        self.tailcount = 0
+        off = _headersize + sortedcount * _entrysize
+        while off + blockstruct.size <= len(data):
+            magic, count, size, hashed = blockstruct.unpack_from(data, off)
+            start = off + blockstruct.size
+            end = start + count * _entrysize
+            if magic != _blockmagic or end > len(data):
+                # interrupted append
+                break
+            self._blocks.append((start, count))
+            self.tailcount += count
+            self.size = size
+            self._hashed = hashed
+            off = end
+        # length of the valid content of the file
+        self.filesize = off
+        self._tail = None
+
+    def valid(self, data):
+        """tell if the index matches the content of the obsstore"""
+        return (self.size <= len(data)
+                and tailhash(data, self.size) == self._hashed)
+
+    def _entry(self, off):
+        return entrystruct.unpack_from(self._data, off)
+
+    def _tailentries(self):
+        """return a dictionary (node, kind) -> [(offset, length)] of the
+        appended entries"""
+        if self._tail is None:
+            tail = {}
+            for start, count in self._blocks:
+                for i in xrange(count):
+                    node, kind, offset, length = self._entry(
+                        start + i * _entrysize)
+                    tail.setdefault((node, kind), []).append((offset, length))
+            self._tail = tail
+        return self._tail
+
+    def _lowerbound(self, key):
+        """offset of the first sorted entry whose node and kind are >= key"""
+        data = self._data
+        lo = 0
+        hi = self.sortedcount
+        klen = len(key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = _headersize + mid * _entrysize
+            if data[off:off + klen] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return _headersize + lo * _entrysize
+
+    def lookup(self, node, kind):
+        """return the (offset, length) of the markers related to node by kind
+        """
+        end = _headersize + self.sortedcount * _entrysize
+        off = self._lowerbound(node + kind)
+        spans = []
+        while off < end:
+            n, k, offset, length = self._entry(off)
+            if n != node or k != kind:
+                break
+            spans.append((offset, length))
+            off += _entrysize
+        spans.extend(self._tailentries().get((node, kind), ()))
+        return spans
+
+    def has(self, node, kind):
+        """tell if markers are related to node by kind"""
+        off = self._lowerbound(node + kind)
+        if off < _headersize + self.sortedcount * _entrysize:
+            n, k = self._entry(off)[:2]
+            if n == node and k == kind:
+                return True
+        return (node, kind) in self._tailentries()
+
+    def nodes(self, kind):
+        """return the set of nodes related to markers by kind"""
+        nodes = set()
+        for off in xrange(_headersize,
+                          _headersize + self.sortedcount * _entrysize,
+                          _entrysize):
+            n, k = self._entry(off)[:2]
+            if k == kind:
+                nodes.add(n)
+        nodes.update(n for n, k in self._tailentries() if k == kind)
+        return nodes
+
+    def entries(self):
+        """return the list of all the entries"""
+        end = _headersize + self.sortedcount * _entrysize
+        entries = [self._entry(off)
+                   for off in xrange(_headersize, end, _entrysize)]
+        for start, count in self._blocks:
+            entries.extend(self._entry(start + i * _entrysize)
+                           for i in xrange(count))
+        return entries
+
+def read(opener):
+    """return the obsstore index, or None if it is missing or unusable"""
+    try:
+        fp = opener(indexfile)
+    except IOError as inst:
+        if inst.errno != errno.ENOENT:
+            raise
+        return None
+    try:
+        try:
+            data = util.mmapread(fp)
+        except (ValueError, EnvironmentError):
+            data = fp.read()
+    finally:
+        fp.close()
+    if len(data) < _headersize:
+        return None
+    try:
+        return obsindex(data)
+    except (ValueError, struct.error):
+        return None
+
+def _packentries(entries):
+    pack = entrystruct.pack
+    return ''.join(pack(*e) for e in entries)
+
+def write(opener, entries, size, hashed):
+    """write an index made of entries, covering size bytes of the obsstore"""
+    entries = sorted(entries)
+    fp = opener(indexfile, 'w', atomictemp=True)
+    try:
+        fp.write(headerstruct.pack(_magic, _version, len(entries), size,
+                                   hashed))
+        fp.write(_packentries(entries))
+    finally:
+        fp.close()
+
+def needsrewrite(idx, count):
+    """tell if count more appended entries would make the tail of the index
+    too long"""
+    tail = idx.tailcount + count
+    return tail > _mintail and tail * _tailratio > idx.sortedcount
+
+def append(opener, idx, entries, size, hashed, tr):
+    """append entries covering the obsstore up to size to a valid index
+
+    The appended block is truncated if the transaction is rolled back."""
+    tr.add(indexfile, idx.filesize)
+    fp = opener(indexfile, 'r+b')
+    try:
+        fp.seek(idx.filesize)
+        fp.write(blockstruct.pack(_blockmagic, len(entries), size, hashed))
+        fp.write(_packentries(entries))
+    finally:
+        fp.close()
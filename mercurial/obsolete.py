@@ -76,6 +76,7 @@ from .i18n import _
 from . import (
     error,
     node,
+    obsindex,
     obsutil,
     phases,
     policy,
@@ -432,11 +433,28 @@ def _fm1readmarkers(data, off, stop):
         return _fm1purereadmarkers(data, off, stop)
     return native(data, off, stop)
 
+def _fm0markerspans(data, off, stop):
+    while off < stop:
+        numsuc, mdsize = _unpack('>BI', data[off:off + 5])
+        length = _fm0fsize + numsuc * _fm0fnodesize + mdsize
+        yield off, length
+        off += length
+
+def _fm1markerspans(data, off, stop):
+    while off < stop:
+        length = _unpack('>I', data[off:off + 4])[0]
+        yield off, length
+        off += length
+
 # mapping to read/write various marker formats
 # <version> -> (decoder, encoder)
 formats = {_fm0version: (_fm0readmarkers, _fm0encodeonemarker),
            _fm1version: (_fm1readmarkers, _fm1encodeonemarker)}
 
+# <version> -> function yielding the (offset, length) of the encoded markers
+_markerspans = {_fm0version: _fm0markerspans,
+                _fm1version: _fm1markerspans}
+
 def _readmarkerversion(data):
     return _unpack('>B', data[0:1])[0]
 
@@ -484,6 +502,85 @@ def _addchildren(children, markers):
             for p in parents:
                 children.setdefault(p, set()).add(mark)
 
+def _indexentries(spans, markers):
+    """return the obsstore index entries of markers, stored at spans, or
+    None if they cannot be indexed"""
+    entries = []
+    for (offset, length), mark in zip(spans, markers):
+        related = [(mark[0], obsindex.PRECURSOR)]
+        related.extend((suc, obsindex.SUCCESSOR) for suc in mark[1])
+        if mark[5] is not None:
+            related.extend((p, obsindex.PARENT) for p in mark[5])
+        for n, kind in related:
+            if len(n) != 20:
+                return None
+            entries.append((n, kind, offset, length))
+    return entries
+
+class _indexedmarkers(object):
+    """mapping of nodes to sets of markers, read from the obsstore through
+    its index on first access
+
+    It stands for the dictionaries of the obsstore built by parsing all the
+    markers. Iterating over it still requires reading the whole index."""
+
+    def __init__(self, store, index, kind, addmarkers):
+        self._store = store
+        self._index = index
+        self._kind = kind
+        self._map = {}
+        # markers not covered by the index
+        addmarkers(self, store._unindexedmarkers(index))
+
+    def _lookup(self, node):
+        markers = self._map.get(node)
+        if markers is None:
+            markers = self._store._readindexed(self._index, node,
+                                               self._kind)
+            self._map[node] = markers
+        return markers
+
+    def get(self, node, default=None):
+        return self._lookup(node) or default
+
+    def __getitem__(self, node):
+        markers = self._lookup(node)
+        if not markers:
+            raise KeyError(node)
+        return markers
+
+    def __contains__(self, node):
+        markers = self._map.get(node)
+        if markers is not None:
+            return bool(markers)
+        return self._index.has(node, self._kind)
+
+    def setdefault(self, node, default):
+        # the set read from the index is kept, even when empty
+        return self._lookup(node)
+
+    def keys(self):
+        nodes = self._index.nodes(self._kind)
+        for node, markers in self._map.iteritems():
+            if markers:
+                nodes.add(node)
+            else:
+                nodes.discard(node)
+        return list(nodes)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def iteritems(self):
+        for node in self.keys():
+            yield node, self._lookup(node)
+
+    def items(self):
+        return list(self.iteritems())
+
 def _checkinvalidmarkers(markers):
     """search for marker with invalid data and raise error if needed
 
@@ -513,12 +610,15 @@ class obsstore(object):
     # parents: (tuple of nodeid) or None, parents of precursors
     #          None is used when no data has been recorded
 
-    def __init__(self, svfs, defaultformat=_fm1version, readonly=False):
+    def __init__(self, svfs, defaultformat=_fm1version, readonly=False,
+                 index=False):
         # caches for various obsolescence related cache
         self.caches = {}
         self.svfs = svfs
         self._defaultformat = defaultformat
         self._readonly = readonly
+        # maintain and use the on-disk index of the markers
+        self._useindex = index
 
     def __iter__(self):
         return iter(self._all)
@@ -616,6 +716,8 @@ class obsstore(object):
             addedmarkers = transaction.changes.get('obsmarkers')
             if addedmarkers is not None:
                 addedmarkers.update(new)
+            if self._useindex:
+                self._updateindex(transaction, offset, new, data)
             self._addmarkers(new, data)
             # new marker *may* have changed several set. invalidate the cache.
             self.caches.clear()
@@ -633,8 +735,79 @@ class obsstore(object):
 
     @propertycache
     def _data(self):
+        # not mapped, even with the index: the transaction truncates the file
+        # in place on rollback. Only the markers the index points to are
+        # parsed.
         return self.svfs.tryread('obsstore')
 
+    @propertycache
+    def _index(self):
+        """the index of the markers of the obsstore file, or None"""
+        if not self._useindex:
+            return None
+        idx = obsindex.read(self.svfs)
+        if idx is None or not idx.valid(self._data):
+            return None
+        return idx
+
+    def _readindexed(self, index, node, kind):
+        """read the markers related to node by kind through an index"""
+        data = self._data
+        markers = set()
+        for offset, length in index.lookup(node, kind):
+            markers.update(_readmarkers(data, offset, offset + length)[1])
+        _checkinvalidmarkers(markers)
+        return markers
+
+    def _unindexedmarkers(self, index):
+        """return the markers of the end of the obsstore file not covered by
+        an index"""
+        data = self._data
+        size = index.size
+        if size >= len(data):
+            return []
+        markers = list(_readmarkers(data, size, len(data))[1])
+        _checkinvalidmarkers(markers)
+        return markers
+
+    def _indexed(self):
+        """tell if the lookups should go through the index"""
+        return self._index is not None and not self._cached('_all')
+
+    def _updateindex(self, transaction, offset, markers, rawdata):
+        """update the index for markers, just written at offset"""
+        version = self._version
+        start = 1 if offset == 0 else 0
+        spans = [(off + offset, length) for off, length
+                 in _markerspans[version](rawdata, start, len(rawdata))]
+        entries = _indexentries(spans, markers)
+        if entries is None:
+            return
+        size = offset + len(rawdata)
+        idx = self._index
+        if idx is not None and idx.size == offset:
+            tail = self._data[max(0, offset - obsindex.hashedsize):offset]
+            tail += rawdata
+            hashed = obsindex.tailhash(tail, len(tail))
+            if not obsindex.needsrewrite(idx, len(entries)):
+                obsindex.append(self.svfs, idx, entries, size, hashed,
+                                transaction)
+            else:
+                entries.extend(idx.entries())
+                obsindex.write(self.svfs, entries, size, hashed)
+        else:
+            data = self.svfs.read('obsstore')
+            hashed = obsindex.tailhash(data, size)
+            spans = list(_markerspans[version](data, 1, size))
+            markers = _readmarkers(data, 1, size)[1]
+            entries = _indexentries(spans, markers)
+            if entries is None:
+                return
+            obsindex.write(self.svfs, entries, size, hashed)
+        # read again on next use, the lookup mappings already built keep
+        # the previous index and are updated by _addmarkers
+        self.__dict__.pop('_index', None)
+
     @propertycache
     def _version(self):
         if len(self._data) >= 1:
@@ -654,18 +827,27 @@ class obsstore(object):
 
     @propertycache
     def successors(self):
+        if self._indexed():
+            return _indexedmarkers(self, self._index, obsindex.PRECURSOR,
+                                   _addsuccessors)
         successors = {}
         _addsuccessors(successors, self._all)
         return successors
 
     @propertycache
     def precursors(self):
+        if self._indexed():
+            return _indexedmarkers(self, self._index, obsindex.SUCCESSOR,
+                                   _addprecursors)
         precursors = {}
         _addprecursors(precursors, self._all)
         return precursors
 
     @propertycache
     def children(self):
+        if self._indexed():
+            return _indexedmarkers(self, self._index, obsindex.PARENT,
+                                   _addchildren)
         children = {}
         _addchildren(children, self._all)
         return children
@@ -675,8 +857,15 @@ class obsstore(object):
 
     def _addmarkers(self, markers, rawdata):
         markers = list(markers) # to allow repeated iteration
-        self._data = self._data + rawdata
-        self._all.extend(markers)
+        if self._useindex:
+            # the markers are only parsed if they were already
+            if self._cached('_data'):
+                self._data = self._data + rawdata
+            if self._cached('_all'):
+                self._all.extend(markers)
+        else:
+            self._data = self._data + rawdata
+            self._all.extend(markers)
         if self._cached('successors'):
             _addsuccessors(self.successors, markers)
         if self._cached('precursors'):
@@ -727,7 +916,9 @@ def makestore(ui, repo):
     if defaultformat is not None:
         kwargs['defaultformat'] = defaultformat
     readonly = not isenabled(repo, createmarkersopt)
-    store = obsstore(repo.svfs, readonly=readonly, **kwargs)
+    # experimental config: experimental.obsstore-index
+    index = ui.configbool('experimental', 'obsstore-index')
+    store = obsstore(repo.svfs, readonly=readonly, index=index, **kwargs)
     if store and readonly:
         ui.warn(_('obsolete feature not enabled but %i markers found!\n')
                 % len(list(store)))
@@ -0,0 +1,70 @@
+# pathindex.py - index of the changesets touching each directory
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""persistent index of the changesets touching the files of each directory
+
+Finding the changesets touching the files below a directory requires reading
+the list of files of every changeset from the changelog. With
+``experimental.path-index`` set, ``.hg/cache/pathindex-v1`` records for each
+directory, and for each file at the root of the repository, the revisions of
+the changesets touching a file below it. The history queries on paths
+(``hg log DIR``, ``file()``, ``filelog()``) then only read the changesets
+listed for the queried paths.
+
+The file has the format of the other indexes of revisions by key, see
+revindex.
+"""
+
+from __future__ import absolute_import
+
+from . import (
+    revindex,
+    util,
+)
+
+def enabled(repo):
+    # experimental config: experimental.path-index
+    return repo.ui.configbool('experimental', 'path-index')
+
+def _keys(cl, rev):
+    keys = set()
+    for f in cl.readfiles(rev):
+        if '/' in f:
+            keys.update(util.finddirs(f))
+        else:
+            keys.add(f)
+    return keys
+
+def pathindex(repo):
+    """return the index of the revisions touching the files below each
+    directory of the unfiltered repository repo"""
+    return revindex.revindex(repo, 'pathindex-v1', 'HGPI', _keys)
+
+def candidates(repo, files):
+    """return the set of revisions which may touch the given files or files
+    below the given directories, or None if the index can't tell"""
+    if not enabled(repo):
+        return None
+    index = repo.pathindex()
+    index.update()
+    revs = set()
+    for f in files:
+        if f in ('', '.'):
+            return None
+        revs.update(index.revs(f))
+        dirname = f.rpartition('/')[0]
+        if dirname:
+            # f may be a file
+            revs.update(index.revs(dirname))
+    return revs
+
+def matchcandidates(repo, match):
+    """return the set of revisions which may touch a file matched by match,
+    or None if the index can't tell"""
+    if match.always() or not (match.isexact() or match.prefix()):
+        return None
+    return candidates(repo, match.files())
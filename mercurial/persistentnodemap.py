@@ -0,0 +1,200 @@
+# persistentnodemap.py - on-disk node to revision mapping for revlogs
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""persistent node -> revision mapping stored next to a revlog
+
+Building the node -> rev mapping of a large revlog requires a walk over
+the whole index. Short-lived processes usually only look up a handful of
+nodes, so the mapping is kept on disk, in a file mapped in memory and
+searched in place.
+
+File format:
+
+  header: 4 bytes magic, 1 byte version, 3 bytes padding, 4 bytes
+          number of sorted entries, 20 bytes node of the last sorted
+          revision.
+  sorted block: one entry per revision, sorted by node.
+  tail: entries for revisions added after the sorted block was written,
+        in revision order.
+
+Each entry is a 20 bytes node followed by a 4 bytes revision number.
+
+The file only ever covers a prefix of the revlog. New revisions are
+appended to the tail and the whole file is rewritten once the tail grows
+too large compared to the sorted block.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import struct
+
+from . import (
+    util,
+)
+
+_magic = 'HGNM'
+_version = 1
+
+headerstruct = struct.Struct('>4sBxxxI20s')
+entrystruct = struct.Struct('>20sI')
+_headersize = headerstruct.size
+_entrysize = entrystruct.size
+
+# the file is rewritten as a single sorted block once the tail holds more
+# than this many entries and more than 1/_tailratio of the sorted entries.
+_mintail = 1024
+_tailratio = 32
+
+class nodemap(object):
+    """read-only view over the content of a nodemap file"""
+
+    def __init__(self, data):
+        self._data = data
+        magic, version, sortedcount, sortedtip = headerstruct.unpack_from(data)
+        if magic != _magic or version != _version:
+            raise ValueError('unknown nodemap format')
+        total, extra = divmod(len(data) - _headersize, _entrysize)
+        if extra or total < sortedcount:
+            raise ValueError('truncated nodemap')
+        self.sortedcount = sortedcount
+        # number of revisions covered by this map, revisions 0 to count - 1
+        self.count = total
+        if total > sortedcount:
+            self.lastnode = self._entry(total - 1)[0]
+        else:
+            self.lastnode = sortedtip
+
+    @property
+    def tailcount(self):
+        return self.count - self.sortedcount
+
+    def _entry(self, idx):
+        return entrystruct.unpack_from(self._data,
+                                       _headersize + idx * _entrysize)
+
+    def _lowerbound(self, key):
+        """index of the first sorted entry whose node is >= key"""
+        data = self._data
+        lo = 0
+        hi = self.sortedcount
+        klen = len(key)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = _headersize + mid * _entrysize
+            if data[off:off + klen] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def get(self, node):
+        """return the revision of a node, or None if it is not covered"""
+        idx = self._lowerbound(node)
+        if idx < self.sortedcount:
+            n, rev = self._entry(idx)
+            if n == node:
+                return rev
+        # the tail is not sorted but is small, look for an aligned match
+        data = self._data
+        start = _headersize + self.sortedcount * _entrysize
+        pos = data.find(node, start)
+        while pos != -1:
+            if not (pos - start) % _entrysize:
+                return self._entry((pos - _headersize) // _entrysize)[1]
+            pos = data.find(node, pos + 1)
+        return None
+
+    def prefixmatch(self, prefix):
+        """return the list of covered nodes starting with a binary prefix"""
+        nodes = []
+        idx = self._lowerbound(prefix)
+        while idx < self.sortedcount:
+            n = self._entry(idx)[0]
+            if not n.startswith(prefix):
+                break
+            nodes.append(n)
+            idx += 1
+        for idx in xrange(self.sortedcount, self.count):
+            n = self._entry(idx)[0]
+            if n.startswith(prefix):
+                nodes.append(n)
+        return nodes
+
+def read(opener, filename):
+    """return a nodemap for the given file, or None if it is unusable"""
+    try:
+        fp = opener(filename)
+    except IOError as inst:
+        if inst.errno != errno.ENOENT:
+            raise
+        return None
+    try:
+        try:
+            data = util.mmapread(fp)
+        except (ValueError, EnvironmentError):
+            data = fp.read()
+    finally:
+        fp.close()
+    if len(data) < _headersize:
+        return None
+    try:
+        return nodemap(data)
+    except (ValueError, struct.error):
+        return None
+
+def _serializeentries(index, start, stop):
+    pack = entrystruct.pack
+    return ''.join(pack(index[r][7], r) for r in xrange(start, stop))
+
+def serialize(index, count):
+    """return the full content of a nodemap covering revisions < count"""
+    pack = entrystruct.pack
+    entries = sorted((index[r][7], r) for r in xrange(count))
+    tip = index[count - 1][7] if count else '\0' * 20
+    header = headerstruct.pack(_magic, _version, count, tip)
+    return header + ''.join(pack(n, r) for n, r in entries)
+
+def needsrewrite(nm, count):
+    """tell if the tail of a nodemap covering count revisions would be too
+    long to keep appending to it"""
+    tail = count - nm.sortedcount
+    return tail > _mintail and tail * _tailratio > nm.sortedcount
+
+def update(opener, filename, nm, index, count, tr):
+    """write the nodemap of the revisions < count of an index
+
+    ``nm`` is the currently valid nodemap for the file, if any. New entries
+    are appended to it when possible (registered in the transaction so they
+    are truncated on rollback), the file is rewritten otherwise.
+    """
+    if (nm is not None and nm.count <= count
+        and not needsrewrite(nm, count)):
+        if nm.count == count:
+            return
+        size = _headersize + nm.count * _entrysize
+        tr.add(filename, size)
+        fp = opener(filename, 'r+b')
+        try:
+            fp.seek(size)
+            fp.write(_serializeentries(index, nm.count, count))
+        finally:
+            fp.close()
+        return
+    fp = opener(filename, 'w', atomictemp=True)
+    try:
+        fp.write(serialize(index, count))
+    finally:
+        fp.close()
+
+def stripoffset(nm, rev):
+    """file offset to truncate a nodemap to when stripping revisions >= rev
+    """
+    if rev < nm.sortedcount:
+        # the sorted block is invalidated, the map must be rebuilt
+        return 0
+    return _headersize + min(rev, nm.count) * _entrysize
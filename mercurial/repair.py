@@ -19,6 +19,7 @@ from . import (
     discovery,
     error,
     exchange,
+    obsindex,
     obsolete,
     obsutil,
     util,
@@ -430,4 +431,6 @@ def deleteobsmarkers(obsstore, indices):
     for bytes in obsolete.encodemarkers(left, True, obsstore._version):
         newobsstorefile.write(bytes)
     newobsstorefile.close()
+    # the offsets of the markers changed
+    obsstore.svfs.tryunlink(obsindex.indexfile)
     return n
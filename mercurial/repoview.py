@@ -9,12 +9,17 @@
 from __future__ import absolute_import
 
 import copy
+import errno
+import hashlib
+import struct
 
 from .node import nullrev
 from . import (
+    error,
     obsolete,
     phases,
     tags as tagsmod,
+    util,
 )
 
 def hideablerevs(repo):
@@ -63,15 +68,12 @@ def _revealancestors(pfunc, hidden, revs):
                 hidden.remove(p)
                 stack.append(p)
 
-def computehidden(repo):
-    """compute the set of hidden revision to filter
-
-    During most operation hidden should be filtered."""
-    assert not repo.changelog.filteredrevs
-
-    hidden = hideablerevs(repo)
+def _hidden(repo, hideable, pinned):
+    """return the hideable revisions which are not pinned and not ancestors
+    of visible mutable revisions"""
+    hidden = hideable
     if hidden:
-        hidden = set(hidden - pinnedrevs(repo))
+        hidden = set(hidden - pinned)
         pfunc = repo.changelog.parentrevs
         mutablephases = (phases.draft, phases.secret)
         mutable = repo._phasecache.getrevset(repo, mutablephases)
@@ -80,13 +82,18 @@ def computehidden(repo):
         _revealancestors(pfunc, hidden, visible)
     return frozenset(hidden)
 
-def computeunserved(repo):
-    """compute the set of revision that should be filtered when used a server
+def computehidden(repo):
+    """compute the set of hidden revision to filter
 
-    Secret and hidden changeset should not pretend to be here."""
+    During most operation hidden should be filtered."""
     assert not repo.changelog.filteredrevs
-    # fast path in simple case to avoid impact of non optimised code
-    hiddens = filterrevs(repo, 'visible')
+
+    hidden = hideablerevs(repo)
+    if hidden:
+        hidden = _hidden(repo, hidden, pinnedrevs(repo))
+    return frozenset(hidden)
+
+def _unserved(repo, hiddens):
     if phases.hassecret(repo):
         cl = repo.changelog
         secret = phases.secret
@@ -98,6 +105,15 @@ def computeunserved(repo):
     else:
         return hiddens
 
+def computeunserved(repo):
+    """compute the set of revision that should be filtered when used a server
+
+    Secret and hidden changeset should not pretend to be here."""
+    assert not repo.changelog.filteredrevs
+    # fast path in simple case to avoid impact of non optimised code
+    hiddens = filterrevs(repo, 'visible')
+    return _unserved(repo, hiddens)
+
 def computemutable(repo):
     """compute the set of revision that should be filtered when used a server
 
@@ -146,11 +162,197 @@ filtertable = {'visible': computehidden,
                'immutable':  computemutable,
                'base':  computeimpactable}
 
+# Cache of the revisions filtered by 'visible' and 'served'
+#
+# Computing the hidden revisions requires parsing all the obsolescence
+# markers, which every command filtering the repository pays for. With
+# experimental.hidden-cache set, the 'visible' and 'served' filters are
+# stored in .hg/cache with the state of the repository they were computed
+# for: tip of the changelog, size and end of the obsstore file, phase roots
+# and pinned revisions. When only changesets or markers were appended since,
+# the obsolete revisions are updated from the new ones only.
+#
+# The cache bypasses hideablerevs() when it is valid, so it should not be
+# used with extensions changing the hideable revisions.
+#
+# File format: header, then the obsolete, hidden and unserved revisions as
+# 4 bytes integers.
+
+_hiddencachefile = 'hidden-v1'
+# tip rev, tip node, obsstore size, hash of the end of the obsstore, hash of
+# the phase roots, hash of the pinned revisions and number of obsolete,
+# hidden and unserved revisions
+_hiddenheader = struct.Struct('>i20sI20s20s20sIII')
+# size of the end of the obsstore hashed to check it was only appended to
+_obshashedsize = 64
+
+def _usehiddencache(repo):
+    # experimental config: experimental.hidden-cache
+    return repo.ui.configbool('experimental', 'hidden-cache')
+
+def _obsstorehash(fp, size):
+    fp.seek(max(0, size - _obshashedsize))
+    return hashlib.sha1(fp.read(min(size, _obshashedsize))).digest()
+
+def _phasehash(repo):
+    s = hashlib.sha1()
+    for roots in repo._phasecache.phaseroots:
+        s.update(''.join(sorted(roots)))
+        s.update('\0')
+    return s.digest()
+
+def _pinnedhash(pinned):
+    return hashlib.sha1(' '.join('%d' % r for r in sorted(pinned))).digest()
+
+class hiddencache(object):
+    """revisions filtered by 'visible' and 'served', with the state of the
+    repository they were computed for"""
+
+    def __init__(self, tiprev, tipnode, obssize, obshash, phasehash,
+                 pinnedhash, obsolete, hidden, unserved):
+        self.tiprev = tiprev
+        self.tipnode = tipnode
+        self.obssize = obssize
+        self.obshash = obshash
+        self.phasehash = phasehash
+        self.pinnedhash = pinnedhash
+        self.obsolete = obsolete
+        self.hidden = hidden
+        self.unserved = unserved
+
+    def key(self):
+        return (self.tiprev, self.tipnode, self.obssize, self.obshash,
+                self.phasehash, self.pinnedhash)
+
+def _readhiddencache(repo):
+    try:
+        data = repo.cachevfs.read(_hiddencachefile)
+    except (IOError, OSError):
+        return None
+    try:
+        header = _hiddenheader.unpack_from(data)
+        nobs, nhidden, nunserved = header[6:]
+        count = nobs + nhidden + nunserved
+        if len(data) != _hiddenheader.size + 4 * count:
+            raise ValueError('unexpected size')
+        revs = struct.unpack_from('>%di' % count, data, _hiddenheader.size)
+    except (struct.error, ValueError) as inst:
+        repo.ui.debug('invalid hidden cache: %s\n' % inst)
+        return None
+    obs = frozenset(revs[:nobs])
+    hidden = frozenset(revs[nobs:nobs + nhidden])
+    unserved = frozenset(revs[nobs + nhidden:])
+    return hiddencache(*(header[:6] + (obs, hidden, unserved)))
+
+def _writehiddencache(repo, cache):
+    if repo.currenttransaction() is not None:
+        # the state of the repository is not final yet
+        return
+    revs = []
+    for s in (cache.obsolete, cache.hidden, cache.unserved):
+        revs.extend(sorted(s))
+    try:
+        f = repo.cachevfs(_hiddencachefile, 'w', atomictemp=True)
+        f.write(_hiddenheader.pack(*(cache.key() + (len(cache.obsolete),
+                                                     len(cache.hidden),
+                                                     len(cache.unserved)))))
+        f.write(struct.pack('>%di' % len(revs), *revs))
+        f.close()
+    except (IOError, OSError, error.Abort) as inst:
+        repo.ui.debug("couldn't write hidden cache: %s\n" % inst)
+        # Abort may be raise by read only opener
+        pass
+
+def _hiddenstate(repo, cache, pinned):
+    """return the cache key of the current state of repo, and tell if the
+    obsstore covered by cache was only appended to since"""
+    cl = repo.changelog
+    tiprev = len(cl) - 1
+    obssize = 0
+    obshash = hashlib.sha1().digest()
+    appended = cache is not None and cache.obssize == 0
+    try:
+        fp = repo.svfs('obsstore')
+    except IOError as inst:
+        if inst.errno != errno.ENOENT:
+            raise
+    else:
+        try:
+            obssize = util.fstat(fp).st_size
+            obshash = _obsstorehash(fp, obssize)
+            if cache is not None and 0 < cache.obssize <= obssize:
+                appended = _obsstorehash(fp, cache.obssize) == cache.obshash
+        finally:
+            fp.close()
+    key = (tiprev, cl.node(tiprev), obssize, obshash, _phasehash(repo),
+           _pinnedhash(pinned))
+    return key, appended
+
+def _appendedmarkers(repo, start, stop):
+    """return the markers stored between offsets start and stop of the
+    obsstore file"""
+    fp = repo.svfs('obsstore')
+    try:
+        # the format version is given by the first byte
+        data = fp.read(1)
+        start = max(start, 1)
+        fp.seek(start)
+        data += fp.read(stop - start)
+    finally:
+        fp.close()
+    return obsolete._readmarkers(data)[1]
+
+def _updateobsolete(repo, cache, obssize):
+    """return the obsolete revisions of cache updated for the changesets and
+    markers appended since, or None if changesets were removed"""
+    cl = repo.changelog
+    if cache.tiprev >= len(cl) or cl.node(cache.tiprev) != cache.tipnode:
+        return None
+    obs = set(cache.obsolete)
+    node = cl.node
+    phase = repo._phasecache.phase
+    newrevs = xrange(cache.tiprev + 1, len(cl))
+    if newrevs and repo.obsstore:
+        isobs = repo.obsstore.successors.__contains__
+        obs.update(r for r in newrevs if phase(repo, r) and isobs(node(r)))
+    if obssize > cache.obssize:
+        nodemap = cl.nodemap
+        for mark in _appendedmarkers(repo, cache.obssize, obssize):
+            rev = nodemap.get(mark[0])
+            if rev is not None and phase(repo, rev):
+                obs.add(rev)
+    return frozenset(obs)
+
+def _cachedfilters(repo):
+    """return the revisions filtered by 'visible' and 'served', using and
+    updating the on-disk cache"""
+    assert not repo.changelog.filteredrevs
+    pinned = pinnedrevs(repo)
+    cache = _readhiddencache(repo)
+    key, appended = _hiddenstate(repo, cache, pinned)
+    if cache is not None and cache.key() == key:
+        return {'visible': cache.hidden, 'served': cache.unserved}
+    obs = None
+    if cache is not None and appended and cache.phasehash == key[4]:
+        obs = _updateobsolete(repo, cache, key[2])
+    if obs is None:
+        repo.ui.debug('computing hidden revisions\n')
+        obs = frozenset(hideablerevs(repo))
+    else:
+        repo.ui.debug('updating hidden revisions\n')
+    hidden = _hidden(repo, obs, pinned)
+    unserved = _unserved(repo, hidden)
+    _writehiddencache(repo, hiddencache(*(key + (obs, hidden, unserved))))
+    return {'visible': hidden, 'served': unserved}
+
 def filterrevs(repo, filtername):
     """returns set of filtered revision for this filter name"""
     if filtername not in repo.filteredrevcache:
-        func = filtertable[filtername]
-        repo.filteredrevcache[filtername] = func(repo.unfiltered())
+        if filtername in ('visible', 'served') and _usehiddencache(repo):
+            repo.filteredrevcache.update(_cachedfilters(repo.unfiltered()))
+        else:
+            func = filtertable[filtername]
+            repo.filteredrevcache[filtername] = func(repo.unfiltered())
     return repo.filteredrevcache[filtername]
 
 class repoview(object):
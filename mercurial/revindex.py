@@ -0,0 +1,261 @@
+# revindex.py - persistent index of the revisions by key
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""persistent index of the revisions of a repository by key
+
+The indexes of the changesets touching each directory (pathindex) and of the
+text of the changesets (textindex) record, for each key, the revisions of
+the changesets indexed under it. They share the storage implemented here,
+each one with its own file in .hg/cache and its own function giving the keys
+of a revision.
+
+The file is a sequence of blocks, each indexing a range of revisions:
+
+  header: 4 bytes magic, 4 bytes first and end revisions of the range,
+          20 bytes node of the last revision, 4 bytes number of keys and
+          4 bytes length of the data.
+  data: the table of the keys, made of 4 bytes offset of the key and 4 bytes
+          offset of its revisions for each key, in the order of the keys,
+          followed by one more entry with the length of the keys and of the
+          revisions. Then the keys, concatenated, and the revisions of each
+          key, as space separated differences between them, the first one
+          being relative to 0.
+
+Looking up a key is a binary search in the table of each block.
+
+A block is appended for the revisions added since the last update, and the
+blocks are merged into a single one once they get too many. Blocks whose last
+node no longer matches the changelog, after a strip, are dropped with the
+blocks following them, and their revisions are indexed again.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import struct
+
+from . import (
+    error,
+)
+
+_blockstruct = struct.Struct('>4sII20sII')
+_entrystruct = struct.Struct('>II')
+
+# the blocks are merged into a single one once there are more than this many
+_maxblocks = 16
+
+def _encode(postings):
+    """return the data of a block indexing postings, a dict of the sorted
+    revisions by key, and the number of keys"""
+    keys = sorted(postings)
+    table = []
+    revs = []
+    keyoff = revsoff = 0
+    for key in keys:
+        table.append(_entrystruct.pack(keyoff, revsoff))
+        r = postings[key]
+        deltas = ' '.join('%d' % (b - a) for a, b in zip([0] + r, r))
+        revs.append(deltas)
+        keyoff += len(key)
+        revsoff += len(deltas)
+    table.append(_entrystruct.pack(keyoff, revsoff))
+    return ''.join(table + keys + revs), len(keys)
+
+def _revs(deltas):
+    revs = []
+    rev = 0
+    for d in deltas.split(' '):
+        rev += int(d)
+        revs.append(rev)
+    return revs
+
+def _sizes(data, count):
+    """return the length of the keys and of the revisions of a block"""
+    return _entrystruct.unpack_from(data, _entrystruct.size * count)
+
+class _block(object):
+    """the keys of the revisions start to end - 1"""
+
+    def __init__(self, start, end, node, data, count, written=True):
+        self.start = start
+        self.end = end
+        self.node = node
+        self.data = data
+        # number of keys
+        self.count = count
+        self.written = written
+        self._keysoff = _entrystruct.size * (count + 1)
+        self._revsoff = self._keysoff + _sizes(data, count)[0]
+
+    def _entry(self, i):
+        """return the key and the deltas of the revisions of the ith key"""
+        data = self.data
+        keystart, revsstart = _entrystruct.unpack_from(
+            data, i * _entrystruct.size)
+        keyend, revsend = _entrystruct.unpack_from(
+            data, (i + 1) * _entrystruct.size)
+        return (data[self._keysoff + keystart:self._keysoff + keyend],
+                data[self._revsoff + revsstart:self._revsoff + revsend])
+
+    def items(self):
+        """yield the keys of the block with their revisions"""
+        for i in xrange(self.count):
+            key, deltas = self._entry(i)
+            yield key, _revs(deltas)
+
+    def revs(self, key):
+        """the revisions of the block indexed under key"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k, deltas = self._entry(mid)
+            if k < key:
+                lo = mid + 1
+            elif k > key:
+                hi = mid
+            else:
+                return _revs(deltas)
+        return []
+
+class revindex(object):
+    """persistent index of the revisions of a repository by key
+
+    The index is stored in the cache file filename, in blocks starting with
+    magic. keys(cl, rev) returns the keys under which the revision rev of the
+    changelog cl is indexed, which can be any strings.
+    """
+
+    def __init__(self, repo, filename, magic, keys):
+        assert repo.filtername is None
+        self._repo = repo
+        self._filename = filename
+        self._magic = magic
+        self._keys = keys
+        self._load()
+
+    def _load(self):
+        repo = self._repo
+        self._blocks = []
+        # length of the valid content of the file
+        self._datalen = 0
+        # the file has to be rewritten, not appended to
+        self._rewrite = False
+        try:
+            data = repo.cachevfs.read(self._filename)
+        except (IOError, OSError) as inst:
+            if inst.errno != errno.ENOENT:
+                repo.ui.debug("couldn't read cache/%s: %s\n"
+                              % (self._filename, inst))
+            data = ''
+        cl = repo.changelog
+        hsize = _blockstruct.size
+        off = end = 0
+        while off + hsize <= len(data):
+            magic, start, bend, node, count, size = _blockstruct.unpack_from(
+                data, off)
+            bdata = data[off + hsize:off + hsize + size]
+            if (magic != self._magic or start != end or bend <= start
+                or bend > len(cl) or cl.node(bend - 1) != node
+                or len(bdata) != size
+                or _entrystruct.size * (count + 1) > size
+                or (_entrystruct.size * (count + 1)
+                    + sum(_sizes(bdata, count)) != size)):
+                # stripped revisions or interrupted write
+                break
+            self._blocks.append(_block(start, bend, node, bdata, count))
+            end = bend
+            off += hsize + size
+        self._datalen = off
+
+    @property
+    def end(self):
+        """the first revision not indexed"""
+        if not self._blocks:
+            return 0
+        return self._blocks[-1].end
+
+    def _valid(self):
+        cl = self._repo.changelog
+        end = self.end
+        return end <= len(cl) and (not end or
+                                   cl.node(end - 1) == self._blocks[-1].node)
+
+    def update(self):
+        """index the revisions added to the changelog since the last update"""
+        if not self._valid():
+            # the changelog was stripped since the index was loaded
+            self._load()
+        cl = self._repo.changelog
+        start = self.end
+        if start == len(cl):
+            return
+        postings = {}
+        for rev in cl.revs(start):
+            for key in self._keys(cl, rev):
+                postings.setdefault(key, []).append(rev)
+        end = len(cl)
+        data, count = _encode(postings)
+        self._blocks.append(_block(start, end, cl.node(end - 1), data, count,
+                                   written=False))
+        if len(self._blocks) > _maxblocks:
+            self._compact()
+
+    def _compact(self):
+        postings = {}
+        for block in self._blocks:
+            for key, revs in block.items():
+                postings.setdefault(key, []).extend(revs)
+        last = self._blocks[-1]
+        data, count = _encode(postings)
+        self._blocks = [_block(0, last.end, last.node, data, count,
+                               written=False)]
+        self._rewrite = True
+
+    def revs(self, key):
+        """return the revisions indexed under key"""
+        revs = []
+        for block in self._blocks:
+            revs.extend(block.revs(key))
+        return revs
+
+    def write(self):
+        """write the blocks added to the cache file"""
+        new = [b for b in self._blocks if not b.written]
+        if not new:
+            return
+        repo = self._repo
+        wlock = None
+        try:
+            wlock = repo.wlock(wait=False)
+            if self._rewrite:
+                f = repo.cachevfs(self._filename, 'w', atomictemp=True)
+                self._datalen = 0
+            else:
+                f = repo.cachevfs.open(self._filename, 'ab')
+                if f.tell() != self._datalen:
+                    # changed by someone else, or ends with a partial block
+                    repo.ui.debug("cache/%s changed - truncating it\n"
+                                  % self._filename)
+                    f.seek(self._datalen)
+                    f.truncate()
+            try:
+                for block in new:
+                    f.write(_blockstruct.pack(self._magic, block.start,
+                                              block.end, block.node,
+                                              block.count, len(block.data)))
+                    f.write(block.data)
+                    block.written = True
+                    self._datalen += _blockstruct.size + len(block.data)
+            finally:
+                f.close()
+            self._rewrite = False
+        except (IOError, OSError, error.Abort, error.LockError) as inst:
+            repo.ui.debug("couldn't write cache/%s: %s\n"
+                          % (self._filename, inst))
+        finally:
+            if wlock is not None:
+                wlock.release()
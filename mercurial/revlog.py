@@ -17,6 +17,7 @@ import binascii
 import collections
 import errno
 import hashlib
+import heapq
 import os
 import struct
 import zlib
@@ -36,6 +37,7 @@ from . import (
     ancestor,
     error,
     mdiff,
+    persistentnodemap,
     policy,
     pycompat,
     templatefilters,
@@ -173,6 +175,72 @@ indexformatv0 = struct.Struct(">4l20s20s20s")
 indexformatv0_pack = indexformatv0.pack
 indexformatv0_unpack = indexformatv0.unpack
 
+def _slicechunk(revlog, revs):
+    """slice revs to reduce the amount of unrelated data to be read from disk.
+
+    ``revs`` is sliced into groups that should be read in one time.
+    Assume that revs are sorted.
+
+    The gaps between revisions are dropped, largest first, until the ratio of
+    useful data over read data reaches the revlog density threshold. Gaps
+    smaller than the minimal gap size are always read through.
+    """
+    start = revlog.start
+    length = revlog.length
+
+    if len(revs) <= 1:
+        yield revs
+        return
+
+    startbyte = start(revs[0])
+    endbyte = start(revs[-1]) + length(revs[-1])
+    readdata = deltachainspan = endbyte - startbyte
+
+    chainpayload = sum(length(r) for r in revs)
+
+    if deltachainspan:
+        density = chainpayload / float(deltachainspan)
+    else:
+        density = 1.0
+
+    # Store the gaps in a heap to have them sorted by decreasing size
+    gapsheap = []
+    prevend = None
+    for i, rev in enumerate(revs):
+        revstart = start(rev)
+        revlen = length(rev)
+
+        if prevend is not None:
+            gapsize = revstart - prevend
+            # only consider holes that are large enough
+            if gapsize > revlog._srmingapsize:
+                heapq.heappush(gapsheap, (-gapsize, i))
+
+        prevend = revstart + revlen
+
+    # Collect the indices of the largest holes until the density is acceptable
+    indicesheap = []
+    while gapsheap and density < revlog._srdensitythreshold:
+        oppgapsize, gapidx = heapq.heappop(gapsheap)
+
+        heapq.heappush(indicesheap, gapidx)
+
+        # the gap sizes are stored as negatives to be sorted decreasingly
+        # by the heap
+        readdata -= (-oppgapsize)
+        if readdata > 0:
+            density = chainpayload / float(readdata)
+        else:
+            density = 1.0
+
+    # Cut the revs at collected indices
+    previdx = 0
+    while indicesheap:
+        idx = heapq.heappop(indicesheap)
+        yield revs[previdx:idx]
+        previdx = idx
+    yield revs[previdx:]
+
 class revlogoldio(object):
     def __init__(self):
         self.size = indexformatv0.size
@@ -268,8 +336,13 @@ class revlog(object):
 
     If checkambig, indexfile is opened with checkambig=True at
     writing, to avoid file stat ambiguity.
+
+    If persistentnodemap, the node -> rev mapping is also kept on disk
+    (when the 'persistent-nodemap' opener option is set) so lookups do not
+    have to scan the whole index.
     """
-    def __init__(self, opener, indexfile, datafile=None, checkambig=False):
+    def __init__(self, opener, indexfile, datafile=None, checkambig=False,
+                 persistentnodemap=False):
         """
         create a revlog object
 
@@ -291,7 +364,9 @@ class revlog(object):
         # How much data to read and cache into the raw revlog data cache.
         self._chunkcachesize = 65536
         self._maxchainlen = None
+        self._maxchainspan = None
         self._aggressivemergedeltas = False
+        self._exhaustivedeltasearch = False
         self.index = []
         # Mapping of partial identifiers to full nodes.
         self._pcache = {}
@@ -300,6 +375,12 @@ class revlog(object):
         self._nodepos = None
         self._compengine = 'zlib'
         self._maxdeltachainspan = -1
+        self._nodemapfile = None
+        self._persistentnodemap = None
+        self._mmapthreshold = None
+        self._withsparseread = False
+        self._srdensitythreshold = 0.25
+        self._srmingapsize = 262144
 
         v = REVLOG_DEFAULT_VERSION
         opts = getattr(opener, 'options', None)
@@ -316,13 +397,26 @@ class revlog(object):
                 self._chunkcachesize = opts['chunkcachesize']
             if 'maxchainlen' in opts:
                 self._maxchainlen = opts['maxchainlen']
+            if 'maxchainspan' in opts:
+                self._maxchainspan = opts['maxchainspan']
             if 'aggressivemergedeltas' in opts:
                 self._aggressivemergedeltas = opts['aggressivemergedeltas']
+            if 'exhaustivedeltasearch' in opts:
+                self._exhaustivedeltasearch = opts['exhaustivedeltasearch']
             self._lazydeltabase = bool(opts.get('lazydeltabase', False))
             if 'compengine' in opts:
                 self._compengine = opts['compengine']
             if 'maxdeltachainspan' in opts:
                 self._maxdeltachainspan = opts['maxdeltachainspan']
+            if 'mmapindexthreshold' in opts:
+                self._mmapthreshold = opts['mmapindexthreshold']
+            self._withsparseread = bool(opts.get('with-sparse-read', False))
+            if 'sparse-read-density-threshold' in opts:
+                self._srdensitythreshold = opts['sparse-read-density-threshold']
+            if 'sparse-read-min-gap-size' in opts:
+                self._srmingapsize = opts['sparse-read-min-gap-size']
+            if persistentnodemap and opts.get('persistent-nodemap'):
+                self._nodemapfile = self.datafile[:-2] + '.n'
 
         if self._chunkcachesize <= 0:
             raise RevlogError(_('revlog chunk cache size %r is not greater '
@@ -335,11 +429,17 @@ class revlog(object):
         self._initempty = True
         try:
             f = self.opener(self.indexfile)
-            indexdata = f.read()
+            indexdata = self._mapfile(f)
+            if indexdata is None:
+                indexdata = f.read()
             f.close()
             if len(indexdata) > 0:
                 v = versionformat_unpack(indexdata[:4])[0]
                 self._initempty = False
+                if v & FLAG_INLINE_DATA and not isinstance(indexdata, str):
+                    # revision data of inline revlogs goes through the chunk
+                    # cache, do not keep the mapping around
+                    indexdata = indexdata[:]
         except IOError as inst:
             if inst.errno != errno.ENOENT:
                 raise
@@ -386,6 +486,29 @@ class revlog(object):
         self._chaininfocache = {}
         # revlog header -> revlog compressor
         self._decompressors = {}
+        if self._nodemapfile is not None:
+            self._loadnodemap()
+
+    def _mapfile(self, fp):
+        """return a buffer over a read-only mapping of an open revlog index
+
+        Returns None if the file is smaller than the configured threshold or
+        cannot be mapped. Mappings of a file are shared through the page cache
+        by every process reading it.
+
+        Only indexes are mapped: data files are read through the chunk cache,
+        a mapping of them would crash their long-lived readers once truncated
+        by a strip or a rollback.
+        """
+        threshold = self._mmapthreshold
+        if threshold is None:
+            return None
+        try:
+            if self.opener.fstat(fp).st_size < threshold:
+                return None
+            return util.buffer(util.mmapread(fp))
+        except (EnvironmentError, ValueError):
+            return None
 
     @util.propertycache
     def _compressor(self):
@@ -412,9 +535,37 @@ class revlog(object):
 
     @util.propertycache
     def nodemap(self):
-        self.rev(self.node(0))
+        self._buildnodecache()
         return self._nodecache
 
+    def _buildnodecache(self):
+        """fill the pure python node cache with every revision"""
+        # the persistent nodemap would answer without walking the index
+        nm, self._persistentnodemap = self._persistentnodemap, None
+        try:
+            self.rev(self.node(0))
+        finally:
+            self._persistentnodemap = nm
+
+    def _loadnodemap(self):
+        """load the on-disk nodemap if it matches the current index"""
+        nm = persistentnodemap.read(self.opener, self._nodemapfile)
+        if nm is not None:
+            count = nm.count
+            if count > len(self) or (count and
+                                     self.index[count - 1][7] != nm.lastnode):
+                # out of date (stripped or rewritten history), ignore it
+                nm = None
+        self._persistentnodemap = nm
+
+    def _writenodemap(self, tr):
+        """update the on-disk nodemap at transaction close"""
+        self._loadnodemap()
+        persistentnodemap.update(self.opener, self._nodemapfile,
+                                 self._persistentnodemap, self.index,
+                                 len(self), tr)
+        self._loadnodemap()
+
     def hasnode(self, node):
         try:
             self.rev(node)
@@ -435,6 +586,12 @@ class revlog(object):
             self._nodepos = None
 
     def rev(self, node):
+        if self._persistentnodemap is not None:
+            r = self._persistentnodemap.get(node)
+            if r is not None:
+                return r
+            # unknown, or appended after the nodemap was written: the index
+            # nodemap knows every revision and is built only once
         try:
             return self._nodecache[node]
         except TypeError:
@@ -1067,8 +1224,32 @@ class revlog(object):
             except (TypeError, LookupError):
                 pass
 
+    def _nodemappartialmatch(self, id, maybewdir):
+        """resolve a hex prefix using the persistent nodemap"""
+        try:
+            prefix = bin(id[:len(id) // 2 * 2])
+        except (TypeError, binascii.Error):
+            return None
+        nl = self._persistentnodemap.prefixmatch(prefix)
+        # the null revision is the last entry of the index
+        if nullid.startswith(prefix):
+            nl.append(nullid)
+        nl = [n for n in nl if hex(n).startswith(id) and self.hasnode(n)]
+        if nl:
+            if len(nl) == 1 and not maybewdir:
+                return nl[0]
+            raise LookupError(id, self.indexfile, _('ambiguous identifier'))
+        if maybewdir:
+            raise error.WdirUnsupported
+        return None
+
     def _partialmatch(self, id):
         maybewdir = wdirhex.startswith(id)
+        nm = self._persistentnodemap
+        if nm is not None and nm.count == len(self) and 4 <= len(id) <= 40:
+            # avoid building the full radix tree of the index, unless some
+            # revisions are not in the nodemap
+            return self._nodemappartialmatch(id, maybewdir)
         try:
             partial = self.index.partialmatch(id)
             if partial and self.hasnode(partial):
@@ -1264,6 +1445,10 @@ class revlog(object):
         This function is similar to calling ``self._chunk()`` multiple times,
         but is faster.
 
+        With sparse reads enabled, the revisions are sliced into dense groups
+        (see ``_slicechunk``) each read separately, so large unrelated areas
+        of the revlog between them are not read.
+
         Returns a list with decompressed data for each requested revision.
         """
         if not revs:
@@ -1277,20 +1462,33 @@ class revlog(object):
         l = []
         ladd = l.append
 
-        try:
-            offset, data = self._getsegmentforrevs(revs[0], revs[-1], df=df)
-        except OverflowError:
-            # issue4215 - we can't cache a run of chunks greater than
-            # 2G on Windows
-            return [self._chunk(rev, df=df) for rev in revs]
+        if not self._withsparseread:
+            slicedchunks = (revs,)
+        else:
+            slicedchunks = _slicechunk(self, revs)
 
         decomp = self.decompress
-        for rev in revs:
-            chunkstart = start(rev)
-            if inline:
-                chunkstart += (rev + 1) * iosize
-            chunklength = length(rev)
-            ladd(decomp(buffer(data, chunkstart - offset, chunklength)))
+        for revschunk in slicedchunks:
+            firstrev = revschunk[0]
+            # Skip trailing revisions with empty diff
+            for lastrev in revschunk[::-1]:
+                if length(lastrev) != 0:
+                    break
+
+            try:
+                offset, data = self._getsegmentforrevs(firstrev, lastrev,
+                                                       df=df)
+            except OverflowError:
+                # issue4215 - we can't cache a run of chunks greater than
+                # 2G on Windows
+                return [self._chunk(rev, df=df) for rev in revs]
+
+            for rev in revschunk:
+                chunkstart = start(rev)
+                if inline:
+                    chunkstart += (rev + 1) * iosize
+                chunklength = length(rev)
+                ladd(decomp(buffer(data, chunkstart - offset, chunklength)))
 
         return l
 
@@ -1680,8 +1878,60 @@ class revlog(object):
             (self._maxchainlen and chainlen > self._maxchainlen)):
             return False
 
+        # unlike the limits above, the chain span limit does not grow with
+        # the size of the text, so reading any revision stays bounded
+        if self._maxchainspan and dist > self._maxchainspan:
+            return False
+
         return True
 
+    def _getcandidaterevs(self, p1, p2, cachedelta):
+        """Provides revisions that present an interest to be diffed against,
+        grouped by level of easiness.
+
+        The revisions of a group are all tried and the smallest acceptable
+        delta is used, the next group is only considered if none of them was
+        acceptable.
+        """
+        curr = len(self)
+        prev = curr - 1
+
+        # should we try to build a delta?
+        if prev != nullrev and self.storedeltachains:
+            tested = set()
+            # This condition is true most of the time when processing
+            # changegroup data into a generaldelta repo. The only time it
+            # isn't true is if this is the first revision in a delta chain
+            # or if ``format.generaldelta=true`` disabled ``lazydeltabase``.
+            if cachedelta and self._generaldelta and self._lazydeltabase:
+                # Assume what we received from the server is a good choice
+                # build delta will reuse the cache
+                yield (cachedelta[0],)
+                tested.add(cachedelta[0])
+
+            if self._generaldelta:
+                # exclude already lazy tested base if any
+                parents = [p for p in (p1, p2)
+                           if p != nullrev and p not in tested]
+                if self._exhaustivedeltasearch:
+                    # try every reasonable base at once and keep the smallest
+                    # delta instead of the first acceptable one
+                    if prev not in tested and prev not in parents:
+                        parents.append(prev)
+                    yield tuple(parents)
+                    return
+                if parents and not self._aggressivemergedeltas:
+                    # Pick whichever parent is closer to us (to minimize the
+                    # chance of having to build a fulltext).
+                    parents = [max(parents)]
+                tested.update(parents)
+                yield tuple(parents)
+
+            if prev not in tested:
+                # other approach failed try against prev to hopefully save us a
+                # fulltext.
+                yield (prev,)
+
     def _addrevision(self, node, rawtext, transaction, link, p1, p2, flags,
                      cachedelta, ifh, dfh, alwayscache=False):
         """internal function to add revisions to the log
@@ -1774,42 +2024,16 @@ class revlog(object):
         else:
             textlen = len(rawtext)
 
-        # should we try to build a delta?
-        if prev != nullrev and self.storedeltachains:
-            tested = set()
-            # This condition is true most of the time when processing
-            # changegroup data into a generaldelta repo. The only time it
-            # isn't true is if this is the first revision in a delta chain
-            # or if ``format.generaldelta=true`` disabled ``lazydeltabase``.
-            if cachedelta and self._generaldelta and self._lazydeltabase:
-                # Assume what we received from the server is a good choice
-                # build delta will reuse the cache
-                candidatedelta = builddelta(cachedelta[0])
-                tested.add(cachedelta[0])
+        for candidaterevs in self._getcandidaterevs(p1r, p2r, cachedelta):
+            nominateddeltas = []
+            for candidaterev in candidaterevs:
+                candidatedelta = builddelta(candidaterev)
                 if self._isgooddelta(candidatedelta, textlen):
-                    delta = candidatedelta
-            if delta is None and self._generaldelta:
-                # exclude already lazy tested base if any
-                parents = [p for p in (p1r, p2r)
-                           if p != nullrev and p not in tested]
-                if parents and not self._aggressivemergedeltas:
-                    # Pick whichever parent is closer to us (to minimize the
-                    # chance of having to build a fulltext).
-                    parents = [max(parents)]
-                tested.update(parents)
-                pdeltas = []
-                for p in parents:
-                    pd = builddelta(p)
-                    if self._isgooddelta(pd, textlen):
-                        pdeltas.append(pd)
-                if pdeltas:
-                    delta = min(pdeltas, key=lambda x: x[1])
-            if delta is None and prev not in tested:
-                # other approach failed try against prev to hopefully save us a
-                # fulltext.
-                candidatedelta = builddelta(prev)
-                if self._isgooddelta(candidatedelta, textlen):
-                    delta = candidatedelta
+                    nominateddeltas.append(candidatedelta)
+            if nominateddeltas:
+                delta = min(nominateddeltas, key=lambda x: x[1])
+                break
+
         if delta is not None:
             dist, l, data, base, chainbase, chainlen, compresseddeltalen = delta
         else:
@@ -1850,6 +2074,9 @@ class revlog(object):
             dfh.seek(0, os.SEEK_END)
 
         curr = len(self) - 1
+        if self._nodemapfile is not None:
+            transaction.addfinalize('nodemap-%s' % self._nodemapfile,
+                                    self._writenodemap)
         if not self._inline:
             transaction.add(self.datafile, offset)
             transaction.add(self.indexfile, curr * len(entry))
@@ -1875,9 +2102,15 @@ class revlog(object):
 
         If ``addrevisioncb`` is defined, it will be called with arguments of
         this revlog and the node that was added.
+
+        Revisions whose delta is stored as received are added without
+        building their text. Their hash is checked once the whole group has
+        been added, see _checkaddedhashes.
         """
 
         nodes = []
+        # revisions added without checking their hash
+        unchecked = []
 
         r = len(self)
         end = 0
@@ -1951,6 +2184,9 @@ class revlog(object):
                                           p1, p2, flags, (baserev, delta),
                                           ifh, dfh,
                                           alwayscache=bool(addrevisioncb))
+                if ((self._cache is None or self._cache[0] != chain)
+                    and not flags & REVIDX_ISCENSORED):
+                    unchecked.append(len(self) - 1)
 
                 if addrevisioncb:
                     addrevisioncb(self, chain)
@@ -1962,6 +2198,10 @@ class revlog(object):
                     dfh = self.opener(self.datafile, "a+")
                     ifh = self.opener(self.indexfile, "a+",
                                       checkambig=self._checkambig)
+
+            if unchecked:
+                flush()
+                self._checkaddedhashes(unchecked, self._inline and ifh or dfh)
         finally:
             if dfh:
                 dfh.close()
@@ -1969,6 +2209,41 @@ class revlog(object):
 
         return nodes
 
+    def _checkaddedhashes(self, revs, df):
+        """check the hash of the raw text of the added revisions revs
+
+        The text of each revision is built by applying its delta to the text
+        of its delta parent, which is kept around while other revisions of
+        revs have it as delta parent. Checking them through revision(), in
+        revision order, would rebuild the whole delta chain of a revision
+        whenever its delta parent isn't the previous revision, as often with
+        generaldelta.
+        """
+        deltaparent = self.deltaparent
+        # number of revisions left to check, by delta parent
+        refs = collections.Counter(deltaparent(rev) for rev in revs)
+        texts = {}
+        for rev in revs:
+            base = deltaparent(rev)
+            delta = self._chunk(rev, df=df)
+            if base == nullrev:
+                rawtext = bytes(delta)
+            else:
+                basetext = texts.get(base)
+                if basetext is None:
+                    basetext = self.revision(base, _df=df, raw=True)
+                    texts[base] = basetext
+                rawtext = mdiff.patches(basetext, [delta])
+                refs[base] -= 1
+                if not refs[base]:
+                    del texts[base]
+            if refs[rev]:
+                texts[rev] = rawtext
+            text, validatehash = self._processflags(rawtext, self.flags(rev),
+                                                    'read', raw=True)
+            if validatehash:
+                self.checkhash(text, self.node(rev), rev=rev)
+
     def iscensored(self, rev):
         """Check if a file revision is censored."""
         return False
@@ -2048,6 +2323,12 @@ class revlog(object):
 
         transaction.add(self.indexfile, end)
 
+        nm = self._persistentnodemap
+        if nm is not None:
+            transaction.add(self._nodemapfile,
+                            persistentnodemap.stripoffset(nm, rev))
+            self._persistentnodemap = None
+
         # then reset internal state in memory to forget those revisions
         self._cache = None
         self._chaininfocache = {}
@@ -20,6 +20,7 @@ from . import (
     node,
     obsolete as obsmod,
     obsutil,
+    pathindex,
     pathutil,
     phases,
     registrar,
@@ -27,6 +28,7 @@ from . import (
     revsetlang,
     scmutil,
     smartset,
+    textindex,
     util,
 )
 
@@ -617,6 +619,8 @@ def desc(repo, subset, x):
     ds = getstring(x, _("desc requires a string"))
 
     kind, pattern, matcher = _substringmatcher(ds, casesensitive=False)
+    if kind == 'literal':
+        subset = _textcandidates(repo, subset, pattern)
 
     return subset.filter(lambda r: matcher(repo[r].description()),
                          condrepr=('<desc %r>', ds))
@@ -805,7 +809,12 @@ def filelog(repo, subset, x):
                 # ahead in changelog
                 start = max(lr, scanpos) + 1
                 scanpos = None
-                for r in cl.revs(start):
+                revs = cl.revs(start)
+                candidates = pathindex.candidates(repo, [f])
+                if candidates is not None:
+                    revs = sorted(r for r in candidates
+                                  if r >= start and r in cl)
+                for r in revs:
                     # minimize parsing of non-matching entries
                     if f in cl.revision(r) and f in cl.readfiles(r):
                         try:
@@ -945,6 +954,9 @@ def getall(repo, subset, x):
     getargs(x, 0, 0, _("all takes no arguments"))
     return subset & spanset(repo)  # drop "null" if any
 
+# characters making a regular expression more than a plain string
+_regexspecialchars = '.^$*+?{}[]\\|()'
+
 @predicate('grep(regex)')
 def grep(repo, subset, x):
     """Like ``keyword(string)`` but accepts a regex. Use ``grep(r'...')``
@@ -956,6 +968,9 @@ def grep(repo, subset, x):
         gr = re.compile(getstring(x, _("grep requires a string")))
     except re.error as e:
         raise error.ParseError(_('invalid match pattern: %s') % e)
+    if not any(c in gr.pattern for c in _regexspecialchars):
+        # a plain string, look it up in the text index
+        subset = _textcandidates(repo, subset, gr.pattern)
 
     def matches(x):
         c = repo[x]
@@ -1015,9 +1030,13 @@ def _matchfiles(repo, subset, x):
     # revisions is quite expensive.
     getfiles = repo.changelog.readfiles
     wdirrev = node.wdirrev
+    # the revisions which may touch the matched files, if known
+    candidates = pathindex.matchcandidates(repo, m)
     def matches(x):
         if x == wdirrev:
             files = repo[x].files()
+        elif candidates is not None and x not in candidates:
+            return False
         else:
             files = getfiles(x)
         for f in files:
@@ -1063,6 +1082,14 @@ def heads(repo, subset, x):
     ps = parents(repo, subset, x)
     return s - ps
 
+@predicate('_headrevs', safe=True)
+def _headrevs(repo, subset, x):
+    # ``_headrevs()``, the heads of the repository, as computed by the index
+    # for ``heads(all())``
+    getargs(x, 0, 0, "_headrevs takes no arguments")
+    heads = repo.changelog.headrevs()
+    return subset & baseset([r for r in heads if r != node.nullrev])
+
 @predicate('hidden()', safe=True)
 def hidden(repo, subset, x):
     """Hidden changesets.
@@ -1082,6 +1109,7 @@ def keyword(repo, subset, x):
     """
     # i18n: "keyword" is a keyword
     kw = encoding.lower(getstring(x, _("keyword requires a string")))
+    subset = _textcandidates(repo, subset, kw)
 
     def matches(r):
         c = repo[r]
@@ -1874,6 +1902,16 @@ def successors(repo, subset, x):
     d = _mapbynodefunc(repo, s, f)
     return subset & d
 
+def _textcandidates(repo, subset, text):
+    """filter subset down to the revisions whose description, user or files
+    may contain text, ignoring case, if the text index can tell"""
+    candidates = textindex.candidates(repo, text)
+    if candidates is None:
+        return subset
+    wdirrev = node.wdirrev
+    return subset.filter(lambda r: r == wdirrev or r in candidates,
+                         cache=False)
+
 def _substringmatcher(pattern, casesensitive=True):
     kind, pattern, matcher = util.stringmatcher(pattern,
                                                 casesensitive=casesensitive)
@@ -313,6 +313,19 @@ def _matchonly(revs, bases):
     if _isposargs(ta, 1) and _isposargs(tb, 1):
         return ('list', ta, tb)
 
+def _isnot(x):
+    return x is not None and x[0] == 'not'
+
+def _flattenand(x):
+    """Return the list of the operands of a chain of 'and' operations
+
+    >>> _flattenand(_analyze(parse('a and (b and c) and d'), defineorder))
+    [('symbol', 'a'), ('symbol', 'b'), ('symbol', 'c'), ('symbol', 'd')]
+    """
+    if x is None or x[0] != 'and':
+        return [x]
+    return _flattenand(x[1]) + _flattenand(x[2])
+
 def _fixops(x):
     """Rewrite raw parsed tree to resolve ambiguous syntax which cannot be
     handled well by our simple top-down parser"""
@@ -423,22 +436,40 @@ def _optimize(x, small):
     if op in ('string', 'symbol'):
         return smallbonus, x # single revisions are small
     elif op == 'and':
-        wa, ta = _optimize(x[1], True)
-        wb, tb = _optimize(x[2], True)
         order = x[3]
-        w = min(wa, wb)
+        wts = [_optimize(y, True) for y in _flattenand(x)]
 
         # (::x and not ::y)/(not ::y and ::x) have a fast path
-        tm = _matchonly(ta, tb) or _matchonly(tb, ta)
-        if tm:
-            return w, ('func', ('symbol', 'only'), tm, order)
-
-        if tb is not None and tb[0] == 'not':
-            return wa, ('difference', ta, tb[1], order)
-
-        if wa > wb:
-            return w, (op, tb, ta, order)
-        return w, (op, ta, tb, order)
+        for i, (wa, ta) in enumerate(wts):
+            for j, (wb, tb) in enumerate(wts):
+                tm = i != j and _matchonly(ta, tb)
+                if tm:
+                    wts[i] = (min(wa, wb),
+                              ('func', ('symbol', 'only'), tm, order))
+                    del wts[j]
+                    break
+            else:
+                continue
+            break
+
+        # each operand only has to look at the revisions selected by the
+        # previous ones, so the cheapest and most selective go first. The
+        # negated ones are evaluated as differences once the others are.
+        # Only the first operand in the original order defines the order of
+        # the result, the others follow it wherever they are evaluated.
+        pos = sorted((wt for wt in wts if not _isnot(wt[1])),
+                     key=lambda wt: wt[0])
+        neg = sorted((wt for wt in wts if _isnot(wt[1])),
+                     key=lambda wt: wt[0])
+        w = min(wt[0] for wt in (pos or neg))
+        wts = pos + neg
+        t = wts[0][1]
+        for wb, tb in wts[1:]:
+            if _isnot(tb):
+                t = ('difference', t, tb[1], order)
+            else:
+                t = (op, t, tb, order)
+        return w, t
     elif op == 'or':
         # fast path for machine-generated expression, that is likely to have
         # lots of trivial revisions: 'a + b + c()' to '_list(a b) + c()'
@@ -509,6 +540,19 @@ def _optimize(x, small):
         return w, (op, x[1], t)
     elif op == 'func':
         f = getsymbol(x[1])
+        order = x[3]
+        # public() is evaluated as a difference with the other phases, whose
+        # sets are precomputed. The working directory is never public,
+        # all() excludes it.
+        if f == 'public' and x[2] is None:
+            newsym = ('func', ('symbol', '_notpublic'), None, anyorder)
+            allsym = ('func', ('symbol', 'all'), None, order)
+            t = ('and', allsym, ('not', newsym, _tofolloworder[order]), order)
+            return _optimize(t, small)
+        # heads(all()) is computed by the index
+        if f == 'heads' and (_isnamedfunc(x[2], 'all') and x[2][2] is None
+                             or x[2] is not None and x[2][0] == 'rangeall'):
+            return 1, ('func', ('symbol', '_headrevs'), None, order)
         wa, ta = _optimize(x[2], small)
         if f in ('author', 'branch', 'closed', 'date', 'desc', 'file', 'grep',
                  'keyword', 'outgoing', 'user', 'destination'):
@@ -525,7 +569,6 @@ def _optimize(x, small):
             w = 10 # assume most sorts look at changelog
         else:
             w = 1
-        order = x[3]
         return w + wa, (op, x[1], ta, order)
     raise ValueError('invalid operator %r' % op)
 
@@ -47,14 +47,26 @@ def _findexactmatches(repo, added, removed):
     # Done
     repo.ui.progress(_('searching for exact renames'), None)
 
+# estimated cost of scoring a pair of files, used to decide if the scoring
+# is worth spreading over worker processes
+_scorecost = 0.001
+
+# total size of the removed files loaded at once to be scored
+_batchsize = 64 * 1024 * 1024
+
 def _ctxdata(fctx):
     # lazily load text
     orig = fctx.data()
     return orig, mdiff.splitnewlines(orig)
 
-def _score(fctx, otherdata):
+def _linecounts(lines):
+    counts = {}
+    for line in lines:
+        counts[line] = counts.get(line, 0) + 1
+    return counts
+
+def _scoretext(text, otherdata):
     orig, lines = otherdata
-    text = fctx.data()
     # mdiff.blocks() returns blocks of matching lines
     # count the number of bytes in each
     equal = 0
@@ -66,33 +78,114 @@ def _score(fctx, otherdata):
     lengths = len(text) + len(orig)
     return equal * 2.0 / lengths
 
+def _score(fctx, otherdata):
+    return _scoretext(fctx.data(), otherdata)
+
+def _maxscore(len1, counts1, len2, counts2):
+    """upper bound of the score of two texts, from their lengths and the
+    number of occurrences of each of their lines
+
+    Matching blocks only pair identical lines, each line at most once.
+    """
+    if len(counts1) > len(counts2):
+        counts1, counts2 = counts2, counts1
+    equal = 0
+    for line, n in counts1.iteritems():
+        m = counts2.get(line)
+        if m:
+            equal += min(n, m) * len(line)
+    return equal * 2.0 / (len1 + len2)
+
 def score(fctx1, fctx2):
     return _score(fctx1, _ctxdata(fctx2))
 
+def _bestmatches(added, removed, best, args):
+    """find the best match among removed files of some added files
+
+    removed is a list of (index, data, line counts) of removed files, best a
+    dictionary of the score to beat for each added file, args a list of
+    indexes in added. Yields (index, "index of the removed file and score")
+    pairs, the data is empty if no removed file scores above the score to
+    beat.
+    """
+    for i in args:
+        text = added[i].data()
+        lines = None
+        counts = None
+        bestj = None
+        bestscore = best[i]
+        for j, data, rcounts in removed:
+            orig = data[0]
+            # cheap bounds of the score first: by size, then by lines
+            if (min(len(text), len(orig)) * 2.0 / (len(text) + len(orig))
+                <= bestscore):
+                continue
+            if lines is None:
+                lines = mdiff.splitnewlines(text)
+                counts = _linecounts(lines)
+            if _maxscore(len(text), counts, len(orig), rcounts) <= bestscore:
+                continue
+            myscore = _scoretext(text, data)
+            if myscore > bestscore:
+                bestj, bestscore = j, myscore
+        if bestj is None:
+            yield i, ''
+        else:
+            yield i, '%d %r' % (bestj, bestscore)
+
+def _batches(fctxs, maxsize):
+    """split fctxs in (start, stop) ranges whose total size is at most
+    maxsize, or holding a single file"""
+    start = 0
+    size = 0
+    for i, fctx in enumerate(fctxs):
+        fsize = fctx.size()
+        if i > start and size + fsize > maxsize:
+            yield start, i
+            start = i
+            size = 0
+        size += fsize
+    if start < len(fctxs):
+        yield start, len(fctxs)
+
 def _findsimilarmatches(repo, added, removed, threshold):
     '''find potentially renamed files based on similar file content
 
     Takes a list of new filectxs and a list of removed filectxs, and yields
     (before, after, score) tuples of partial matches.
+
+    Pairs of files that cannot score above the threshold are pruned using
+    their sizes and lines before being diffed, the remaining pairs are
+    scored in worker processes when worthwhile. The removed files are loaded
+    in batches of bounded size, each one scored against every added file.
     '''
+    from . import worker # avoid import cycle
+    ui = repo.ui
     copies = {}
-    for i, r in enumerate(removed):
-        repo.ui.progress(_('searching for similar files'), i,
-                         total=len(removed), unit=_('files'))
-
-        data = None
-        for a in added:
-            bestscore = copies.get(a, (None, threshold))[1]
-            if data is None:
-                data = _ctxdata(r)
-            myscore = _score(a, data)
-            if myscore > bestscore:
-                copies[a] = (r, myscore)
-    repo.ui.progress(_('searching'), None)
-
-    for dest, v in copies.iteritems():
-        source, bscore = v
-        yield source, dest, bscore
+    best = dict.fromkeys(range(len(added)), threshold)
+    for start, stop in _batches(removed, _batchsize):
+        rdata = []
+        for j in xrange(start, stop):
+            ui.progress(_('searching for similar files'), j,
+                        total=len(removed), unit=_('files'))
+            data = _ctxdata(removed[j])
+            rdata.append((j, data, _linecounts(data[1])))
+
+        prog = worker.worker(ui, _scorecost * len(rdata), _bestmatches,
+                             (added, rdata, best), range(len(added)))
+        for n, (i, res) in enumerate(prog):
+            ui.progress(_('scoring similar files'), n, total=len(added),
+                        unit=_('files'))
+            if res:
+                j, myscore = res.split(' ')
+                copies[i] = int(j)
+                best[i] = float(myscore)
+        ui.progress(_('scoring similar files'), None)
+        del rdata
+    ui.progress(_('searching for similar files'), None)
+
+    for i in sorted(copies):
+        yield removed[copies[i]], added[i], best[i]
 
 def _dropempty(fctxs):
     return [x for x in fctxs if x.size() > 0]
@@ -7,7 +7,10 @@
 
 from __future__ import absolute_import
 
+import os
 import re
+import stat
+import tempfile
 
 from .i18n import _
 from . import (
@@ -40,6 +43,43 @@ def _serverquote(s):
         return s
     return "'%s'" % s.replace("'", "'\\''")
 
+def _controlargs(ui):
+    """return the ssh arguments sharing connections to a host through a
+    control socket, or '' if connections are not shared
+
+    The first connection to a host becomes the master connection, kept
+    alive in the background for ``experimental.ssh.controlpersist`` after
+    the last connection using it is closed. This requires OpenSSH.
+    """
+    # experimental config: experimental.ssh.controlpersist
+    persist = ui.config('experimental', 'ssh.controlpersist')
+    if not persist or pycompat.osname == 'nt':
+        return ''
+    # experimental config: experimental.ssh.controldir
+    controldir = ui.config('experimental', 'ssh.controldir')
+    if controldir:
+        controldir = util.expandpath(controldir)
+    else:
+        controldir = os.path.join(tempfile.gettempdir(),
+                                  'hg-ssh-%s' % util.getuser())
+    try:
+        if not os.path.isdir(controldir):
+            util.makedirs(controldir, 0o700)
+        st = os.lstat(controldir)
+    except OSError as inst:
+        ui.warn(_('not sharing ssh connections: %s\n') % inst)
+        return ''
+    # anybody able to write there could hijack the connections
+    if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid()
+        or st.st_mode & 0o077):
+        ui.warn(_('not sharing ssh connections: %s is not a private '
+                  'directory\n') % controldir)
+        return ''
+    controlpath = os.path.join(controldir, '%r@%h:%p')
+    return '-o ControlMaster=auto -o %s -o %s' % (
+        util.shellquote('ControlPath=%s' % controlpath),
+        util.shellquote('ControlPersist=%s' % persist))
+
 def _forwardoutput(ui, pipe):
     """display all data currently available on pipe as remote output.
 
@@ -153,6 +193,9 @@ class sshpeer(wireproto.wirepeer):
                             _serverquote(self.host),
                             _serverquote(self.user),
                             _serverquote(self.port))
+        controlargs = _controlargs(ui)
+        if controlargs:
+            args = '%s %s' % (args, controlargs)
 
         if create:
             cmd = '%s %s %s' % (sshcmd, args,
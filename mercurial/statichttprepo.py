@@ -163,6 +163,10 @@ class statichttprepository(localrepo.localrepository):
         self.nodetagscache = None
         self._branchcaches = {}
         self._revbranchcache = None
+        self._copiescache = None
+        self._copiesindex = None
+        self._pathindex = None
+        self._textindex = None
         self.encodepats = None
         self.decodepats = None
         self._transref = None
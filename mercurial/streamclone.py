@@ -7,14 +7,21 @@
 
 from __future__ import absolute_import
 
+import contextlib
+import os
+import shutil
 import struct
+import tempfile
 
 from .i18n import _
 from . import (
     branchmap,
+    changegroup,
     error,
     phases,
+    repoview,
     store,
+    tags,
     util,
 )
 
@@ -34,8 +41,10 @@ def canperformstreamclone(pullop, bailifbundle2supported=False):
     remote = pullop.remote
 
     bundle2supported = False
-    if pullop.canusebundle2:
-        if 'v1' in pullop.remotebundle2caps.get('stream', []):
+    # experimental config: experimental.bundle2.stream
+    if (pullop.canusebundle2
+        and repo.ui.configbool('experimental', 'bundle2.stream')):
+        if 'v2' in pullop.remotebundle2caps.get('stream', []):
             bundle2supported = True
         # else
             # Server doesn't support bundle2 stream clone or doesn't support
@@ -45,8 +54,8 @@ def canperformstreamclone(pullop, bailifbundle2supported=False):
     if bailifbundle2supported and bundle2supported:
         return False, None
     # Ensures bundle2 doesn't try to do a stream clone if it isn't supported.
-    #elif not bailifbundle2supported and not bundle2supported:
-    #    return False, None
+    elif not bailifbundle2supported and not bundle2supported:
+        return False, None
 
     # Streaming clone only works on empty repositories.
     if len(repo):
@@ -110,7 +119,8 @@ def maybeperformlegacystreamclone(pullop):
     A legacy stream clone will not be performed if a bundle2 stream clone is
     supported.
     """
-    supported, requirements = canperformstreamclone(pullop)
+    supported, requirements = canperformstreamclone(
+        pullop, bailifbundle2supported=True)
 
     if not supported:
         return
@@ -330,7 +340,8 @@ def consumev1(repo, fp, filecount, bytecount):
         # clonebundles).
 
         with repo.transaction('clone'):
-            with repo.svfs.backgroundclosing(repo.ui, expectedcount=filecount):
+            with repo.svfs.backgroundclosing(repo.ui, expectedcount=filecount,
+                                             backgroundwrite=True):
                 for i in xrange(filecount):
                     # XXX doesn't support '\n' or '\r' in filenames
                     l = fp.readline()
@@ -345,7 +356,7 @@ def consumev1(repo, fp, filecount, bytecount):
                                       (name, util.bytecount(size)))
                     # for backwards compat, name was partially encoded
                     path = store.decodedir(name)
-                    with repo.svfs(path, 'w', backgroundclose=True) as ofp:
+                    with repo.svfs(path, 'w', backgroundwrite=True) as ofp:
                         for chunk in util.filechunkiter(fp, limit=size):
                             handled_bytes += len(chunk)
                             repo.ui.progress(_('clone'), handled_bytes,
@@ -412,3 +423,206 @@ class streamcloneapplier(object):
 
     def apply(self, repo):
         return applybundlev1(repo, self._fh)
+
+# sources of the files of a version 2 stream
+_srcstore = 's'
+_srccache = 'c'
+
+# header of the files of a version 2 stream: source, length of the name and
+# length of the data
+_v2fileheader = struct.Struct('>cHQ')
+
+def _makemap(repo):
+    """make a source -> vfs map for the files of a version 2 stream"""
+    return {
+        _srcstore: repo.svfs,
+        _srccache: repo.cachevfs,
+    }
+
+def _cachetostream(repo):
+    """names of the cache files sent in a version 2 stream
+
+    These caches are expensive to compute from scratch on large
+    repositories, and validate themselves against the changelog."""
+    names = ['branch2']
+    names.extend('branch2-%s' % f for f in sorted(repoview.filtertable))
+    names.extend([branchmap._rbcnames, branchmap._rbcrevs,
+                  tags._fnodescachefile])
+    return names
+
+# This is it's own function so extensions can override it.
+def _walkstreamvolatilefiles(repo):
+    """names of the non-revlog store files sent in a version 2 stream,
+    that may be rewritten in place"""
+    # the obsstore is rewritten when markers are deleted
+    return ['obsstore', 'phaseroots']
+
+@contextlib.contextmanager
+def _volatilecopies():
+    """return a function copying a file to a temporary directory, removed
+    on exit"""
+    tmpdir = tempfile.mkdtemp(prefix='hg-stream-')
+    try:
+        def copy(src):
+            fd, dst = tempfile.mkstemp(dir=tmpdir)
+            os.close(fd)
+            util.copyfile(src, dst)
+            return dst
+        yield copy
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+def _emitv2(repo, entries, totalbytes):
+    """emit the files of a version 2 stream
+
+    ``entries`` is a list of (source, name, size) for files that are only
+    appended to, the first ``size`` bytes of the file being sent, and of
+    (source, name, None) for files that may be rewritten: these are copied
+    before the first item is yielded. The first item is None, the caller must
+    hold the repository lock until it has been consumed.
+    """
+    vfsmap = _makemap(repo)
+    debugflag = repo.ui.debugflag
+    with _volatilecopies() as copy:
+        snapshot = []
+        for src, name, size in entries:
+            path = None
+            if size is None:
+                path = copy(vfsmap[src].join(name))
+                size = os.stat(path).st_size
+            snapshot.append((src, name, size, path))
+        yield None
+
+        for src, name, size, path in snapshot:
+            if debugflag:
+                repo.ui.debug('sending %s (%d bytes)\n' % (name, size))
+            yield _v2fileheader.pack(src, len(name), size) + name
+            if path is None:
+                # auditing at this stage is both pointless (paths are
+                # already trusted by the local repo) and expensive
+                fp = vfsmap[src](name, 'rb', auditpath=False)
+            else:
+                fp = open(path, 'rb')
+            with fp:
+                if size <= 65536:
+                    yield fp.read(size)
+                else:
+                    for chunk in util.filechunkiter(fp, limit=size):
+                        yield chunk
+
+def generatev2(repo, includeobsmarkers=True):
+    """Emit content for version 2 of a streaming clone.
+
+    This returns a 3-tuple of (file count, byte size, data iterator).
+
+    Version 2 streams are sent in a bundle2 part. On top of the revlogs, they
+    carry the obsstore, unless ``includeobsmarkers`` is False, the phase
+    roots and the caches listed by ``_cachetostream``, so the client does not
+    have to rebuild them.
+
+    The data iterator consists of N entries for each file being transferred.
+    Each entry starts with a header made of the source of the file (1 byte,
+    "s" for the store, "c" for the cache directory), the length of its name
+    (16 bits big endian unsigned integer) and the length of its data (64 bits
+    big endian unsigned integer). The name follows, then the raw file data.
+
+    The set of files and their size is taken under the repository lock, and
+    the files that may be rewritten in place are copied at that time, so the
+    stream is a consistent snapshot.
+    """
+    with repo.lock():
+        repo.ui.debug('scanning\n')
+        entries = []
+        totalbytes = 0
+        for name, ename, size in _walkstreamfiles(repo):
+            if size:
+                entries.append((_srcstore, name, size))
+                totalbytes += size
+        volatile = [(_srcstore, name)
+                    for name in _walkstreamvolatilefiles(repo)
+                    if includeobsmarkers or name != 'obsstore']
+        volatile.extend((_srccache, name) for name in _cachetostream(repo))
+        vfsmap = _makemap(repo)
+        for src, name in volatile:
+            vfs = vfsmap[src]
+            if vfs.exists(name):
+                entries.append((src, name, None))
+                totalbytes += vfs.lstat(name).st_size
+
+        it = _emitv2(repo, entries, totalbytes)
+        # make the copies of the volatile files under the lock
+        first = next(it)
+        assert first is None
+
+    repo.ui.debug('%d files, %d bytes to transfer\n' %
+                  (len(entries), totalbytes))
+    return len(entries), totalbytes, it
+
+def consumev2(repo, fp, filecount, bytecount):
+    """Apply the contents from version 2 of a streaming clone file handle.
+
+    The byte count is only used for progress reporting, as volatile files
+    may have changed size since it was computed.
+    """
+    with repo.lock():
+        repo.ui.status(_('%d files to transfer, %s of data\n') %
+                       (filecount, util.bytecount(bytecount)))
+        handledbytes = 0
+        repo.ui.progress(_('clone'), 0, total=bytecount, unit=_('bytes'))
+        start = util.timer()
+        vfsmap = _makemap(repo)
+
+        # see consumev1 about the nested transaction
+        with repo.transaction('clone'):
+            with repo.svfs.backgroundclosing(repo.ui, expectedcount=filecount,
+                                             backgroundwrite=True):
+                for i in xrange(filecount):
+                    header = changegroup.readexactly(fp, _v2fileheader.size)
+                    src, namelen, size = _v2fileheader.unpack(header)
+                    vfs = vfsmap.get(src)
+                    if vfs is None:
+                        raise error.Abort(_('unknown stream clone file '
+                                            'source: %s') % src)
+                    name = changegroup.readexactly(fp, namelen)
+                    if repo.ui.debugflag:
+                        repo.ui.debug('adding %s (%s)\n' %
+                                      (name, util.bytecount(size)))
+                    background = vfs is repo.svfs
+                    with vfs(name, 'w', backgroundwrite=background) as ofp:
+                        for chunk in util.filechunkiter(fp, limit=size):
+                            handledbytes += len(chunk)
+                            repo.ui.progress(_('clone'), handledbytes,
+                                             total=bytecount, unit=_('bytes'))
+                            ofp.write(chunk)
+
+            # force @filecache properties to be reloaded from
+            # streamclone-ed file at next access
+            repo.invalidate(clearfilecache=True)
+
+        elapsed = util.timer() - start
+        if elapsed <= 0:
+            elapsed = 0.001
+        repo.ui.progress(_('clone'), None)
+        repo.ui.status(_('transferred %s in %.1f seconds (%s/sec)\n') %
+                       (util.bytecount(handledbytes), elapsed,
+                        util.bytecount(handledbytes / elapsed)))
+
+def applybundlev2(repo, fp, filecount, bytecount, requirements):
+    """Apply the content of a version 2 stream sent in a bundle2 part."""
+    missingreqs = set(requirements) - repo.supportedformats
+    if missingreqs:
+        raise error.Abort(_('unable to apply stream clone: '
+                            'unsupported format: %s') %
+                          ', '.join(sorted(missingreqs)))
+
+    consumev2(repo, fp, filecount, bytecount)
+
+    # new requirements = old non-format requirements +
+    #                    new format-related remote requirements
+    # requirements from the streamed-in repository
+    repo.requirements = set(requirements) | (
+            repo.requirements - repo.supportedformats)
+    repo._applyopenerreqs()
+    repo._writerequirements()
+    # the streamed caches are picked up on next access
+    repo.invalidatecaches()
@@ -0,0 +1,105 @@
+# textindex.py - index of the text of the changesets
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""persistent index of the text of the changesets
+
+The ``keyword()``, ``desc()`` and ``grep()`` revsets and the keyword search of
+hgweb look for a string in the description, the user and the files of every
+changeset. With ``experimental.text-index`` set, ``.hg/cache/textindex-v1``
+records for each sequence of three ASCII characters the revisions whose text
+contains it, ignoring case, and those searches only check the revisions
+containing all the sequences of the searched string.
+
+The sequences are taken from the UTF-8 text stored in the changelog, those
+containing newlines or non-ASCII characters are not indexed. Non-ASCII
+characters may be folded to 'i' or 'k' (U+0130, U+212A), or replaced by '?'
+when converted to the local encoding, so the revisions with non-ASCII text
+are also indexed under a separate key, and are candidates to any search for
+these characters.
+
+The file has the format of the other indexes of revisions by key, see
+revindex.
+"""
+
+from __future__ import absolute_import
+
+import re
+
+from . import (
+    encoding,
+    error,
+    revindex,
+)
+
+# key of the revisions with non-ASCII text
+_nonascii = '\x80'
+_nonasciire = re.compile(r'[\x80-\xff]')
+
+# characters non-ASCII characters may be turned into
+_foldedchars = 'ik?'
+
+# lowercase the ASCII characters, unlike encoding.asciilower, the others are
+# kept as they are
+_lowertable = ''.join(chr(c + 32) if ord('A') <= c <= ord('Z') else chr(c)
+                      for c in xrange(256))
+
+# separators of the runs of indexed characters
+_unindexedre = re.compile(r'[\x80-\xff\n\0]+')
+
+def enabled(repo):
+    # experimental config: experimental.text-index
+    return repo.ui.configbool('experimental', 'text-index')
+
+def _trigrams(text):
+    """return the indexed sequences of three characters of the lowercase
+    text"""
+    trigrams = set()
+    for run in _unindexedre.split(text):
+        trigrams.update(run[i:i + 3] for i in xrange(len(run) - 2))
+    return trigrams
+
+def _keys(cl, rev):
+    # parse the UTF-8 text the way changelog.changelogrevision does
+    text = cl.revision(rev)
+    last = text.index('\n\n')
+    lines = text[:last].split('\n')
+    text = '\n'.join([text[last + 2:], lines[1]] + lines[3:])
+    keys = _trigrams(text.translate(_lowertable))
+    if _nonasciire.search(text):
+        keys.add(_nonascii)
+    return keys
+
+def textindex(repo):
+    """return the index of the sequences of three characters of the text of
+    the changesets of the unfiltered repository repo"""
+    return revindex.revindex(repo, 'textindex-v1', 'HGTI', _keys)
+
+def candidates(repo, text):
+    """return the set of revisions whose description, user or files may
+    contain text, ignoring case, or None if the index can't tell"""
+    if not enabled(repo):
+        return None
+    try:
+        text = encoding.fromlocal(text).translate(_lowertable)
+    except error.Abort:
+        return None
+    trigrams = _trigrams(text)
+    if not trigrams:
+        return None
+    index = repo.textindex()
+    index.update()
+    revs = None
+    for trigram in trigrams:
+        if revs is None:
+            revs = set(index.revs(trigram))
+        else:
+            revs.intersection_update(index.revs(trigram))
+        if not revs:
+            break
+    if any(c in text for c in _foldedchars):
+        revs.update(index.revs(_nonascii))
+    return revs
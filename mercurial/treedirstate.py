@@ -0,0 +1,252 @@
+# treedirstate.py - directory keyed, appendable dirstate file format
+#
+#  Copyright 2017 Matt Mackall <mpm@selenic.com> and others
+#
+# This software may be used and distributed according to the terms of the
+# GNU General Public License version 2 or any later version.
+
+"""directory keyed, appendable dirstate file format
+
+The regular dirstate file is rewritten from scratch every time the state
+of the working directory changes, and is parsed entirely by every command
+looking at it. This format groups the entries by directory behind a sorted
+index, so the entries of a single directory can be loaded without parsing
+the whole file, and records changes by appending them to the file.
+
+File format:
+
+  header: 4 bytes magic, 1 byte version, 3 bytes padding, 4 bytes number
+          of directories, 4 bytes number of entries, 4 bytes offset of the
+          entries, 4 bytes offset of the end of the entries, then the
+          parents (40 bytes) at the time the file was written.
+  directory index: one record per directory, sorted by directory name,
+          holding 4 bytes offset and 4 bytes length of the name, 4 bytes
+          offset and 4 bytes length of the entries of the directory.
+  names: names of the directories.
+  entries: for each directory, the entries of the files it directly
+          contains, in the format of the regular dirstate file.
+  appended blocks: 4 bytes magic, 4 bytes length of the content and 4 bytes
+          number of entries, then the content: the parents (40 bytes)
+          followed by entries in the format of the regular dirstate file.
+          Entries with the 'x' state record dropped files.
+
+Entries of an appended block supersede the ones written before them. An
+incomplete block at the end of the file, from an interrupted write, is
+ignored.
+"""
+
+from __future__ import absolute_import
+
+import struct
+
+from .i18n import _
+from . import (
+    error,
+    policy,
+    util,
+)
+
+parsers = policy.importmod(r'parsers')
+
+_magic = 'HGDT'
+_blockmagic = 'HGDA'
+_version = 1
+
+headerstruct = struct.Struct('>4sBxxxIIII40s')
+dirstruct = struct.Struct('>IIII')
+blockstruct = struct.Struct('>4sII')
+entrystruct = struct.Struct('>cllll')
+
+# state of the entries recording dropped files in appended blocks
+_dropped = 'x'
+
+def _damaged():
+    return error.Abort(_('working directory state appears damaged!'))
+
+def _dirname(f):
+    return f.rpartition('/')[0]
+
+class reader(object):
+    """read access to the content of a tree dirstate file"""
+
+    def __init__(self, data):
+        self._data = data
+        try:
+            (magic, version, ndirs, count, entriesoffset, end,
+             parents) = headerstruct.unpack_from(data)
+        except struct.error:
+            raise _damaged()
+        if (magic != _magic or version != _version or end > len(data)
+            or entriesoffset > end):
+            raise _damaged()
+        self._ndirs = ndirs
+        self._entriesoffset = entriesoffset
+        self._end = end
+        # number of entries in the base part of the file
+        self.basecount = count
+        # number of entries in the appended blocks
+        self.appendedcount = 0
+        self.parents = parents
+        self._blocks = []
+        off = end
+        while off + blockstruct.size <= len(data):
+            magic, length, count = blockstruct.unpack_from(data, off)
+            start = off + blockstruct.size
+            if (magic != _blockmagic or length < 40
+                or start + length > len(data)):
+                # interrupted append
+                break
+            self._blocks.append((start, start + length))
+            self.appendedcount += count
+            self.parents = data[start:start + 40]
+            off = start + length
+        # length of the valid content of the file
+        self.size = off
+        self._appended = None
+        self._dircache = {}
+
+    def _parseblocks(self):
+        """return the entries and copies of the appended blocks"""
+        if self._appended is None:
+            entries = {}
+            copies = {}
+            for start, end in self._blocks:
+                e, c = {}, {}
+                parsers.parse_dirstate(e, c, self._data[start:end])
+                for f in e:
+                    copies.pop(f, None)
+                entries.update(e)
+                copies.update(c)
+            self._appended = entries, copies
+        return self._appended
+
+    def parse(self, dmap, copymap):
+        """fill dmap and copymap with the content of the file"""
+        data = self._data
+        parsers.parse_dirstate(dmap, copymap,
+                               '\0' * 40 + data[self._entriesoffset:self._end])
+        entries, copies = self._parseblocks()
+        for f, e in entries.iteritems():
+            copymap.pop(f, None)
+            if e[0] == _dropped:
+                dmap.pop(f, None)
+            else:
+                dmap[f] = e
+        copymap.update(copies)
+
+    def _finddir(self, d):
+        """return the (offset, length) of the entries of a directory"""
+        data = self._data
+        lo = 0
+        hi = self._ndirs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            noff, nlen, eoff, elen = dirstruct.unpack_from(
+                data, headerstruct.size + mid * dirstruct.size)
+            name = data[noff:noff + nlen]
+            if name < d:
+                lo = mid + 1
+            elif name > d:
+                hi = mid
+            else:
+                return eoff, elen
+        return None
+
+    def readdir(self, d):
+        """return the entries and copies of the files directly in d
+
+        Only the entries of that directory are parsed."""
+        cached = self._dircache.get(d)
+        if cached is not None:
+            return cached
+        dmap = {}
+        copymap = {}
+        loc = self._finddir(d)
+        if loc is not None:
+            eoff, elen = loc
+            parsers.parse_dirstate(dmap, copymap,
+                                   '\0' * 40 + self._data[eoff:eoff + elen])
+        entries, copies = self._parseblocks()
+        for f, e in entries.iteritems():
+            if _dirname(f) != d:
+                continue
+            copymap.pop(f, None)
+            if e[0] == _dropped:
+                dmap.pop(f, None)
+            else:
+                dmap[f] = e
+        for f, source in copies.iteritems():
+            if _dirname(f) == d:
+                copymap[f] = source
+        self._dircache[d] = dmap, copymap
+        return dmap, copymap
+
+    def get(self, f):
+        """return the entry of a file, or None"""
+        return self.readdir(_dirname(f))[0].get(f)
+
+def read(fp):
+    """return a reader for the content of an open tree dirstate file, or
+    None if the file is empty"""
+    try:
+        data = util.mmapread(fp)
+    except (ValueError, EnvironmentError):
+        data = fp.read()
+    if not data:
+        return None
+    return reader(data)
+
+def _packentries(dmap, copymap, files):
+    pack = entrystruct.pack
+    dropped = (_dropped, 0, 0, 0)
+    out = []
+    for f in files:
+        e = dmap.get(f, dropped)
+        if f in copymap:
+            f = '%s\0%s' % (f, copymap[f])
+        out.append(pack(e[0], e[1], e[2], e[3], len(f)))
+        out.append(f)
+    return ''.join(out)
+
+def pack(dmap, copymap, pl, now):
+    """return the full content of a tree dirstate file
+
+    Like parsers.pack_dirstate, the mtime of normal entries modified at
+    ``now`` is unset, in the file and in dmap, as the file could still be
+    changed within the same second."""
+    dirs = {}
+    ambiguous = []
+    for f, e in dmap.iteritems():
+        if e[0] == 'n' and e[3] == now:
+            ambiguous.append(f)
+        dirs.setdefault(_dirname(f), []).append(f)
+    for f in ambiguous:
+        e = dmap[f]
+        dmap[f] = parsers.dirstatetuple(e[0], e[1], e[2], -1)
+
+    names = sorted(dirs)
+    nameoffset = headerstruct.size + len(names) * dirstruct.size
+    entriesoffset = nameoffset + sum(len(d) for d in names)
+    index = []
+    blocks = []
+    offset = entriesoffset
+    for d in names:
+        block = _packentries(dmap, copymap, sorted(dirs[d]))
+        index.append(dirstruct.pack(nameoffset, len(d), offset, len(block)))
+        nameoffset += len(d)
+        offset += len(block)
+        blocks.append(block)
+    header = headerstruct.pack(_magic, _version, len(names), len(dmap),
+                               entriesoffset, offset, pl[0] + pl[1])
+    return ''.join([header] + index + names + blocks)
+
+def packblock(dmap, copymap, pl, files):
+    """return a block recording the current state of files, to be appended
+    to a tree dirstate file"""
+    content = pl[0] + pl[1] + _packentries(dmap, copymap, sorted(files))
+    return blockstruct.pack(_blockmagic, len(content), len(files)) + content
+
+def needscompaction(appended, live):
+    """tell if a file with ``appended`` entries in appended blocks and
+    ``live`` current entries should be rewritten instead of appended to"""
+    return appended > live
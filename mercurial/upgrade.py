@@ -60,7 +60,9 @@ def supportremovedrequirements(repo):
     the dropped requirement must appear in the returned set for the upgrade
     to be allowed.
     """
-    return set()
+    return {
+        localrepo.TREEDIRSTATE_REQUIREMENT,
+    }
 
 def supporteddestrequirements(repo):
     """Obtain requirements that upgrade supports in the destination.
@@ -76,6 +78,7 @@ def supporteddestrequirements(repo):
         'generaldelta',
         'revlogv1',
         'store',
+        localrepo.TREEDIRSTATE_REQUIREMENT,
     }
 
 def allowednewrequirements(repo):
@@ -92,6 +95,7 @@ def allowednewrequirements(repo):
         'dotencode',
         'fncache',
         'generaldelta',
+        localrepo.TREEDIRSTATE_REQUIREMENT,
     }
 
 deficiency = 'deficiency'
@@ -254,6 +258,22 @@ class generaldelta(requirementformatvariant):
                        'CPU resources, making "hg push" and "hg pull" '
                        'faster')
 
+@registerformatvariant
+class treedirstate(requirementformatvariant):
+    name = localrepo.TREEDIRSTATE_REQUIREMENT
+
+    _requirement = localrepo.TREEDIRSTATE_REQUIREMENT
+
+    default = False
+
+    description = _('the working directory state is rewritten and parsed '
+                    'entirely by commands changing or reading it; they are '
+                    'slower than they could be with many tracked files')
+
+    upgrademessage = _('the working directory state will be stored by '
+                       'directory; changes will be appended to it and '
+                       'commands will only read the entries they need')
+
 @registerformatvariant
 class removecldeltachain(formatvariant):
     name = 'removecldeltachain'
@@ -570,6 +590,24 @@ def _finishdatamigration(ui, srcrepo, dstrepo, requirements):
     before the new store is swapped into the original location.
     """
 
+def _convertdirstate(ui, srcrepo, requirements, backupvfs):
+    """Rewrite the dirstate file if its format changes during the upgrade."""
+    treereq = localrepo.TREEDIRSTATE_REQUIREMENT
+    totree = treereq in requirements
+    if totree == (treereq in srcrepo.requirements):
+        return
+    if not srcrepo.vfs.exists('dirstate'):
+        return
+    ui.write(_('converting working directory state\n'))
+    util.copyfile(srcrepo.vfs.join('dirstate'), backupvfs.join('dirstate'))
+    ds = srcrepo.dirstate
+    # load the entries in the current format before switching
+    ds._map
+    ds._treeformat = totree
+    ds._treestat = None
+    ds._dirty = True
+    ds.write(None)
+
 def _upgraderepo(ui, srcrepo, dstrepo, requirements, actions):
     """Do the low-level work of upgrading a repository.
 
@@ -645,6 +683,10 @@ def _upgraderepo(ui, srcrepo, dstrepo, requirements, actions):
     ui.write(_('store replacement complete; repository was inconsistent for '
                '%0.1fs\n') % elapsed)
 
+    # The working directory state is not part of the store, convert it while
+    # clients are locked out.
+    _convertdirstate(ui, srcrepo, requirements, backupvfs)
+
     # We first write the requirements file. Any new requirements will lock
     # out legacy clients.
     ui.write(_('finalizing requirements file and making repository readable '
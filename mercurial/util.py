@@ -25,6 +25,7 @@ import errno
 import gc
 import hashlib
 import imp
+import mmap
 import os
 import platform as pyplatform
 import re as remod
@@ -1729,6 +1730,19 @@ def appendfile(path, text):
     with open(path, 'ab') as fp:
         fp.write(text)
 
+def mmapread(fp):
+    """map the content of an open file (or file descriptor) read-only
+
+    Empty files cannot be mapped, an empty string is returned for them.
+    """
+    fd = getattr(fp, 'fileno', lambda: fp)()
+    try:
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        if os.fstat(fd).st_size == 0:
+            return ''
+        raise
+
 class chunkbuffer(object):
     """Allow arbitrary sized chunks of data to be efficiently read from an
     iterator over chunks of arbitrary size."""
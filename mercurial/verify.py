@@ -7,6 +7,7 @@
 
 from __future__ import absolute_import
 
+import copy
 import os
 
 from .i18n import _
@@ -20,6 +21,7 @@ from . import (
     revlog,
     scmutil,
     util,
+    worker,
 )
 
 def verify(repo):
@@ -51,9 +53,18 @@ class verifier(object):
         self.fncachewarned = False
         # developer config: verify.skipflags
         self.skipflags = repo.ui.configint('verify', 'skipflags')
+        # messages recorded instead of written when checking files in a
+        # worker process, see _verifyfilesparallel
+        self._output = None
+
+    def _write(self, kind, msg):
+        if self._output is not None:
+            self._output.append((kind, msg))
+        else:
+            getattr(self.ui, kind)(msg)
 
     def warn(self, msg):
-        self.ui.warn(msg + "\n")
+        self._write('warn', msg + "\n")
         self.warnings += 1
 
     def err(self, linkrev, msg, filename=None):
@@ -64,7 +75,7 @@ class verifier(object):
         msg = "%s: %s" % (linkrev, msg)
         if filename:
             msg = "%s@%s" % (filename, msg)
-        self.ui.warn(" " + msg + "\n")
+        self._write('warn', " " + msg + "\n")
         self.errors += 1
 
     def exc(self, linkrev, msg, inst, filename=None):
@@ -327,9 +338,7 @@ class verifier(object):
     def _verifyfiles(self, filenodes, filelinkrevs):
         repo = self.repo
         ui = self.ui
-        lrugetctx = self.lrugetctx
         revlogv1 = self.revlogv1
-        havemf = self.havemf
         ui.status(_("checking files\n"))
 
         storefiles = set()
@@ -340,149 +349,230 @@ class verifier(object):
                 storefiles.add(_normpath(f))
 
         files = sorted(set(filenodes) | set(filelinkrevs))
+        # experimental config: experimental.verify-workers
+        if ui.configbool('experimental', 'verify-workers'):
+            revisions = self._verifyfilesparallel(files, filenodes,
+                                                  filelinkrevs, storefiles)
+        else:
+            total = len(files)
+            revisions = 0
+            for i, f in enumerate(files):
+                ui.progress(_('checking'), i, item=f, total=total,
+                            unit=_('files'))
+                revisions += self._verifyfile(f, filenodes, filelinkrevs,
+                                              storefiles)
+        ui.progress(_('checking'), None)
+
+        for f in sorted(storefiles):
+            self.warn(_("warning: orphan revlog '%s'") % f)
+
+        return len(files), revisions
+
+    def _verifyfilesparallel(self, files, filenodes, filelinkrevs,
+                             storefiles):
+        """check filelogs in worker processes
+
+        Workers record the messages of the files they check, this process
+        writes them back in the order a serial verify would have. Returns the
+        number of checked revisions.
+        """
+        ui = self.ui
         total = len(files)
         revisions = 0
-        for i, f in enumerate(files):
-            ui.progress(_('checking'), i, item=f, total=total, unit=_('files'))
-            try:
-                linkrevs = filelinkrevs[f]
-            except KeyError:
-                # in manifest but not in changelog
-                linkrevs = []
+        pending = {}
+        nextidx = 0
+        prog = worker.worker(ui, 0.01, _verifyfilesworker,
+                             (self, filenodes, filelinkrevs, storefiles),
+                             list(enumerate(files)))
+        for i, data in prog:
+            pending[i] = util.pickle.loads(util.unescapestr(data))
+            while nextidx in pending:
+                res = pending.pop(nextidx)
+                ui.progress(_('checking'), nextidx, item=files[nextidx],
+                            total=total, unit=_('files'))
+                for kind, msg in res['output']:
+                    getattr(ui, kind)(msg)
+                self.errors += res['errors']
+                self.warnings += res['warnings']
+                self.badrevs.update(res['badrevs'])
+                if res['fncachewarned']:
+                    self.fncachewarned = True
+                storefiles.difference_update(res['storefiles'])
+                revisions += res['revisions']
+                nextidx += 1
+        return revisions
 
-            if linkrevs:
-                lr = linkrevs[0]
-            else:
-                lr = None
+    def _verifyfile(self, f, filenodes, filelinkrevs, storefiles):
+        """check the filelog of a file, returns its number of revisions"""
+        repo = self.repo
+        ui = self.ui
+        lrugetctx = self.lrugetctx
+        havemf = self.havemf
+        revisions = 0
+        try:
+            linkrevs = filelinkrevs[f]
+        except KeyError:
+            # in manifest but not in changelog
+            linkrevs = []
 
-            try:
-                fl = repo.file(f)
-            except error.RevlogError as e:
-                self.err(lr, _("broken revlog! (%s)") % e, f)
-                continue
-
-            for ff in fl.files():
-                try:
-                    storefiles.remove(ff)
-                except KeyError:
-                    self.warn(_(" warning: revlog '%s' not in fncache!") % ff)
-                    self.fncachewarned = True
+        if linkrevs:
+            lr = linkrevs[0]
+        else:
+            lr = None
 
-            self.checklog(fl, f, lr)
-            seen = {}
-            rp = None
-            for i in fl:
-                revisions += 1
-                n = fl.node(i)
-                lr = self.checkentry(fl, i, n, seen, linkrevs, f)
-                if f in filenodes:
-                    if havemf and n not in filenodes[f]:
-                        self.err(lr, _("%s not in manifests") % (short(n)), f)
-                    else:
-                        del filenodes[f][n]
-
-                # Verify contents. 4 cases to care about:
-                #
-                #   common: the most common case
-                #   rename: with a rename
-                #   meta: file content starts with b'\1\n', the metadata
-                #         header defined in filelog.py, but without a rename
-                #   ext: content stored externally
-                #
-                # More formally, their differences are shown below:
-                #
-                #                       | common | rename | meta  | ext
-                #  -------------------------------------------------------
-                #   flags()             | 0      | 0      | 0     | not 0
-                #   renamed()           | False  | True   | False | ?
-                #   rawtext[0:2]=='\1\n'| False  | True   | True  | ?
-                #
-                # "rawtext" means the raw text stored in revlog data, which
-                # could be retrieved by "revision(rev, raw=True)". "text"
-                # mentioned below is "revision(rev, raw=False)".
-                #
-                # There are 3 different lengths stored physically:
-                #  1. L1: rawsize, stored in revlog index
-                #  2. L2: len(rawtext), stored in revlog data
-                #  3. L3: len(text), stored in revlog data if flags==0, or
-                #     possibly somewhere else if flags!=0
-                #
-                # L1 should be equal to L2. L3 could be different from them.
-                # "text" may or may not affect commit hash depending on flag
-                # processors (see revlog.addflagprocessor).
-                #
-                #              | common  | rename | meta  | ext
-                # -------------------------------------------------
-                #    rawsize() | L1      | L1     | L1    | L1
-                #       size() | L1      | L2-LM  | L1(*) | L1 (?)
-                # len(rawtext) | L2      | L2     | L2    | L2
-                #    len(text) | L2      | L2     | L2    | L3
-                #  len(read()) | L2      | L2-LM  | L2-LM | L3 (?)
-                #
-                # LM:  length of metadata, depending on rawtext
-                # (*): not ideal, see comment in filelog.size
-                # (?): could be "- len(meta)" if the resolved content has
-                #      rename metadata
-                #
-                # Checks needed to be done:
-                #  1. length check: L1 == L2, in all cases.
-                #  2. hash check: depending on flag processor, we may need to
-                #     use either "text" (external), or "rawtext" (in revlog).
-                try:
-                    skipflags = self.skipflags
-                    if skipflags:
-                        skipflags &= fl.flags(i)
-                    if not skipflags:
-                        fl.read(n) # side effect: read content and do checkhash
-                        rp = fl.renamed(n)
-                    # the "L1 == L2" check
-                    l1 = fl.rawsize(i)
-                    l2 = len(fl.revision(n, raw=True))
-                    if l1 != l2:
-                        self.err(lr, _("unpacked size is %s, %s expected") %
-                                 (l2, l1), f)
-                except error.CensoredNodeError:
-                    # experimental config: censor.policy
-                    if ui.config("censor", "policy") == "abort":
-                        self.err(lr, _("censored file data"), f)
-                except Exception as inst:
-                    self.exc(lr, _("unpacking %s") % short(n), inst, f)
-
-                # check renames
-                try:
-                    if rp:
-                        if lr is not None and ui.verbose:
-                            ctx = lrugetctx(lr)
-                            found = False
-                            for pctx in ctx.parents():
-                                if rp[0] in pctx:
-                                    found = True
-                                    break
-                            if not found:
-                                self.warn(_("warning: copy source of '%s' not"
-                                            " in parents of %s") % (f, ctx))
-                        fl2 = repo.file(rp[0])
-                        if not len(fl2):
-                            self.err(lr, _("empty or missing copy source "
-                                     "revlog %s:%s") % (rp[0], short(rp[1])), f)
-                        elif rp[1] == nullid:
-                            ui.note(_("warning: %s@%s: copy source"
-                                      " revision is nullid %s:%s\n")
-                                % (f, lr, rp[0], short(rp[1])))
-                        else:
-                            fl2.rev(rp[1])
-                except Exception as inst:
-                    self.exc(lr, _("checking rename of %s") % short(n), inst, f)
+        try:
+            fl = repo.file(f)
+        except error.RevlogError as e:
+            self.err(lr, _("broken revlog! (%s)") % e, f)
+            return revisions
 
-            # cross-check
-            if f in filenodes:
-                fns = [(v, k) for k, v in filenodes[f].iteritems()]
-                for lr, node in sorted(fns):
-                    self.err(lr, _("manifest refers to unknown revision %s") %
-                             short(node), f)
-        ui.progress(_('checking'), None)
+        for ff in fl.files():
+            try:
+                storefiles.remove(ff)
+            except KeyError:
+                self.warn(_(" warning: revlog '%s' not in fncache!") % ff)
+                self.fncachewarned = True
 
-        for f in sorted(storefiles):
-            self.warn(_("warning: orphan revlog '%s'") % f)
+        self.checklog(fl, f, lr)
+        seen = {}
+        rp = None
+        for i in fl:
+            revisions += 1
+            n = fl.node(i)
+            lr = self.checkentry(fl, i, n, seen, linkrevs, f)
+            if f in filenodes:
+                if havemf and n not in filenodes[f]:
+                    self.err(lr, _("%s not in manifests") % (short(n)), f)
+                else:
+                    del filenodes[f][n]
+
+            # Verify contents. 4 cases to care about:
+            #
+            #   common: the most common case
+            #   rename: with a rename
+            #   meta: file content starts with b'\1\n', the metadata
+            #         header defined in filelog.py, but without a rename
+            #   ext: content stored externally
+            #
+            # More formally, their differences are shown below:
+            #
+            #                       | common | rename | meta  | ext
+            #  -------------------------------------------------------
+            #   flags()             | 0      | 0      | 0     | not 0
+            #   renamed()           | False  | True   | False | ?
+            #   rawtext[0:2]=='\1\n'| False  | True   | True  | ?
+            #
+            # "rawtext" means the raw text stored in revlog data, which
+            # could be retrieved by "revision(rev, raw=True)". "text"
+            # mentioned below is "revision(rev, raw=False)".
+            #
+            # There are 3 different lengths stored physically:
+            #  1. L1: rawsize, stored in revlog index
+            #  2. L2: len(rawtext), stored in revlog data
+            #  3. L3: len(text), stored in revlog data if flags==0, or
+            #     possibly somewhere else if flags!=0
+            #
+            # L1 should be equal to L2. L3 could be different from them.
+            # "text" may or may not affect commit hash depending on flag
+            # processors (see revlog.addflagprocessor).
+            #
+            #              | common  | rename | meta  | ext
+            # -------------------------------------------------
+            #    rawsize() | L1      | L1     | L1    | L1
+            #       size() | L1      | L2-LM  | L1(*) | L1 (?)
+            # len(rawtext) | L2      | L2     | L2    | L2
+            #    len(text) | L2      | L2     | L2    | L3
+            #  len(read()) | L2      | L2-LM  | L2-LM | L3 (?)
+            #
+            # LM:  length of metadata, depending on rawtext
+            # (*): not ideal, see comment in filelog.size
+            # (?): could be "- len(meta)" if the resolved content has
+            #      rename metadata
+            #
+            # Checks needed to be done:
+            #  1. length check: L1 == L2, in all cases.
+            #  2. hash check: depending on flag processor, we may need to
+            #     use either "text" (external), or "rawtext" (in revlog).
+            try:
+                skipflags = self.skipflags
+                if skipflags:
+                    skipflags &= fl.flags(i)
+                if not skipflags:
+                    fl.read(n) # side effect: read content and do checkhash
+                    rp = fl.renamed(n)
+                # the "L1 == L2" check
+                l1 = fl.rawsize(i)
+                l2 = len(fl.revision(n, raw=True))
+                if l1 != l2:
+                    self.err(lr, _("unpacked size is %s, %s expected") %
+                             (l2, l1), f)
+            except error.CensoredNodeError:
+                # experimental config: censor.policy
+                if ui.config("censor", "policy") == "abort":
+                    self.err(lr, _("censored file data"), f)
+            except Exception as inst:
+                self.exc(lr, _("unpacking %s") % short(n), inst, f)
 
-        return len(files), revisions
+            # check renames
+            try:
+                if rp:
+                    if lr is not None and ui.verbose:
+                        ctx = lrugetctx(lr)
+                        found = False
+                        for pctx in ctx.parents():
+                            if rp[0] in pctx:
+                                found = True
+                                break
+                        if not found:
+                            self.warn(_("warning: copy source of '%s' not"
+                                        " in parents of %s") % (f, ctx))
+                    fl2 = repo.file(rp[0])
+                    if not len(fl2):
+                        self.err(lr, _("empty or missing copy source "
+                                 "revlog %s:%s") % (rp[0], short(rp[1])), f)
+                    elif rp[1] == nullid:
+                        self._write('note',
+                                    _("warning: %s@%s: copy source"
+                                      " revision is nullid %s:%s\n")
+                                    % (f, lr, rp[0], short(rp[1])))
+                    else:
+                        fl2.rev(rp[1])
+            except Exception as inst:
+                self.exc(lr, _("checking rename of %s") % short(n), inst, f)
+
+        # cross-check
+        if f in filenodes:
+            fns = [(v, k) for k, v in filenodes[f].iteritems()]
+            for lr, node in sorted(fns):
+                self.err(lr, _("manifest refers to unknown revision %s") %
+                         short(node), f)
+        return revisions
+
+def _verifyfilesworker(vrfy, filenodes, filelinkrevs, storefiles, args):
+    """check files in a worker process
+
+    Yields (index, data) pairs, data being the escaped pickle of the outcome
+    of checking a file.
+    """
+    # work on a copy, the function runs in the calling process when spawning
+    # workers is not worth it
+    vrfy = copy.copy(vrfy)
+    for i, f in args:
+        vrfy._output = []
+        vrfy.errors = vrfy.warnings = 0
+        vrfy.badrevs = set()
+        vrfy.fncachewarned = False
+        # revlog files of f that _verifyfile may remove from storefiles
+        known = [ff for ff in ('data/%s.i' % f, 'data/%s.d' % f)
+                 if ff in storefiles]
+        revisions = vrfy._verifyfile(f, filenodes, filelinkrevs, storefiles)
+        res = {
+            'output': vrfy._output,
+            'errors': vrfy.errors,
+            'warnings': vrfy.warnings,
+            'badrevs': vrfy.badrevs,
+            'fncachewarned': vrfy.fncachewarned,
+            'storefiles': [ff for ff in known if ff not in storefiles],
+            'revisions': revisions,
+        }
+        yield i, util.escapestr(util.pickle.dumps(res))
@@ -269,12 +269,16 @@ class abstractvfs(object):
             yield (dirpath[prefixlen:], dirs, files)
 
     @contextlib.contextmanager
-    def backgroundclosing(self, ui, expectedcount=-1):
+    def backgroundclosing(self, ui, expectedcount=-1, backgroundwrite=False):
         """Allow files to be closed asynchronously.
 
         When this context manager is active, ``backgroundclose`` can be passed
         to ``__call__``/``open`` to result in the file possibly being closed
         asynchronously, on a background thread.
+
+        If ``backgroundwrite`` is True, ``backgroundwrite`` can also be passed
+        to ``__call__``/``open``, so the data written to the file may be
+        written on a background thread too.
         """
         # This is an arbitrary restriction and could be changed if we ever
         # have a use case.
@@ -283,7 +287,8 @@ class abstractvfs(object):
             raise error.Abort(
                 _('can only have 1 active background file closer'))
 
-        with backgroundfilecloser(ui, expectedcount=expectedcount) as bfc:
+        with backgroundfilecloser(ui, expectedcount=expectedcount,
+                                  backgroundwrite=backgroundwrite) as bfc:
             try:
                 vfs._backgroundfilecloser = bfc
                 yield bfc
@@ -325,7 +330,7 @@ class vfs(abstractvfs):
 
     def __call__(self, path, mode="r", text=False, atomictemp=False,
                  notindexed=False, backgroundclose=False, checkambig=False,
-                 auditpath=True):
+                 auditpath=True, backgroundwrite=False):
         '''Open ``path`` file, which is relative to vfs root.
 
         Newly created directories are marked as "not to be indexed by
@@ -345,6 +350,11 @@ class vfs(abstractvfs):
            file were opened multiple times, there could be unflushed data
            because the original file handle hasn't been flushed/closed yet.)
 
+        If ``backgroundwrite`` is passed, the data written to the file may
+        also be written asynchronously, when the file is closed. It implies
+        ``backgroundclose`` and the same criteria apply. In addition, the
+        file must only be written to sequentially.
+
         ``checkambig`` argument is passed to atomictemplfile (valid
         only for writing), and is useful only if target file is
         guarded by any lock (e.g. repo.lock or repo.wlock).
@@ -407,13 +417,16 @@ class vfs(abstractvfs):
                                     ' valid for checkambig=True') % mode)
             fp = checkambigatclosing(fp)
 
-        if backgroundclose:
+        if backgroundclose or backgroundwrite:
             if not self._backgroundfilecloser:
                 raise error.Abort(_('backgroundclose can only be used when a '
                                   'backgroundclosing context manager is active')
                                   )
 
-            fp = delayclosedfile(fp, self._backgroundfilecloser)
+            if backgroundwrite and self._backgroundfilecloser.writing:
+                fp = delaywrittenfile(fp, self._backgroundfilecloser)
+            else:
+                fp = delayclosedfile(fp, self._backgroundfilecloser)
 
         return fp
 
@@ -526,18 +539,68 @@ class delayclosedfile(closewrapbase):
     def close(self):
         self._closer.close(self._origfh)
 
+class delaywrittenfile(closewrapbase):
+    """Proxy for a file object whose writes and close are delayed.
+
+    The written data is kept in memory and handed over with the file to
+    the background threads when it is closed. Once more data than the
+    closer is willing to buffer for a single file has been written, it is
+    written synchronously instead.
+
+    Do not instantiate outside of the vfs layer.
+    """
+    def __init__(self, fh, closer):
+        super(delaywrittenfile, self).__init__(fh)
+        object.__setattr__(self, r'_closer', closer)
+        object.__setattr__(self, r'_chunks', [])
+        object.__setattr__(self, r'_size', 0)
+
+    def __enter__(self):
+        return self
+
+    def write(self, data):
+        chunks = self._chunks
+        if chunks is None:
+            self._origfh.write(data)
+            return
+        chunks.append(data)
+        object.__setattr__(self, r'_size', self._size + len(data))
+        if self._size > self._closer.maxfilebytes:
+            # too large to be kept around, write it out from now on
+            self._origfh.write(''.join(chunks))
+            object.__setattr__(self, r'_chunks', None)
+            object.__setattr__(self, r'_size', 0)
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    def close(self):
+        chunks = self._chunks or []
+        object.__setattr__(self, r'_chunks', None)
+        self._closer.writeandclose(self._origfh, chunks, self._size)
+
 class backgroundfilecloser(object):
-    """Coordinates background closing of file handles on multiple threads."""
-    def __init__(self, ui, expectedcount=-1):
+    """Coordinates background closing of file handles on multiple threads.
+
+    If ``backgroundwrite`` is True and enabled by the configuration, the
+    threads can also write the data of the files they close. The amount
+    of data waiting to be written is capped, callers block until enough
+    of it has been written."""
+    def __init__(self, ui, expectedcount=-1, backgroundwrite=False):
         self._running = False
         self._entered = False
         self._threads = []
         self._threadexception = None
+        # whether the threads write file data
+        self.writing = False
 
         # Only Windows/NTFS has slow file closing. So only enable by default
         # on that platform. But allow to be enabled elsewhere for testing.
         defaultenabled = pycompat.osname == 'nt'
         enabled = ui.configbool('worker', 'backgroundclose', defaultenabled)
+        writing = backgroundwrite and ui.configbool('worker', 'backgroundwrite',
+                                                    defaultenabled)
+        enabled = enabled or writing
 
         if not enabled:
             return
@@ -553,9 +616,23 @@ class backgroundfilecloser(object):
 
         maxqueue = ui.configint('worker', 'backgroundclosemaxqueue')
         threadcount = ui.configint('worker', 'backgroundclosethreadcount')
+        if threadcount < 1:
+            # no thread to do the work, keep it in the foreground
+            return
 
-        ui.debug('starting %d threads for background file closing\n' %
-                 threadcount)
+        if writing:
+            self.writing = True
+            self._maxbytes = ui.configbytes('worker',
+                                            'backgroundwritemaxbytes')
+            # keep room for the data of several files
+            self.maxfilebytes = self._maxbytes // (2 * threadcount)
+            self._pendingbytes = 0
+            self._pendingcond = threading.Condition()
+            ui.debug('starting %d threads for background file writing\n' %
+                     threadcount)
+        else:
+            ui.debug('starting %d threads for background file closing\n' %
+                     threadcount)
 
         self._queue = util.queue(maxsize=maxqueue)
         self._running = True
@@ -577,24 +654,57 @@ class backgroundfilecloser(object):
         for t in self._threads:
             t.join()
 
+        # Data may not have been written, don't let it go unnoticed.
+        if self._threadexception and exc_type is None:
+            e = self._threadexception
+            self._threadexception = None
+            raise e
+
     def _worker(self):
         """Main routine for worker thread."""
         while True:
             try:
-                fh = self._queue.get(block=True, timeout=0.100)
+                fh, chunks, size = self._queue.get(block=True, timeout=0.100)
                 # Need to catch or the thread will terminate and
                 # we could orphan file descriptors.
                 try:
-                    fh.close()
+                    try:
+                        for chunk in chunks:
+                            fh.write(chunk)
+                    finally:
+                        fh.close()
                 except Exception as e:
                     # Stash so can re-raise from main thread later.
                     self._threadexception = e
+                finally:
+                    if size:
+                        self._release(size)
             except util.empty:
                 if not self._running:
                     break
 
+    def _reserve(self, size):
+        """Wait until ``size`` more bytes can be kept in memory."""
+        with self._pendingcond:
+            # a single file is always accepted, not to wait forever
+            while (self._pendingbytes
+                   and self._pendingbytes + size > self._maxbytes):
+                self._pendingcond.wait()
+            self._pendingbytes += size
+
+    def _release(self, size):
+        with self._pendingcond:
+            self._pendingbytes -= size
+            self._pendingcond.notify_all()
+
     def close(self, fh):
         """Schedule a file for closing."""
+        self.writeandclose(fh, [], 0)
+
+    def writeandclose(self, fh, chunks, size):
+        """Schedule the data of a file to be written, then the file closed.
+
+        ``size`` is the total length of ``chunks``."""
         if not self._entered:
             raise error.Abort(_('can only call close() when context manager '
                               'active'))
@@ -607,12 +717,18 @@ class backgroundfilecloser(object):
             self._threadexception = None
             raise e
 
-        # If we're not actively running, close synchronously.
+        # If we're not actively running, write and close synchronously.
         if not self._running:
-            fh.close()
+            try:
+                for chunk in chunks:
+                    fh.write(chunk)
+            finally:
+                fh.close()
             return
 
-        self._queue.put(fh, block=True, timeout=None)
+        if size:
+            self._reserve(size)
+        self._queue.put((fh, chunks, size), block=True, timeout=None)
 
 class checkambigatclosing(closewrapbase):
     """Proxy for a file object, to avoid ambiguity of file stat
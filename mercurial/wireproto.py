@@ -25,6 +25,8 @@ from . import (
     encoding,
     error,
     exchange,
+    getbundlecache,
+    obsdiscovery,
     peer,
     pushkey as pushkeymod,
     pycompat,
@@ -212,10 +214,13 @@ def encodebatchcmds(req):
 gboptsmap = {'heads':  'nodes',
              'common': 'nodes',
              'obsmarkers': 'boolean',
+             'obsrange': 'boolean',
+             'obsprefixes': 'csv',
              'bundlecaps': 'scsv',
              'listkeys': 'csv',
              'cg': 'boolean',
-             'cbattempted': 'boolean'}
+             'cbattempted': 'boolean',
+             'stream': 'boolean'}
 
 # client side
 
@@ -347,6 +352,21 @@ class wirepeer(peer.peerrepository):
             self.ui.status(_('remote: '), l)
         yield d
 
+    @batchable
+    def obshashrange(self, heads, prefixes):
+        self.requirecap('obshashrange', _('look up remote obsolete markers'))
+        f = future()
+        yield {'heads': encodelist(heads), 'prefixes': ','.join(prefixes)}, f
+        d = f.value
+        try:
+            ranges = []
+            for l in d.splitlines():
+                h, count = l.split(' ')
+                ranges.append((bin(h), int(count)))
+            yield ranges
+        except (ValueError, TypeError):
+            self._abort(error.ResponseError(_("unexpected response:"), d))
+
     @batchable
     def listkeys(self, namespace):
         if not self.capable('pushkey'):
@@ -768,6 +788,8 @@ def _capabilities(repo, proto):
         capsblob = bundle2.encodecaps(bundle2.getrepocaps(repo))
         caps.append('bundle2=' + urlreq.quote(capsblob))
     caps.append('unbundle=%s' % ','.join(bundle2.bundlepriority))
+    if obsdiscovery.enabled(repo):
+        caps.append('obshashrange')
 
     if proto.name == 'http':
         caps.append('httpheader=%d' %
@@ -841,19 +863,28 @@ def getbundle(repo, proto, others):
             raise error.Abort(bundle2requiredmain,
                               hint=bundle2requiredhint)
 
+    cachekey = getbundlecache.cachekey(repo, opts)
+    if cachekey is not None:
+        chunks = getbundlecache.lookup(repo, cachekey)
+        if chunks is not None:
+            return streamres(gen=chunks, v1compressible=True)
+
     try:
         if repo.ui.configbool('server', 'disablefullbundle'):
             # Check to see if this is a full clone.
             clheads = set(repo.changelog.heads())
+            changegroup = opts.get('cg', True)
             heads = set(opts.get('heads', set()))
             common = set(opts.get('common', set()))
             common.discard(nullid)
-            if not common and clheads == heads:
+            if changegroup and not common and clheads == heads:
                 raise error.Abort(
                     _('server has pull-based clones disabled'),
                     hint=_('remove --pull if specified or upgrade Mercurial'))
 
         chunks = exchange.getbundlechunks(repo, 'serve', **opts)
+        if cachekey is not None:
+            chunks = getbundlecache.store(repo, cachekey, chunks)
     except error.Abort as exc:
         # cleanly forward Abort error to the client
         if not exchange.bundle2requested(opts.get('bundlecaps')):
@@ -908,6 +939,12 @@ def lookup(repo, proto, key):
 def known(repo, proto, nodes, others):
     return ''.join(b and "1" or "0" for b in repo.known(decodelist(nodes)))
 
+@wireprotocommand('obshashrange', 'heads prefixes')
+def obshashrange(repo, proto, heads, prefixes):
+    ranges = obsdiscovery.rangehashes(repo, decodelist(heads),
+                                      prefixes.split(','))
+    return ''.join('%s %d\n' % (hex(h), count) for h, count in ranges)
+
 @wireprotocommand('pushkey', 'namespace key old new')
 def pushkey(repo, proto, namespace, key, old, new):
     # compatibility with pre-1.8 clients which were accidentally
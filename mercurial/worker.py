@@ -9,6 +9,7 @@ from __future__ import absolute_import
 
 import errno
 import os
+import select
 import signal
 import sys
 
@@ -53,6 +54,10 @@ def _numworkers(ui):
             raise error.Abort(_('number of cpus must be an integer'))
     return min(max(countcpus(), 4), 32)
 
+# writes of at most this many bytes to the pipe shared by the workers are not
+# interleaved with the writes of the other workers
+_pipebuf = getattr(select, 'PIPE_BUF', 512)
+
 if pycompat.osname == 'posix':
     _startupcost = 0.01
 else:
@@ -153,7 +158,7 @@ def _posixworker(ui, func, staticargs, args):
                 def workerfunc():
                     os.close(rfd)
                     for i, item in func(*(staticargs + (pargs,))):
-                        os.write(wfd, '%d %s\n' % (i, item))
+                        _writeitem(wfd, i, item)
                     return 0
 
                 ret = scmutil.callcatch(ui, workerfunc)
@@ -184,15 +189,38 @@ def _posixworker(ui, func, staticargs, args):
                 os.kill(os.getpid(), -status)
             sys.exit(status)
     try:
+        # chunks of the items being received, by worker
+        partial = {}
         for line in util.iterfile(fp):
-            l = line.split(' ', 1)
-            yield int(l[0]), l[1][:-1]
+            pid, i, more, chunk = line[:-1].split(' ', 3)
+            if more == '1':
+                partial.setdefault(pid, []).append(chunk)
+                continue
+            chunks = partial.pop(pid, [])
+            chunks.append(chunk)
+            yield int(i), ''.join(chunks)
     except: # re-raises
         killworkers()
         cleanup()
         raise
     cleanup()
 
+def _writeitem(fd, i, item):
+    '''write an item yielded by a worker to the pipe of the parent
+
+    The item is split in lines small enough for the writes of the workers
+    not to interleave, each made of the pid of the worker, the index of the
+    item, a flag telling if more chunks follow and the chunk.'''
+    item = '%s' % (item,)
+    header = '%d %d ' % (os.getpid(), i)
+    # room left for the flag, its separator and the newline
+    size = _pipebuf - len(header) - 3
+    while True:
+        chunk, item = item[:size], item[size:]
+        os.write(fd, '%s%d %s\n' % (header, bool(item), chunk))
+        if not item:
+            break
+
 def _posixexitstatus(code):
     '''convert a posix exit status into the same form returned by
     os.spawnv
@@ -172,3 +172,32 @@ copies here
   recording removal of d/a as rename to c (100% similar) (glob)
 
   $ cd ..
+
+Scoring many candidate pairs in worker processes gives the same renames
+
+  $ hg init rep4; cd rep4
+  $ for i in `$PYTHON $TESTDIR/seq.py 40`; do
+  >   $PYTHON $TESTDIR/seq.py $i `expr $i + 20` > f$i
+  > done
+  $ hg commit -Aqm 1
+  $ for i in `$PYTHON $TESTDIR/seq.py 40`; do
+  >   mv f$i g$i
+  >   echo changed >> g$i
+  > done
+  $ hg addremove -n -s 90 --config worker.numcpus=1 > ../serial.out
+  $ hg addremove -n -s 90 --config worker.numcpus=4 > ../parallel.out
+  $ cmp ../serial.out ../parallel.out
+  $ cat > $TESTTMP/smallbatches.py << EOF
+  > from mercurial import similar
+  > similar._batchsize = 100
+  > EOF
+  $ hg addremove -n -s 90 \
+  >   --config extensions.smallbatches=$TESTTMP/smallbatches.py > ../batched.out
+  $ cmp ../serial.out ../batched.out
+  $ grep -c 'as rename' ../serial.out
+  40
+  $ grep 'f1 \|f40 ' ../serial.out
+  recording removal of f1 as rename to g1 (93% similar)
+  recording removal of f40 as rename to g40 (94% similar)
+
+  $ cd ..
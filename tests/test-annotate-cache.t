@@ -0,0 +1,173 @@
+Test the cache of the annotations
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > annotate-cache=yes
+  > EOF
+
+  $ check() {
+  >   hg annotate -nlf "$@" > cached
+  >   hg annotate -nlf "$@" --config experimental.annotate-cache=no > computed
+  >   cmp cached computed && cat cached
+  > }
+
+  $ hg init repo
+  $ cd repo
+  $ printf 'a\nb\nc\n' > a
+  $ hg commit -Aqm 0
+  $ printf 'a\nb\nb2\nc\n' > a
+  $ hg commit -m 1
+  $ printf 'a0\na\nb\nb2\n' > a
+  $ hg commit -m 2
+
+The annotations are stored in the cache
+
+  $ check a
+  2 a:1: a0
+  0 a:1: a
+  0 a:2: b
+  1 a:3: b2
+  $ ls .hg/cache/annotate/1000
+  * (glob)
+
+Older revisions are added to the cache and answered from it
+
+  $ check -r 1 a
+  0 a:1: a
+  0 a:2: b
+  1 a:3: b2
+  0 a:3: c
+  $ check -r 1 a
+  0 a:1: a
+  0 a:2: b
+  1 a:3: b2
+  0 a:3: c
+  $ check -r 2 a
+  2 a:1: a0
+  0 a:1: a
+  0 a:2: b
+  1 a:3: b2
+
+Merges, copies and the working directory
+
+  $ hg up -q 0
+  $ printf 'a\nb\nc\nd\n' > a
+  $ hg commit -qm 3
+  $ hg merge -q -t :local 2
+  $ printf 'a0\na\nb\nb2\nd\ne\n' > a
+  $ hg commit -m 4
+  $ check a
+  2 a:1: a0
+  0 a:1: a
+  0 a:2: b
+  1 a:3: b2
+  3 a:4: d
+  4 a:6: e
+  $ hg cp a b
+  $ echo f >> b
+  $ hg commit -m 5
+  $ check b
+  2 a:1: a0
+  0 a:1: a
+  0 a:2: b
+  1 a:3: b2
+  3 a:4: d
+  4 a:6: e
+  5 b:7: f
+  $ check --no-follow b
+  5 b:1: a0
+  5 b:2: a
+  5 b:3: b
+  5 b:4: b2
+  5 b:5: d
+  5 b:6: e
+  5 b:7: f
+  $ echo g >> b
+  $ check -r 'wdir()' b
+  2  a:1: a0
+  0  a:1: a
+  0  a:2: b
+  1  a:3: b2
+  3  a:4: d
+  4  a:6: e
+  5  b:7: f
+  5+ b:8: g
+  $ hg revert -q b
+
+Options changing the annotations use their own cache
+
+  $ printf 'a0\n a\nb\nb2\nd\ne\n' > a
+  $ hg commit -m 6
+  $ check a
+  2 a:1: a0
+  6 a:2:  a
+  0 a:2: b
+  1 a:3: b2
+  3 a:4: d
+  4 a:6: e
+  $ check -w a
+  2 a:1: a0
+  0 a:1:  a
+  0 a:2: b
+  1 a:3: b2
+  3 a:4: d
+  4 a:6: e
+  $ ls .hg/cache/annotate
+  0000
+  1000
+  1100
+
+Skipped revisions are not cached
+
+  $ check --skip 6 a
+  2 a:1: a0
+  0 a:1:  a
+  0 a:2: b
+  1 a:3: b2
+  3 a:4: d
+  4 a:6: e
+
+A stripped history is annotated again
+
+  $ hg --config extensions.strip= strip -q 6
+  $ printf 'a0\nb\nb2\nd\ne\n' > a
+  $ hg commit -m 6
+  $ check a
+  2 a:1: a0
+  0 a:2: b
+  1 a:3: b2
+  3 a:4: d
+  4 a:6: e
+
+The changesets of the lines taken from the cache are found from the annotated
+revision, even when the same file revisions were introduced on another branch
+
+  $ cd ..
+  $ hg init branches
+  $ cd branches
+  $ echo a > f
+  $ hg commit -Aqm base
+  $ printf 'a\nb\n' > f
+  $ hg commit -m A1
+  $ printf 'a\nb\nc\n' > f
+  $ hg commit -m A2
+  $ hg up -q 0
+  $ printf 'a\nb\n' > f
+  $ hg commit -qm B1
+  $ printf 'a\nb\nc\n' > f
+  $ hg commit -m B2
+  $ printf 'a\nb\nc\nd\n' > f
+  $ hg commit -m B3
+  $ check -r 2 f
+  0 f:1: a
+  1 f:2: b
+  2 f:3: c
+  $ check -r 5 f
+  0 f:1: a
+  3 f:2: b
+  4 f:3: c
+  5 f:4: d
+  $ check -r 4 f
+  0 f:1: a
+  3 f:2: b
+  4 f:3: c
@@ -998,3 +998,55 @@ Issue5360: Deleted chunk in p1 of a merge changeset
   2: a
 
   $ cd ..
+
+Annotating in worker processes gives the same output, in the same order
+
+#if no-windows
+  $ hg init repo-workers
+  $ cd repo-workers
+  $ for i in `$PYTHON $TESTDIR/seq.py 1 40`; do
+  >   echo $i > f$i
+  > done
+  $ printf '\0' > binary
+  $ hg commit -qAm 0
+  $ for i in `$PYTHON $TESTDIR/seq.py 1 40 3`; do
+  >   echo x >> f$i
+  > done
+  $ hg cp f2 copy
+  $ echo y >> copy
+  $ hg commit -qm 1
+  $ echo z >> f1
+  $ hg annotate -nlfcud . > ../serial
+  $ hg annotate -nlfcud . --config experimental.annotate-workers=yes \
+  >   --config worker.numcpus=4 > ../parallel
+  $ cmp ../serial ../parallel
+  $ hg annotate -r 'wdir()' -Tjson . > ../serial
+  $ hg annotate -r 'wdir()' -Tjson . --config experimental.annotate-workers=yes \
+  >   --config worker.numcpus=4 > ../parallel
+  $ cmp ../serial ../parallel
+  $ hg annotate -r 'wdir()' f1 copy binary --config experimental.annotate-workers=yes
+  binary: binary file
+  0 : 2
+  1 : y
+  0 : 1
+  1 : x
+  1+: z
+  $ cd ..
+
+The annotations larger than what can be written at once to a pipe don't get
+mixed up
+
+  $ hg init repo-large-workers
+  $ cd repo-large-workers
+  $ $PYTHON > /dev/null << EOF
+  > for i in range(64):
+  >     with open('f%d' % i, 'w') as f:
+  >         f.writelines('%d %d\\n' % (i, j) for j in range(500))
+  > EOF
+  $ hg commit -qAm 0
+  $ hg annotate -n f* > ../serial
+  $ hg annotate -n f* --config experimental.annotate-workers=yes \
+  >   --config worker.numcpus=8 > ../parallel
+  $ cmp ../serial ../parallel
+  $ cd ..
+#endif
@@ -49,6 +49,23 @@ Clone with background file closing enabled
   bundle2-input-bundle: 1 parts total
   checking for updated bookmarks
 
+Clone with background file writing, with little room for pending data
+
+  $ hg --debug --config worker.backgroundwrite=true --config worker.backgroundcloseminfilecount=1 --config worker.backgroundwritemaxbytes=1k clone --uncompressed -U http://localhost:$HGPORT clone-write | egrep 'background|transfer'
+  1027 files to transfer, 96.3 KB of data
+  starting 4 threads for background file writing
+  transferred 96.3 KB in * seconds (*/sec) (glob)
+  $ hg -R clone-write verify -q
+  $ cmp clone1/.hg/store/00changelog.i clone-write/.hg/store/00changelog.i
+  $ cmp clone1/.hg/store/data/1023.i clone-write/.hg/store/data/1023.i
+
+Without background threads, the files are written in the foreground
+
+  $ hg --debug --config worker.backgroundwrite=true --config worker.backgroundcloseminfilecount=1 --config worker.backgroundclosethreadcount=0 clone --uncompressed -U http://localhost:$HGPORT clone-nothread | egrep 'background|transfer'
+  1027 files to transfer, 96.3 KB of data
+  transferred 96.3 KB in * seconds (*/sec) (glob)
+  $ hg -R clone-nothread verify -q
+
 Cannot stream clone when there are secret changesets
 
   $ hg -R server phase --force --secret -r tip
@@ -159,3 +176,91 @@ actually serving file content
   $ wait
   $ hg -R clone id
   000000000000
+  $ cd ..
+
+Stream clone in a bundle2 part, carrying the obsstore, phases and caches
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > bundle2.stream = yes
+  > evolution = createmarkers,exchange
+  > [phases]
+  > publish = no
+  > EOF
+
+  $ hg init v2server
+  $ cd v2server
+  $ echo a > a
+  $ hg commit -Aqm a
+  $ hg phase --public .
+  $ echo b > b
+  $ hg commit -Aqm b
+  $ echo c > c
+  $ hg commit -Aqm c
+  $ hg debugobsolete `hg log -r . -T '{node}'`
+  obsoleted 1 changesets
+  $ hg branches -q
+  default
+  $ hg debugupdatecaches
+  $ ls .hg/cache | egrep 'branch|rbc'
+  branch2-served
+  rbc-names-v1
+  rbc-revs-v1
+  $ hg serve -p $HGPORT2 -d --pid-file=hg.pid
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ cd ..
+
+  $ hg clone --uncompressed -U http://localhost:$HGPORT2 v2clone --debug \
+  >   | egrep 'stream|transfer|sending (obsstore|phaseroots|branch2|rbc)|adding (obsstore|phaseroots|branch2|rbc)|bundle2-input-part: "'
+  streaming all changes
+  bundle2-input-part: "stream2" (params: 3 mandatory) supported
+  applying stream bundle
+  * files to transfer, * of data (glob)
+  adding obsstore (*) (glob)
+  adding phaseroots (*) (glob)
+  adding branch2-served (*) (glob)
+  adding rbc-names-v1 (*) (glob)
+  adding rbc-revs-v1 (*) (glob)
+  transferred * in * seconds (*/sec) (glob)
+  bundle2-input-part: "listkeys" (params: 1 mandatory) supported
+  bundle2-input-part: "listkeys" (params: 1 mandatory) supported
+  $ cat v2clone/.hg/requires
+  dotencode
+  fncache
+  generaldelta
+  revlogv1
+  store
+  $ for f in branch2-served rbc-names-v1 rbc-revs-v1; do
+  >   cmp v2server/.hg/cache/$f v2clone/.hg/cache/$f
+  > done
+  $ hg -R v2clone log -G -T '{rev} {phase} {desc}\n'
+  o  1 draft b
+  |
+  o  0 public a
+  
+  $ hg -R v2clone debugobsolete | wc -l
+  \s*1 (re)
+  $ hg -R v2clone verify -q
+
+Clients without obsolescence enabled do not get the obsstore
+
+  $ hg clone --uncompressed -U http://localhost:$HGPORT2 v2noobs --debug \
+  >   --config experimental.evolution= \
+  >   | egrep 'adding (obsstore|phaseroots)'
+  adding phaseroots (*) (glob)
+  $ test -f v2noobs/.hg/store/obsstore
+  [1]
+  $ hg -R v2noobs verify -q
+
+Clients without the feature use the legacy stream clone
+
+  $ hg clone --uncompressed -U http://localhost:$HGPORT2 v1clone \
+  >   --config experimental.bundle2.stream=no
+  streaming all changes
+  * files to transfer, * of data (glob)
+  transferred * in * seconds (*/sec) (glob)
+  searching for changes
+  no changes found
+  1 new obsolescence markers
+
+  $ killdaemons.py
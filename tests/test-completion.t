@@ -97,6 +97,8 @@ Show debug commands if there are no other candidates
   debuglocks
   debugmergestate
   debugnamecomplete
+  debugnodemap
+  debugobsindex
   debugobsolete
   debugpathcomplete
   debugpickmergetool
@@ -273,6 +275,8 @@ Show all commands + options
   debuglocks: force-lock, force-wlock
   debugmergestate: 
   debugnamecomplete: 
+  debugnodemap: 
+  debugobsindex: 
   debugobsolete: flags, record-parents, rev, exclusive, index, delete, date, user, template
   debugpathcomplete: full, normal, added, removed
   debugpickmergetool: rev, changedelete, include, exclude, tool
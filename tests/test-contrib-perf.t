@@ -56,6 +56,8 @@ perfstatus
    perfbranchmap
                  benchmark the update of a branchmap
    perfcca       (no help text available)
+   perfchangegroup
+                 Benchmark producing a full changegroup.
    perfchangegroupchangelog
                  Benchmark producing a changelog group for a changegroup.
    perfchangeset
@@ -127,6 +129,8 @@ perfstatus
   $ hg perfbookmarks
   $ hg perfbranchmap
   $ hg perfcca
+  $ hg perfchangegroup
+  $ hg perfchangegroup -r tip --base 1
   $ hg perfchangegroupchangelog
   $ hg perfchangeset 2
   $ hg perfctxfiles 2
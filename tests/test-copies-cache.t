@@ -0,0 +1,140 @@
+Test the persistent cache of copies between changesets
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > copies-cache=yes
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ echo a > a
+  $ echo b > b
+  $ hg commit -Aqm 0
+  $ hg mv a a2
+  $ hg cp b b2
+  $ hg commit -m 1
+  $ hg mv a2 a3
+  $ echo c > c
+  $ hg commit -Aqm 2
+
+Copies are computed and recorded in the cache
+
+  $ hg status -C --rev 0 --rev 2
+  A a3
+    a
+  A b2
+    b
+  A c
+  R a
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=53
+
+Known queries are answered from the cache, queries going backward use the
+same records
+
+  $ hg status -C --rev 0 --rev 2
+  A a3
+    a
+  A b2
+    b
+  A c
+  R a
+  $ hg status -C --rev 2 --rev 0
+  A a
+    a3
+  R a3
+  R b2
+  R c
+  $ hg status -C --rev 0 --rev 2 b2
+  A b2
+    b
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=53
+
+New queries are appended
+
+  $ hg status -C --rev 1 --rev 2
+  A a3
+    a2
+  A c
+  R a2
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=102
+
+Queries against the working copy use the cached copies of its parent
+
+  $ hg cp b d
+  $ hg status -C --rev 0
+  A a3
+    a
+  A b2
+    b
+  A c
+  A d
+    b
+  R a
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=102
+  $ hg revert -q d
+  $ rm d
+
+A truncated record is ignored and overwritten
+
+  $ $PYTHON -c "open('.hg/cache/copies-v1', 'r+b').truncate(100)"
+  $ hg status -C --rev 1 --rev 2 --debug
+  A a3
+    a2
+  A c
+  R a2
+  cache/copies-v1 changed - truncating it
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=102
+
+The cache is not used when disabled
+
+  $ rm .hg/cache/copies-v1
+  $ hg status -C --rev 0 --rev 2 --config experimental.copies-cache=no
+  A a3
+    a
+  A b2
+    b
+  A c
+  R a
+  $ f .hg/cache/copies-v1
+  .hg/cache/copies-v1: file not found
+
+The least recently used records are dropped once the cache grows over its
+maximal size, the file being rewritten with half of it
+
+  $ hg status -C --rev 0 --rev 2 > /dev/null
+  $ hg status -C --rev 1 --rev 2 > /dev/null
+  $ hg status -C --rev 0 --rev 1 > /dev/null
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=155
+  $ hg up -q 2
+  $ hg mv c c2
+  $ hg commit -m 3
+  $ hg status -C --rev 2 --rev 3 --config experimental.copies-cache.maxsize=240
+  A c2
+    c
+  R c
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=203
+  $ hg status -C --rev 1 --rev 3 --debug \
+  >   --config experimental.copies-cache.maxsize=240
+  A a3
+    a2
+  A c2
+  R a2
+  compacting cache/copies-v1: 3 records dropped
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=97
+
+The most recent records are still used
+
+  $ hg status -C --rev 2 --rev 3
+  A c2
+    c
+  R c
+  $ f --size .hg/cache/copies-v1
+  .hg/cache/copies-v1: size=97
@@ -0,0 +1,105 @@
+Test tracing copies through the changeset-centric copies index
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > copies-index=yes
+  > EOF
+
+The index is updated by commits
+
+  $ hg init repo
+  $ cd repo
+  $ echo a > a
+  $ echo b > b
+  $ echo c > c
+  $ hg commit -Aqm 0
+  $ f --size .hg/cache/copies-index-v1
+  .hg/cache/copies-index-v1: size=24
+  $ hg mv a a2
+  $ hg cp b b2
+  $ hg commit -m 1
+  $ f --size .hg/cache/copies-index-v1
+  .hg/cache/copies-index-v1: size=62
+  $ hg mv a2 a3
+  $ hg rm c
+  $ hg commit -m 2
+  $ hg up -q 0
+  $ hg mv c c2
+  $ echo d > d
+  $ hg commit -Aqm 3
+  $ hg merge -q 2
+  note: possible conflict - c was deleted and renamed to:
+   c2
+  $ hg commit -m 4
+  $ hg mv b2 b3
+  $ hg commit -m 5
+  $ hg log -G -T '{rev} {files}\n'
+  @  5 b2 b3
+  |
+  o    4 a
+  |\
+  | o  3 c c2 d
+  | |
+  o |  2 a2 a3 c
+  | |
+  o |  1 a a2 b2
+  |/
+  o  0 a b c
+  
+
+Copies are the same as the ones found in the filelogs
+
+  $ for x in 0 1 2 3 4 5; do
+  >   for y in 0 1 2 3 4 5; do
+  >     hg status -C --rev $x --rev $y > ../index.out
+  >     hg status -C --rev $x --rev $y \
+  >       --config experimental.copies-index=no > ../filelog.out
+  >     cmp -s ../index.out ../filelog.out || echo "$x -> $y differs"
+  >   done
+  > done
+  $ hg status -C --rev 0 --rev 5
+  A a3
+    a
+  A b3
+    b
+  A c2
+    c
+  A d
+  R a
+  R c
+  $ hg status -C --rev 1 --rev 5 b3 c2
+  A b3
+    b2
+  A c2
+    c
+  $ hg status -C --rev 5 --rev 0
+  A a
+    a3
+  A c
+    c2
+  R a3
+  R b3
+  R c2
+  R d
+
+The index is updated by pulls, and built for revisions missing from it
+
+  $ cd ..
+  $ hg init pulled
+  $ hg -R pulled pull -q -r 2 repo
+  $ f --size pulled/.hg/cache/copies-index-v1
+  pulled/.hg/cache/copies-index-v1: size=99
+  $ hg -R pulled pull -q repo --config experimental.copies-index=no
+  $ hg -R pulled status -C --rev 0 --rev 5
+  A a3
+    a
+  A b3
+    b
+  A c2
+    c
+  A d
+  R a
+  R c
+  $ hg -R pulled debugupdatecaches --debug | grep copies
+  updating the copies index
+  $ cmp pulled/.hg/cache/copies-index-v1 repo/.hg/cache/copies-index-v1
@@ -149,6 +149,18 @@ Test format.aggressivemergedeltas
        1        59      61      0       1 315c023f341d 000000000000 000000000000
        2       120      62      0       2 2ab389a983eb 315c023f341d 8dde941edb6e
 
+  $ hg strip -q -r . --config extensions.strip=
+
+- Verify exhaustive search picks the smallest delta (against commit 0)
+  $ hg up -q -C 1
+  $ hg merge -q 0
+  $ hg commit -q -m merge --config format.exhaustivedeltasearch=True
+  $ hg debugindex -m
+     rev    offset  length  delta linkrev nodeid       p1           p2
+       0         0      59     -1       0 8dde941edb6e 000000000000 000000000000
+       1        59      61      0       1 315c023f341d 000000000000 000000000000
+       2       120      62      0       2 2ab389a983eb 315c023f341d 8dde941edb6e
+
 Test that strip bundle use bundle2
   $ hg --config extensions.strip= strip .
   0 files updated, 0 files merged, 5 files removed, 0 files unresolved
@@ -349,3 +361,195 @@ test maxdeltachainspan
       50      2857      58     49      50 467f8e30a066 9fff62ea0624 000000000000
       51      2915      58     17      51 346db97283df a33416e52d91 000000000000
       52      2973      58     51      52 4e003fd4d5cd 346db97283df 000000000000
+
+test format.maxchainspan, a hard limit on the span of delta chains that is
+not relaxed for large revisions
+
+  $ hg clone --pull source-repo --config experimental.maxdeltachainspan=0 --config format.maxchainspan=1000 bounded-chain --config format.generaldelta=yes
+  requesting all changes
+  adding changesets
+  adding manifests
+  adding file changes
+  added 53 changesets with 53 changes to 53 files (+2 heads)
+  updating to branch default
+  14 files updated, 0 files merged, 0 files removed, 0 files unresolved
+  $ hg -R bounded-chain debugindex -m
+     rev    offset  length  delta linkrev nodeid       p1           p2
+       0         0      46     -1       0 19deeef41503 000000000000 000000000000
+       1        46      57      0       1 fffc37b38c40 19deeef41503 000000000000
+       2       103      57      1       2 5822d75c83d9 fffc37b38c40 000000000000
+       3       160      57      2       3 19cf2273e601 5822d75c83d9 000000000000
+       4       217      57      3       4 d45ead487afe 19cf2273e601 000000000000
+       5       274      57      4       5 96e0c2ce55ed d45ead487afe 000000000000
+       6       331      46     -1       6 0c2ea5222c74 000000000000 000000000000
+       7       377      57      6       7 4ca08a89134d 0c2ea5222c74 000000000000
+       8       434      57      7       8 c973dbfd30ac 4ca08a89134d 000000000000
+       9       491      57      8       9 d81d878ff2cd c973dbfd30ac 000000000000
+      10       548      58      9      10 dbee7f0dd760 d81d878ff2cd 000000000000
+      11       606      58     10      11 474be9f1fd4e dbee7f0dd760 000000000000
+      12       664      58     11      12 594a27502c85 474be9f1fd4e 000000000000
+      13       722      58     12      13 a7d25307d6a9 594a27502c85 000000000000
+      14       780      58     13      14 3eb53082272e a7d25307d6a9 000000000000
+      15       838      58     14      15 d1e94c85caf6 3eb53082272e 000000000000
+      16       896      58     15      16 8933d9629788 d1e94c85caf6 000000000000
+      17       954      58     16      17 a33416e52d91 8933d9629788 000000000000
+      18      1012      47     -1      18 4ccbf31021ed 000000000000 000000000000
+      19      1059      58     18      19 dcad7a25656c 4ccbf31021ed 000000000000
+      20      1117      58     19      20 617c4f8be75f dcad7a25656c 000000000000
+      21      1175      58     20      21 975b9c1d75bb 617c4f8be75f 000000000000
+      22      1233      58     21      22 74f09cd33b70 975b9c1d75bb 000000000000
+      23      1291      58     22      23 54e79bfa7ef1 74f09cd33b70 000000000000
+      24      1349      58     23      24 c556e7ff90af 54e79bfa7ef1 000000000000
+      25      1407      58     24      25 42daedfe9c6b c556e7ff90af 000000000000
+      26      1465      58     25      26 f302566947c7 42daedfe9c6b 000000000000
+      27      1523      58     26      27 2346959851cb f302566947c7 000000000000
+      28      1581      58     27      28 ca8d867106b4 2346959851cb 000000000000
+      29      1639      58     28      29 fd9152decab2 ca8d867106b4 000000000000
+      30      1697      58     29      30 3fe34080a79b fd9152decab2 000000000000
+      31      1755      58     30      31 bce61a95078e 3fe34080a79b 000000000000
+      32      1813      58     31      32 1dd9ba54ba15 bce61a95078e 000000000000
+      33      1871      58     32      33 3cd9b90a9972 1dd9ba54ba15 000000000000
+      34      1929      58     33      34 5db8c9754ef5 3cd9b90a9972 000000000000
+      35      1987     466     -1      35 ee4a240cc16c 5db8c9754ef5 000000000000
+      36      2453      58     35      36 9e1d38725343 ee4a240cc16c 000000000000
+      37      2511      58     36      37 3463f73086a8 9e1d38725343 000000000000
+      38      2569      58     37      38 88af72fab449 3463f73086a8 000000000000
+      39      2627      58     38      39 472f5ce73785 88af72fab449 000000000000
+      40      2685      58     39      40 c91b8351e5b8 472f5ce73785 000000000000
+      41      2743      58     40      41 9c8289c5c5c0 c91b8351e5b8 000000000000
+      42      2801      58     41      42 a13fd4a09d76 9c8289c5c5c0 000000000000
+      43      2859      58     42      43 2ec2c81cafe0 a13fd4a09d76 000000000000
+      44      2917      58     43      44 f27fdd174392 2ec2c81cafe0 000000000000
+      45      2975     719     -1      45 a539ec59fe41 f27fdd174392 000000000000
+      46      3694      58     45      46 5e98b9ecb738 a539ec59fe41 000000000000
+      47      3752      58     46      47 31e6b47899d0 5e98b9ecb738 000000000000
+      48      3810      58     47      48 2cf25d6636bd 31e6b47899d0 000000000000
+      49      3868     197     -1      49 9fff62ea0624 96e0c2ce55ed 000000000000
+      50      4065      58     49      50 467f8e30a066 9fff62ea0624 000000000000
+      51      4123     356     50      51 346db97283df a33416e52d91 000000000000
+      52      4479      58     51      52 4e003fd4d5cd 346db97283df 000000000000
+
+test format.exhaustivedeltasearch, which also tries the previous revision when
+a parent gives an acceptable delta
+
+  $ cd $TESTTMP
+  $ hg init exhaustive --config format.generaldelta=yes
+  $ cd exhaustive
+  $ $PYTHON -c 'for i in range(100): print(i)' > f
+  $ hg ci -qAm 0
+  $ $PYTHON -c 'for i in range(100): print(10 <= i < 40 and "x%d" % i or i)' > f
+  $ hg ci -qm 1
+  $ cat > $TESTTMP/nearprev.py << EOF
+  > for i in range(100):
+  >     print(10 <= i < 40 and "x%d" % i or i == 80 and "eighty" or i)
+  > EOF
+
+- Verify default and aggressive searches use the parent (commit 0) as base
+  $ hg up -q 0
+  $ $PYTHON $TESTTMP/nearprev.py > f
+  $ hg ci -qm 2
+  $ hg debugdeltachain f
+      rev  chain# chainlen     prev   delta       size    rawsize  chainsize     ratio   lindist extradist extraratio
+        0       1        1       -1    base        146        290        146   0.50345       146         0    0.00000
+        1       1        2        0      p1         73        320        219   0.68437       219         0    0.00000
+        2       1        2        0      p1         93        324        239   0.73765       312        73    0.30544
+  $ hg strip -q -r . --config extensions.strip=
+  $ hg up -q 0
+  $ $PYTHON $TESTTMP/nearprev.py > f
+  $ hg ci -qm 2 --config format.aggressivemergedeltas=yes
+  $ hg debugdeltachain f
+      rev  chain# chainlen     prev   delta       size    rawsize  chainsize     ratio   lindist extradist extraratio
+        0       1        1       -1    base        146        290        146   0.50345       146         0    0.00000
+        1       1        2        0      p1         73        320        219   0.68437       219         0    0.00000
+        2       1        2        0      p1         93        324        239   0.73765       312        73    0.30544
+  $ hg strip -q -r . --config extensions.strip=
+
+- Verify exhaustive search picks the smallest delta (against commit 1)
+  $ hg up -q 0
+  $ $PYTHON $TESTTMP/nearprev.py > f
+  $ hg ci -qm 2 --config format.exhaustivedeltasearch=yes
+  $ hg debugdeltachain f
+      rev  chain# chainlen     prev   delta       size    rawsize  chainsize     ratio   lindist extradist extraratio
+        0       1        1       -1    base        146        290        146   0.50345       146         0    0.00000
+        1       1        2        0      p1         73        320        219   0.68437       219         0    0.00000
+        2       1        3        1    prev         19        324        238   0.73457       238         0    0.00000
+
+format.maxchainspan rejects a delta that is otherwise acceptable
+
+  $ cat > $TESTTMP/nearparent.py << EOF
+  > for i in range(100):
+  >     print(10 <= i < 40 and "x%d" % i or i == 80 and "eighty" or
+  >           i == 90 and "ninety" or i)
+  > EOF
+  $ $PYTHON $TESTTMP/nearparent.py > f
+  $ hg ci -qm 3
+  $ hg debugdeltachain f | tail -1
+        3       1        4        2      p1         19        328        257   0.78354       257         0    0.00000
+  $ hg strip -q -r . --config extensions.strip=
+  $ hg up -q 2
+  $ $PYTHON $TESTTMP/nearparent.py > f
+  $ hg ci -qm 3 --config format.maxchainspan=200
+  $ hg debugdeltachain f | tail -1
+        3       2        1       -1    base        172        328        172   0.52439       172         0    0.00000
+
+Deltas stored against a revision the receiver has can be sent as is
+
+  $ cd $TESTTMP
+  $ hg init reusesource
+  $ cd reusesource
+  $ $PYTHON -c 'for i in range(100): print(i)' > f
+  $ hg ci -qAm 0
+  $ $PYTHON -c 'for i in range(100): print(i == 5 and "five" or i)' > f
+  $ hg ci -qm 1
+  $ hg up -q 0
+  $ $PYTHON -c 'for i in range(100): print(i == 50 and "fifty" or i)' > f
+  $ hg ci -qm 2
+  $ cd ..
+
+A bundle sending the revisions in order makes the file revision of 2 stored
+as a delta against the one of 1, which is not its parent
+
+  $ hg -R reusesource bundle -q -a -t none-v1 reuse.hg
+  $ hg init reuse --config format.generaldelta=yes
+  $ hg -R reuse unbundle -q reuse.hg
+  $ hg -R reuse debugdeltachain f
+      rev  chain# chainlen     prev   delta       size    rawsize  chainsize     ratio   lindist extradist extraratio
+        0       1        1       -1    base        146        290        146   0.50345       146         0    0.00000
+        1       1        2        0      p1         17        293        163   0.55631       163         0    0.00000
+        2       1        3        1    prev         32        293        195   0.66553       195         0    0.00000
+  $ hg -R reuse debugindex f
+     rev    offset  length  delta linkrev nodeid       p1           p2
+       0         0     146     -1       0 7018db9c1ea5 000000000000 000000000000
+       1       146      17      0       1 4120c567e413 7018db9c1ea5 000000000000
+       2       163      32      1       2 * 7018db9c1ea5 000000000000 (glob)
+
+For receivers having the revision 1, the delta against the parent is
+computed, unless stored deltas are reused
+
+  $ hg -R reuse bundle -q -t none-v2 --base 1 -r 2 computed.hg
+  $ hg debugbundle --all computed.hg | grep ' 7018db9c1ea5' | awk '{print $5}'
+  7018db9c1ea5525751b8987905ae1105dc2bc6c5
+  $ hg -R reuse bundle -q -t none-v2 --base 1 -r 2 \
+  >   --config bundle.reusedeltas=yes reused.hg
+  $ hg debugbundle --all reused.hg | grep ' 7018db9c1ea5' | awk '{print $5}'
+  4120c567e413b29a839efbe3fe99eadb4b45828e
+  $ hg clone -q -U -r 1 reuse reusedest
+  $ hg -R reusedest unbundle -q reused.hg
+  $ hg -R reusedest verify -q
+  $ hg --cwd reusedest cat -r 2 f | grep fifty
+  fifty
+
+The hash of revisions stored from the received delta is checked
+
+  $ hg -R reusesource bundle -q -a -t none-v2 corrupted.hg
+  $ $PYTHON -c "import sys; d = open(sys.argv[1], 'rb').read(); open(sys.argv[1], 'wb').write(d.replace('fifty', 'fiftY'))" corrupted.hg
+  $ hg init corrupted
+  $ hg -R corrupted unbundle corrupted.hg
+  adding changesets
+  adding manifests
+  adding file changes
+  transaction abort!
+  rollback completed
+  abort: integrity check failed on data/f.i:2!
+  [255]
+  $ hg -R corrupted log
@@ -0,0 +1,89 @@
+#require serve
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > getbundlecache = 1M
+  > EOF
+
+  $ hg init server
+  $ cd server
+  $ echo a > a
+  $ hg commit -qAm a
+  $ echo b > b
+  $ hg commit -qAm b
+  $ hg serve -p $HGPORT -d --pid-file=hg.pid -E errors.log
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ cd ..
+
+The first clone fills the cache
+
+  $ hg clone -q http://localhost:$HGPORT clone1
+  $ ls server/.hg/cache/getbundle | wc -l
+  \s*1 (re)
+
+The same request is answered from the cache, without reading the revlogs
+
+  $ cp server/.hg/store/data/b.i b.i.orig
+  $ echo garbage > server/.hg/store/data/b.i
+  $ hg clone -q http://localhost:$HGPORT clone2
+  $ hg -R clone2 verify -q
+  $ cat clone2/b
+  b
+  $ mv b.i.orig server/.hg/store/data/b.i
+
+A new changeset changes the key
+
+  $ cd server
+  $ echo c > c
+  $ hg commit -qAm c
+  $ cd ..
+  $ hg clone -q http://localhost:$HGPORT clone3
+  $ hg -R clone3 log -T '{rev} {desc}\n'
+  2 c
+  1 b
+  0 a
+  $ ls server/.hg/cache/getbundle | wc -l
+  \s*2 (re)
+
+So does a bookmark change
+
+  $ hg -R server bookmark -r 1 book
+  $ hg clone -q http://localhost:$HGPORT clone4
+  $ hg -R clone4 bookmarks
+     book                      1:d2ae7f538514
+  $ ls server/.hg/cache/getbundle | wc -l
+  \s*3 (re)
+
+Pulls are cached too
+
+  $ hg -R clone1 pull -q
+  $ hg -R clone1 log -r tip -T '{rev} {desc}\n'
+  2 c
+  $ ls server/.hg/cache/getbundle | wc -l
+  \s*4 (re)
+
+The least recently used bundles are removed once the cache grows too large
+
+  $ killdaemons.py
+  $ hg -R server serve -p $HGPORT -d --pid-file=hg.pid \
+  >   --config experimental.getbundlecache=2500
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ hg clone -q http://localhost:$HGPORT clone5
+  $ ls server/.hg/cache/getbundle | wc -l
+  \s*1 (re)
+
+Bundles are not cached when outgoing hooks have to run
+
+  $ rm -r server/.hg/cache/getbundle
+  $ killdaemons.py
+  $ hg -R server serve -p $HGPORT -d --pid-file=hg.pid \
+  >   --config hooks.outgoing='echo outgoing > $TESTTMP/hook.log'
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ hg clone -q http://localhost:$HGPORT clone6
+  $ cat hook.log
+  outgoing
+  $ ls server/.hg/cache/getbundle
+  ls: *: No such file or directory (glob)
+  [2]
+
+  $ cat server/errors.log
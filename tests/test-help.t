@@ -931,6 +931,9 @@ Test list of internal help commands
                  print merge state
    debugnamecomplete
                  complete "names" - tags, open branch names, bookmark names
+   debugnodemap  show the state of the persistent nodemaps of the store
+   debugobsindex
+                 show the state of the index of the obsolescence markers
    debugobsolete
                  create arbitrary obsolete marker
    debugoptADV   (no help text available)
@@ -0,0 +1,146 @@
+Test the on-disk cache of the hidden revisions
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > evolution=createmarkers
+  > hidden-cache=yes
+  > [phases]
+  > publish=no
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ for i in 0 1 2 3; do
+  >   echo $i > f$i
+  >   hg commit -Aqm "c$i"
+  > done
+
+The cache is written by the commands filtering the repository and used by the
+next ones
+
+  $ f --size .hg/cache/hidden-v1
+  .hg/cache/hidden-v1: size=100
+  $ hg log -r . -T '{rev}\n' --debug
+  3
+
+New markers are read from the end of the obsstore
+
+  $ hg debugobsolete `hg log -r 3 -T '{node}'`
+  obsoleted 1 changesets
+  $ hg up -q 1
+  $ hg log -G -T '{rev} {desc}\n' --debug
+  updating hidden revisions
+  o  2 c2
+  |
+  @  1 c1
+  |
+  o  0 c0
+  
+
+  $ hg log -G -T '{rev} {desc}\n' --debug
+  o  2 c2
+  |
+  @  1 c1
+  |
+  o  0 c0
+  
+
+New changesets are checked against the markers added before them
+
+  $ hg clone -q -u 1 . ../other
+  $ echo 4 > ../other/f4
+  $ hg -R ../other commit -Aqm c4
+  $ hg debugobsolete `hg -R ../other log -r tip -T '{node}'`
+  $ echo 4 > f4
+  $ hg commit -Aqm c4
+  $ hg log -G -T '{rev} {desc}\n' --debug
+  @  4 c4
+  |
+  | o  2 c2
+  |/
+  o  1 c1
+  |
+  o  0 c0
+  
+
+  $ hg up -q 2
+  $ hg log -G -T '{rev} {desc}\n' --debug
+  updating hidden revisions
+  @  2 c2
+  |
+  o  1 c1
+  |
+  o  0 c0
+  
+
+Pinned revisions are taken into account
+
+  $ hg bookmark -r 3 --hidden book
+  $ hg log -G -T '{rev} {desc}\n' --debug
+  updating hidden revisions
+  x  3 c3
+  |
+  @  2 c2
+  |
+  o  1 c1
+  |
+  o  0 c0
+  
+
+  $ hg bookmark -d book
+  $ hg log -T '{rev} {desc}\n' --debug
+  updating hidden revisions
+  2 c2
+  1 c1
+  0 c0
+
+Phase changes and deleted markers recompute the hidden revisions
+
+  $ hg phase -p 1
+  $ hg log -T '{rev} {desc}\n' --debug
+  computing hidden revisions
+  2 c2
+  1 c1
+  0 c0
+  $ hg debugobsolete --delete 0
+  deleted 1 obsolescence markers
+  $ hg log -T '{rev} {desc}\n' --debug
+  computing hidden revisions
+  3 c3
+  2 c2
+  1 c1
+  0 c0
+
+The served revisions are cached too
+
+  $ hg phase -fs 3
+  $ hg log -T '{rev} {desc}\n' --debug
+  computing hidden revisions
+  3 c3
+  2 c2
+  1 c1
+  0 c0
+  $ hg clone -q . ../served
+  $ hg -R ../served log -T '{rev} {desc}\n'
+  2 c2
+  1 c1
+  0 c0
+
+The cache gives the same results as the computation
+
+  $ hg debugobsolete `hg log -r 2 -T '{node}'`
+  obsoleted 1 changesets
+  $ hg log -G -T '{rev} {desc}\n' --hidden > all
+  $ hg log -G -T '{rev} {desc}\n' > cached
+  $ hg log -G -T '{rev} {desc}\n' --config experimental.hidden-cache=no > computed
+  $ cmp cached computed
+  $ cat cached
+  o  3 c3
+  |
+  @  2 c2
+  |
+  o  1 c1
+  |
+  o  0 c0
+  
+
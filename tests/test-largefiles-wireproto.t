@@ -348,6 +348,14 @@ largefiles should batch verify remote calls
   verified existence of 2 revisions of 2 largefiles
   $ tail -1 access.log
   $LOCALIP - - [*] "GET /?cmd=batch HTTP/1.1" 200 - x-hgarg-1:cmds=statlfile+sha%3D972a1a11f19934401291cc99117ec614933374ce%3Bstatlfile+sha%3Dc801c9cfe94400963fcb683246217d5db77f9a9a x-hgproto-1:0.1 0.2 comp=*zlib,none,bzip2 (glob)
+
+The batched calls can be split over concurrent requests
+
+  $ hg -R batchverifyclone verify -q --large --lfa \
+  >   --config experimental.http.parallelrequests=2
+  $ tail -2 access.log | cut -d '"' -f 2- | sort
+  GET /?cmd=batch HTTP/1.1" 200 - x-hgarg-1:cmds=statlfile+sha%3D972a1a11f19934401291cc99117ec614933374ce x-hgproto-1:0.1 0.2 comp=*zlib,none,bzip2 (glob)
+  GET /?cmd=batch HTTP/1.1" 200 - x-hgarg-1:cmds=statlfile+sha%3Dc801c9cfe94400963fcb683246217d5db77f9a9a x-hgproto-1:0.1 0.2 comp=*zlib,none,bzip2 (glob)
   $ hg -R batchverifyclone update
   getting changed largefiles
   2 largefiles updated, 0 removed
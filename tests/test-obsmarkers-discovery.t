@@ -0,0 +1,111 @@
+Test the discovery of the obsolescence markers to exchange
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > evolution=createmarkers,exchange
+  > obsmarkers-exchange-debug=true
+  > EOF
+
+  $ mkcommit() {
+  >    echo "$1" > "$1"
+  >    hg add "$1"
+  >    hg ci -m "$1"
+  > }
+  $ getid() {
+  >    hg -R "$1" log -T "{node}\n" --hidden -r "desc('re:^$2$')"
+  > }
+
+Markers relevant to many common changesets
+
+  $ hg init server
+  $ cd server
+  $ for i in `$PYTHON $TESTDIR/seq.py 0 39`; do
+  >   mkcommit c$i
+  >   hg debugobsolete `printf '%040d' $i` `getid . c$i`
+  > done
+  $ cd ..
+  $ hg clone -q server client
+  $ hg -R client debugobsolete | wc -l
+  \s*40 (re)
+
+Without discovery, all the markers relevant to the pulled changesets are sent
+
+  $ hg -R server debugobsolete `printf '%040d' 100` `getid server c5`
+  $ hg -R client pull server
+  pulling from server
+  searching for changes
+  no changes found
+  obsmarker-exchange: 2830 bytes received
+  1 new obsolescence markers
+
+With discovery, only the markers of the differing ranges are
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > evolution.obshashrange=yes
+  > EOF
+
+  $ hg -R server debugobsolete `printf '%040d' 101` `getid server c30`
+  $ cd server
+  $ mkcommit c40
+  $ hg debugobsolete `printf '%040d' 40` `getid . c40`
+  $ cd ..
+  $ hg -R client pull --debug server | egrep 'discovery:|exchange:|new obsolescence'
+  obsmarker discovery: 1 differing ranges found in 2 roundtrips (2 requests)
+  obsmarker-exchange: 346 bytes received
+  2 new obsolescence markers
+  $ hg -R client debugobsolete | wc -l
+  \s*43 (re)
+
+Nothing is sent when the markers are the same
+
+  $ hg -R client pull --debug server | egrep 'discovery:|exchange:|new obsolescence'
+  obsmarker discovery: 0 differing ranges found in 1 roundtrips (1 requests)
+  $ hg -R client pull -r `getid server c10` --debug server | egrep 'discovery:|exchange:|new obsolescence'
+  obsmarker discovery: 0 differing ranges found in 1 roundtrips (1 requests)
+
+Markers are found on any side
+
+  $ hg -R client debugobsolete `printf '%040d' 102` `getid client c3`
+  $ hg -R server debugobsolete `printf '%040d' 103` `getid server c20`
+  $ hg -R client push --debug server | egrep 'discovery:|exchange:|new obsolescence'
+  obsmarker discovery: 2 differing ranges found in 3 roundtrips (3 requests)
+  obsmarker-exchange: 277 bytes received
+  1 new obsolescence markers
+  $ hg -R client pull --debug server | egrep 'discovery:|exchange:|new obsolescence'
+  obsmarker discovery: 1 differing ranges found in 3 roundtrips (3 requests)
+  obsmarker-exchange: 139 bytes received
+  1 new obsolescence markers
+  $ hg -R client debugobsolete | sort > client.markers
+  $ hg -R server debugobsolete | sort > server.markers
+  $ cmp client.markers server.markers
+  $ wc -l < client.markers
+  \s*45 (re)
+
+Over http
+
+  $ hg -R server serve --config web.push_ssl=False --config web.allow_push=* -p $HGPORT -d --pid-file=hg.pid -E errors.log
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ hg -R server debugobsolete `printf '%040d' 104` `getid server c15`
+  $ hg -R client pull --debug http://localhost:$HGPORT/ | egrep 'discovery:|exchange:|new obsolescence'
+  obsmarker discovery: 1 differing ranges found in 3 roundtrips (3 requests)
+  obsmarker-exchange: 139 bytes received
+  1 new obsolescence markers
+  $ hg -R client debugobsolete `printf '%040d' 105` `getid client c16`
+  $ hg -R client push --debug http://localhost:$HGPORT/ | egrep 'discovery:|exchange:|new obsolescence'
+  obsmarker discovery: 1 differing ranges found in 2 roundtrips (2 requests)
+  remote: obsmarker-exchange: 139 bytes received
+  remote: 1 new obsolescence markers
+  $ hg -R server debugobsolete | wc -l
+  \s*47 (re)
+  $ cat errors.log
+
+Ranges without markers on one side are not split
+
+  $ hg init fresh
+  $ hg -R fresh pull -q server --config experimental.evolution=createmarkers
+  $ hg -R fresh debugobsolete | wc -l
+  \s*0 (re)
+  $ hg -R fresh pull --debug server | egrep 'discovery:|new obsolescence'
+  obsmarker discovery: 1 differing ranges found in 1 roundtrips (1 requests)
+  47 new obsolescence markers
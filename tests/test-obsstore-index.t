@@ -0,0 +1,122 @@
+Test the on-disk index of the obsolescence markers
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > evolution=createmarkers,exchange
+  > obsstore-index=yes
+  > [extensions]
+  > rebase=
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ for i in 0 1 2 3 4 5; do
+  >   echo $i > f$i
+  >   hg commit -Aqm "c$i"
+  > done
+  $ hg debugobsindex
+  obsindex: missing
+
+The index is created by the first transaction adding markers
+
+  $ hg debugobsolete `printf '%040d' 1` `hg log -r 1 -T '{node}'`
+  $ hg debugobsindex
+  obsindex: 2 entries (2 sorted, 0 appended)
+
+and appended to by the next ones
+
+  $ hg up -q 4
+  $ hg debugobsolete --record-parents `hg log -r 5 -T '{node}'`
+  obsoleted 1 changesets
+  $ hg debugobsindex
+  obsindex: 4 entries (2 sorted, 2 appended)
+  $ hg up -q 0
+  $ echo a > a
+  $ hg commit -Aqm a
+  $ echo b > b
+  $ hg commit -Aqm b
+  $ hg rebase -q -s 6 -d 4
+  $ hg debugobsindex
+  obsindex: 8 entries (2 sorted, 6 appended)
+
+Lookups are answered from the index, the same way as from the parsed markers
+
+  $ hg log -G -T '{rev} {desc}\n' --hidden
+  @  9 b
+  |
+  o  8 a
+  |
+  | x  7 b
+  | |
+  | x  6 a
+  | |
+  +---x  5 c5
+  | |
+  o |  4 c4
+  | |
+  o |  3 c3
+  | |
+  o |  2 c2
+  | |
+  o |  1 c1
+  |/
+  o  0 c0
+  
+  $ hg log -G -T '{rev} {desc}\n' > indexed
+  $ hg log -G -T '{rev} {desc}\n' --config experimental.obsstore-index=no > parsed
+  $ cmp indexed parsed
+  $ hg debugobsolete --rev 'all()' --hidden > indexed
+  $ hg debugobsolete --rev 'all()' --hidden \
+  >   --config experimental.obsstore-index=no > parsed
+  $ cmp indexed parsed
+  $ hg log -r 'successors(6)' -T '{rev}\n' --hidden
+  6
+  8
+  $ hg log -r 'obsolete()' -T '{rev}\n' --hidden
+  5
+  6
+  7
+
+Markers added without the index are parsed from the end of the obsstore
+
+  $ hg debugobsolete --config experimental.obsstore-index=no \
+  >   `printf '%040d' 2` `hg log -r 2 -T '{node}'`
+  $ hg debugobsindex
+  obsindex: 8 entries (2 sorted, 6 appended)
+  obsindex: 69 bytes of obsstore not covered
+  $ hg debugobsolete --rev 2 -T '{precnode}\n'
+  0000000000000000000000000000000000000002
+
+and indexed by the next transaction adding markers
+
+  $ hg debugobsolete `printf '%040d' 3` `hg log -r 2 -T '{node}'`
+  $ hg debugobsindex
+  obsindex: 12 entries (12 sorted, 0 appended)
+  $ hg debugobsolete --rev 2 -T '{precnode}\n'
+  0000000000000000000000000000000000000002
+  0000000000000000000000000000000000000003
+
+A rolled back transaction leaves the index consistent
+
+  $ hg debugobsolete `printf '%040d' 5` `hg log -r 3 -T '{node}'`
+  $ hg debugobsindex
+  obsindex: 14 entries (12 sorted, 2 appended)
+  $ hg rollback -q
+  $ hg debugobsindex
+  obsindex: 12 entries (12 sorted, 0 appended)
+  $ hg debugobsolete --rev 3 -T '{precnode}\n'
+
+Deleting markers drops the index, it is rebuilt by the next transaction
+adding markers
+
+  $ hg debugobsolete --delete 0
+  deleted 1 obsolescence markers
+  $ hg debugobsindex
+  obsindex: missing
+  $ hg debugobsolete `printf '%040d' 4` `hg log -r 2 -T '{node}'`
+  $ hg debugobsindex
+  obsindex: 12 entries (12 sorted, 0 appended)
+  $ hg debugobsolete --rev 'all()' --hidden > indexed
+  $ hg debugobsolete --rev 'all()' --hidden \
+  >   --config experimental.obsstore-index=no > parsed
+  $ cmp indexed parsed
@@ -0,0 +1,84 @@
+Test the index of the changesets touching each directory
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > path-index=yes
+  > [extensions]
+  > strip=
+  > EOF
+
+  $ check() {
+  >   hg log -T '{rev} {desc}\n' "$@" > indexed
+  >   hg log -T '{rev} {desc}\n' "$@" --config experimental.path-index=no \
+  >     > computed
+  >   cmp indexed computed && cat indexed
+  > }
+
+  $ hg init repo
+  $ cd repo
+  $ mkdir -p a/b c
+  $ echo 0 > a/b/f
+  $ echo 0 > top
+  $ hg commit -Aqm 0
+  $ echo 1 > c/f
+  $ hg commit -Aqm 1
+  $ echo 2 > a/g
+  $ hg commit -Aqm 2
+  $ hg rm -q a/b/f
+  $ hg commit -m 3
+
+The index is updated by the transactions adding changesets
+
+  $ echo 4 > top
+  $ hg commit -m 4 --debug | grep 'path index'
+  updating the path index
+  $ f --size .hg/cache/pathindex-v1
+  .hg/cache/pathindex-v1: size=* (glob)
+
+Directories, files and patterns give the same results as without the index
+
+  $ check a
+  3 3
+  2 2
+  0 0
+  $ check a/b
+  3 3
+  0 0
+  $ check a/b/f --removed
+  3 3
+  0 0
+  $ check top
+  4 4
+  0 0
+  $ check c
+  1 1
+  $ check missing
+  $ check 'glob:a/*'
+  2 2
+  $ check -r 'file("path:a")'
+  0 0
+  2 2
+  3 3
+  $ check -r 'file("a/g")'
+  2 2
+  $ check -r 'filelog("a/g")'
+  2 2
+
+Stripped changesets are indexed again
+
+  $ hg strip -q 3
+  $ echo 3 > a/b/f
+  $ hg commit -m 3
+  $ check a/b
+  3 3
+  0 0
+
+Changesets added without updating the index are indexed on demand
+
+  $ hg clone -q . ../other
+  $ echo 4 > ../other/c/f
+  $ hg -R ../other commit -m 4
+  $ hg pull -q ../other --config experimental.path-index=no
+  $ check c
+  4 4
+  1 1
@@ -0,0 +1,111 @@
+Test the persistent on-disk nodemap
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > persistent-nodemap=yes
+  > EOF
+
+  $ hg init test-repo
+  $ cd test-repo
+  $ hg debugnodemap
+  00changelog.n: missing
+  00manifest.n: missing
+
+The nodemap is created by the first transaction adding revisions
+
+  $ for i in 0 1 2 3 4 5; do
+  >   echo $i > f$i
+  >   hg commit -Aqm "commit $i"
+  > done
+  $ hg debugnodemap
+  00changelog.n: 6 revisions (1 sorted, 5 appended)
+  00manifest.n: 6 revisions (1 sorted, 5 appended)
+  $ hg log -T '{rev}:{node}\n'
+  5:4b22e9b2c2f6a218c81d3efaecf957ce8eb03be8
+  4:4186b2b17d8691004f011ef170fdc96ab3831578
+  3:04e7ab2a86f499f375b0f1cbe7eddf6cc5fa61cf
+  2:22aff45ffd4836e9cb2ded3243b3373e2a746483
+  1:8979f70cc8501f7c598f96f3af9aa66272c1c05c
+  0:0a02ceb915ad1e897fff15c74c286bc4491e7e82
+
+Lookups are answered from the nodemap
+
+  $ hg log -r 4b22e9b2c2f6a218c81d3efaecf957ce8eb03be8 -T '{rev}\n'
+  5
+  $ hg log -r 4b22 -T '{rev}\n'
+  5
+  $ hg log -r 8979 -T '{rev}\n'
+  1
+  $ hg log -r 0000 -T '{rev}\n'
+  -1
+  $ hg log -r dead -T '{rev}\n'
+  abort: unknown revision 'dead'!
+  [255]
+
+Revisions added without the nodemap enabled are still found
+
+  $ hg commit --config experimental.persistent-nodemap=no -qm 'empty' \
+  >   --config ui.allowemptycommit=yes
+  $ hg debugnodemap
+  00changelog.n: 6 revisions (1 sorted, 5 appended)
+  00manifest.n: 6 revisions (1 sorted, 5 appended)
+  $ hg log -r tip -T '{rev}:{node|short}\n'
+  6:2c6eddb3b7c1
+  $ hg log -r 2c6eddb3b7c1 -T '{rev}\n'
+  6
+  $ hg commit -qm 'empty again' --config ui.allowemptycommit=yes
+  $ hg debugnodemap
+  00changelog.n: 8 revisions (1 sorted, 7 appended)
+  00manifest.n: 6 revisions (1 sorted, 5 appended)
+
+Stripping appended revisions truncates the file
+
+  $ hg --config extensions.strip= strip -q -r 7 --no-backup
+  $ hg debugnodemap
+  00changelog.n: 7 revisions (1 sorted, 6 appended)
+  00manifest.n: 6 revisions (1 sorted, 5 appended)
+
+A rolled back transaction leaves the file consistent
+
+  $ hg commit -qm 'to be rolled back' --config ui.allowemptycommit=yes
+  $ hg debugnodemap
+  00changelog.n: 8 revisions (1 sorted, 7 appended)
+  00manifest.n: 6 revisions (1 sorted, 5 appended)
+  $ hg rollback -q
+  $ hg debugnodemap
+  00changelog.n: 7 revisions (1 sorted, 6 appended)
+  00manifest.n: 6 revisions (1 sorted, 5 appended)
+
+Stripping revisions of the sorted block invalidates the file, it is rebuilt
+by the next transaction
+
+  $ hg --config extensions.strip= strip -q -r 0 --no-backup
+  $ hg debugnodemap
+  00changelog.n: missing
+  00manifest.n: missing
+  $ echo a > a
+  $ hg commit -Aqm 'new root'
+  $ hg debugnodemap
+  00changelog.n: 1 revisions (1 sorted, 0 appended)
+  00manifest.n: 1 revisions (1 sorted, 0 appended)
+
+A long tail of appended revisions triggers a rewrite of the whole file
+
+  $ cd ..
+  $ hg init big --config experimental.persistent-nodemap=no
+  $ hg -R big debugbuilddag '+1100' --config experimental.persistent-nodemap=no
+  $ hg -R big debugnodemap
+  00changelog.n: missing
+  00manifest.n: missing
+  $ hg init pulled
+  $ hg -R pulled pull -q -r 0 big
+  $ hg -R pulled debugnodemap
+  00changelog.n: 1 revisions (1 sorted, 0 appended)
+  00manifest.n: missing
+  $ hg -R pulled pull -q big
+  $ hg -R pulled debugnodemap
+  00changelog.n: 1100 revisions (1100 sorted, 0 appended)
+  00manifest.n: missing
+  $ hg -R pulled log -r tip -T '{rev}\n'
+  1099
+  $ hg -R pulled verify -q
@@ -0,0 +1,79 @@
+create verbosemmap.py
+  $ cat << EOF > verbosemmap.py
+  > # extension to make util.mmapread verbose
+  > 
+  > from __future__ import absolute_import
+  > 
+  > import sys
+  > 
+  > from mercurial import (
+  >     extensions,
+  >     util,
+  > )
+  > 
+  > def mmapread(orig, fp):
+  >     sys.stderr.write("mmapping %s\n" % fp.name)
+  >     return orig(fp)
+  > 
+  > def extsetup(ui):
+  >     extensions.wrapfunction(util, 'mmapread', mmapread)
+  > EOF
+
+setting up base repo
+  $ hg init a
+  $ cd a
+  $ touch a
+  $ hg add a
+  $ hg commit -qm base
+  $ for i in `$TESTDIR/seq.py 1 100` ; do
+  >   echo $i > a
+  >   hg commit -qm $i
+  > done
+
+a bigger file to get a data file next to its index
+  $ $PYTHON -c 'for i in range(40000): print i' > big
+  $ hg commit -qAm big
+  $ $PYTHON -c 'for i in range(0, 80000, 2): print i' > big
+  $ hg commit -qm 'big again'
+  $ ls .hg/store/data/
+  a.i
+  big.d
+  big.i
+
+set up verbosemmap extension
+  $ cat << EOF >> $HGRCPATH
+  > [extensions]
+  > verbosemmap=$TESTTMP/verbosemmap.py
+  > EOF
+
+mmap index which is now more than 4k long
+  $ hg log -l 5 -T '{rev}\n' --config experimental.mmapindexthreshold=4k
+  mmapping $TESTTMP/a/.hg/store/00changelog.i
+  102
+  101
+  100
+  99
+  98
+
+do not mmap index which is still less than 32k
+  $ hg log -l 5 -T '{rev}\n' --config experimental.mmapindexthreshold=32k
+  102
+  101
+  100
+  99
+  98
+
+inline revlogs are read in memory, data files are never mapped
+  $ hg cat -r 101 big --config experimental.mmapindexthreshold=1 | tail -1
+  mmapping $TESTTMP/a/.hg/store/00changelog.i
+  mmapping $TESTTMP/a/.hg/store/00manifest.i
+  mmapping $TESTTMP/a/.hg/store/data/big.i
+  39999
+  $ hg cat -r 102 big --config experimental.mmapindexthreshold=1 | tail -1
+  mmapping $TESTTMP/a/.hg/store/00changelog.i
+  mmapping $TESTTMP/a/.hg/store/00manifest.i
+  mmapping $TESTTMP/a/.hg/store/data/big.i
+  79998
+
+  $ hg verify -q --config extensions.verbosemmap=! \
+  >   --config experimental.mmapindexthreshold=1
@@ -0,0 +1,86 @@
+Test sparse reads of delta chains
+
+  $ cat << EOF > $TESTTMP/verbosesegment.py
+  > # extension to report the segments of filelogs read from disk
+  > 
+  > from __future__ import absolute_import
+  > 
+  > import sys
+  > 
+  > from mercurial import (
+  >     extensions,
+  >     revlog,
+  > )
+  > 
+  > def getsegmentforrevs(orig, self, startrev, endrev, df=None):
+  >     if self.indexfile.startswith('data/'):
+  >         sys.stderr.write('reading %s revisions %d to %d\n'
+  >                          % (self.indexfile, startrev, endrev))
+  >     return orig(self, startrev, endrev, df=df)
+  > 
+  > def extsetup(ui):
+  >     extensions.wrapfunction(revlog.revlog, '_getsegmentforrevs',
+  >                             getsegmentforrevs)
+  > EOF
+
+  $ cat << EOF > $TESTTMP/bigtext.py
+  > import random, sys
+  > random.seed(int(sys.argv[1]))
+  > with open('f', 'wb') as fp:
+  >     for i in range(10000):
+  >         fp.write('%d\n' % random.randint(0, 1 << 30))
+  > EOF
+
+Build a filelog where the delta chain of one branch is interleaved with
+large revisions of another branch
+
+  $ hg init repo
+  $ cd repo
+  $ $PYTHON -c 'for i in range(2000): print "line %d" % i' > f
+  $ hg commit -qAm base
+  $ echo 'a1' >> f
+  $ hg commit -qm a1
+  $ hg update -q 0
+  $ $PYTHON $TESTTMP/bigtext.py 1
+  $ hg commit -qm b1
+  $ hg update -q 1
+  $ echo 'a2' >> f
+  $ hg commit -qm a2
+  $ hg debugdeltachain f -T '{rev} {chainlen} {prevrev}\n'
+  0 1 -1
+  1 2 0
+  2 2 0
+  3 3 1
+
+  $ cat << EOF >> $HGRCPATH
+  > [extensions]
+  > verbosesegment=$TESTTMP/verbosesegment.py
+  > EOF
+
+By default, the whole span of the chain is read at once
+
+  $ hg cat -r 3 f > /dev/null
+  reading data/f.i revisions 0 to 3
+
+With sparse reads, the large revision in the middle of the chain is skipped
+
+  $ hg cat -r 3 f --config experimental.sparse-read=yes \
+  >   --config experimental.sparse-read.min-gap-size=1k > /dev/null
+  reading data/f.i revisions 0 to 1
+  reading data/f.i revisions 3 to 3
+
+Gaps smaller than the minimal gap size are read through
+
+  $ hg cat -r 3 f --config experimental.sparse-read=yes \
+  >   --config experimental.sparse-read.min-gap-size=1m > /dev/null
+  reading data/f.i revisions 0 to 3
+
+Nothing is skipped when the chain is dense enough
+
+  $ hg cat -r 3 f --config experimental.sparse-read=yes \
+  >   --config experimental.sparse-read.min-gap-size=1k \
+  >   --config experimental.sparse-read.density-threshold=0.01 > /dev/null
+  reading data/f.i revisions 0 to 3
+
+  $ hg verify -q --config extensions.verbosesegment=! \
+  >   --config experimental.sparse-read=yes
@@ -3417,6 +3417,141 @@ invalid function call should not be optimized to only()
   hg: parse error: not a symbol
   [255]
 
+chains of 'and' are reordered by weight, the negated operands last, and
+the ancestors of a set and the non-ancestors of another are converted to only()
+anywhere in the chain
+
+  $ hg debugrevspec -p optimized --verify-optimized \
+  >   'desc(bug) and not ::2 and 0:9 and ::6 and not 4'
+  * optimized:
+  (difference
+    (and
+      (and
+        (range
+          ('symbol', '0')
+          ('symbol', '9')
+          follow)
+        (func
+          ('symbol', 'only')
+          (list
+            ('symbol', '6')
+            ('symbol', '2'))
+          define)
+        define)
+      (func
+        ('symbol', 'desc')
+        ('symbol', 'bug')
+        define)
+      define)
+    ('symbol', '4')
+    define)
+  $ log 'desc(bug) and not ::2 and 0:9 and ::6 and not 4'
+  5
+
+  $ hg debugrevspec -p optimized --verify-optimized \
+  >   'reverse(0:9) and desc(" ") and (merge() or 3::)'
+  * optimized:
+  (and
+    (and
+      (func
+        ('symbol', 'reverse')
+        (range
+          ('symbol', '0')
+          ('symbol', '9')
+          define)
+        define)
+      (or
+        (list
+          (func
+            ('symbol', 'merge')
+            None
+            follow)
+          (func
+            ('symbol', 'descendants')
+            ('symbol', '3')
+            follow))
+        follow)
+      define)
+    (func
+      ('symbol', 'desc')
+      ('string', ' ')
+      follow)
+    define)
+  $ log 'reverse(0:9) and desc(" ") and (merge() or 3::)'
+  6
+  5
+
+public() is turned into a difference with the other phases, and heads(all())
+is computed by the index
+
+  $ hg phase -p 3
+  $ hg debugrevspec -p optimized --verify-optimized '0:9 and public()'
+  * optimized:
+  (and
+    (range
+      ('symbol', '0')
+      ('symbol', '9')
+      define)
+    (difference
+      (func
+        ('symbol', 'all')
+        None
+        follow)
+      (func
+        ('symbol', '_notpublic')
+        None
+        any)
+      follow)
+    define)
+  $ log '0:9 and public()'
+  0
+  1
+  3
+  $ hg debugrevspec -p optimized --verify-optimized 'public()'
+  * optimized:
+  (difference
+    (func
+      ('symbol', 'all')
+      None
+      define)
+    (func
+      ('symbol', '_notpublic')
+      None
+      any)
+    define)
+  $ log 'public()'
+  0
+  1
+  3
+  $ log 'wdir() and public()'
+  $ hg debugrevspec -p optimized --verify-optimized 'heads(all())'
+  * optimized:
+  (func
+    ('symbol', '_headrevs')
+    None
+    define)
+  $ log 'heads(all())'
+  7
+  9
+  $ hg debugrevspec -p optimized --verify-optimized 'reverse(heads(:)) and 5:'
+  * optimized:
+  (and
+    (rangepost
+      ('symbol', '5')
+      follow)
+    (func
+      ('symbol', 'reverse')
+      (func
+        ('symbol', '_headrevs')
+        None
+        define)
+      define)
+    define)
+  $ log 'reverse(heads(:)) and 5:'
+  9
+  7
+  $ hg phase -fd 3
+
 we can use patterns when searching for tags
 
   $ log 'tag("1..*")'
@@ -0,0 +1,44 @@
+Sharing ssh connections through a control socket
+
+  $ hg init remote
+  $ cd remote
+  $ echo a > a
+  $ hg commit -qAm a
+  $ cd ..
+
+  $ cat >> $HGRCPATH << EOF
+  > [ui]
+  > ssh = $PYTHON "$TESTDIR/dummyssh"
+  > [experimental]
+  > ssh.controlpersist = 60
+  > ssh.controldir = $TESTTMP/control
+  > EOF
+
+The control directory is created private and the options are passed to ssh
+
+  $ hg clone -q ssh://user@dummy/remote local
+  $ cat dummylog
+  Got arguments 1:user@dummy 2:-o 3:ControlMaster=auto 4:-o 5:ControlPath=$TESTTMP/control/%r@%h:%p 6:-o 7:ControlPersist=60 8:hg -R remote serve --stdio
+#if unix-permissions
+  $ f --mode control
+  control: mode=700
+#endif
+
+Connections are not shared through a directory others can write to
+
+#if unix-permissions
+  $ chmod 777 control
+  $ hg -R local pull
+  pulling from ssh://user@dummy/remote
+  not sharing ssh connections: $TESTTMP/control is not a private directory
+  searching for changes
+  no changes found
+  $ tail -1 dummylog
+  Got arguments 1:user@dummy 2:hg -R remote serve --stdio
+#endif
+
+Connections are not shared unless requested
+
+  $ hg -R local pull --config experimental.ssh.controlpersist= -q
+  $ tail -1 dummylog
+  Got arguments 1:user@dummy 2:hg -R remote serve --stdio
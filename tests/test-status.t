@@ -606,4 +606,41 @@ using log status template, the copy information is displayed correctly.
   R b
   
 
+  $ cd ..
+
+Stat'ing files and listing directories from several threads gives the same
+results
+
+  $ hg init threaded
+  $ cd threaded
+  $ for d in a b c d; do
+  >   mkdir $d $d/sub
+  >   for i in `$PYTHON -c 'for i in range(50): print(i)'`; do
+  >     echo $i > $d/f$i
+  >     echo $i > $d/sub/f$i
+  >   done
+  > done
+  $ hg ci -Aqm0
+  $ echo changed > a/f1
+  $ echo changed > c/sub/f40
+  $ rm b/f3 d/sub/f7
+  $ echo new > d/new
+  $ mkdir e
+  $ echo new > e/new
+  $ hg st > ../serial.out
+  $ hg st --config experimental.stat-threads=4 > ../threaded.out
+  $ cmp ../serial.out ../threaded.out
+  $ cat ../threaded.out
+  M a/f1
+  M c/sub/f40
+  ! b/f3
+  ! d/sub/f7
+  ? d/new
+  ? e/new
+  $ hg st -mard --config experimental.stat-threads=4
+  M a/f1
+  M c/sub/f40
+  ! b/f3
+  ! d/sub/f7
+
   $ cd ..
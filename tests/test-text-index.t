@@ -0,0 +1,103 @@
+#require serve
+
+Test the index of the text of the changesets
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > text-index=yes
+  > [extensions]
+  > strip=
+  > EOF
+
+  $ check() {
+  >   hg log -T '{rev} {desc|firstline}\n' -r "$1" > indexed
+  >   hg log -T '{rev} {desc|firstline}\n' -r "$1" --config experimental.text-index=no \
+  >     > computed
+  >   cmp indexed computed && cat indexed
+  > }
+
+  $ hg init repo
+  $ cd repo
+  $ echo 0 > Alpha
+  $ hg commit -Aqm 'Add the first file' -u alice
+  $ echo 1 > beta
+  $ hg commit -Aqm 'fix a BUG in beta' -u bob
+  $ echo 2 > Alpha
+  $ printf 'Fix the Alpha bug\n\non several lines\n' > ../message
+  $ hg commit -l ../message -u alice
+  $ echo 3 > beta
+  $ $PYTHON -c 'open("../message", "wb").write(b"caf\xc3\xa9 \xe2\x84\xaaelvin\n")'
+  $ HGENCODING=utf-8 hg commit -l ../message -u carol
+
+The index is updated by the transactions adding changesets
+
+  $ echo 4 > gamma
+  $ hg commit -Aqm 'add gamma' -u dave --debug | grep 'text index'
+  updating the text index
+  $ f --size .hg/cache/textindex-v1
+  .hg/cache/textindex-v1: size=* (glob)
+
+Keywords, descriptions and plain grep patterns give the same results as
+without the index
+
+  $ check 'keyword(bug)'
+  1 fix a BUG in beta
+  2 Fix the Alpha bug
+  $ check 'keyword(alpha)'
+  0 Add the first file
+  2 Fix the Alpha bug
+  $ check 'keyword(alice)'
+  0 Add the first file
+  2 Fix the Alpha bug
+  $ check 'keyword(gam)'
+  4 add gamma
+  $ check 'keyword(missing)'
+  $ check 'keyword(ug)'
+  1 fix a BUG in beta
+  2 Fix the Alpha bug
+  $ check 'desc(fix)'
+  1 fix a BUG in beta
+  2 Fix the Alpha bug
+  $ check 'desc("bug\non")'
+  $ check 'desc("bug\n\non")'
+  2 Fix the Alpha bug
+  $ check 'desc(alice)'
+  $ check 'desc("re:B.G")'
+  1 fix a BUG in beta
+  2 Fix the Alpha bug
+  $ check 'grep(BUG)'
+  1 fix a BUG in beta
+  $ check 'grep("Alpha b")'
+  2 Fix the Alpha bug
+  $ check 'grep("B.G")'
+  1 fix a BUG in beta
+
+Non-ASCII text is searched like without the index
+
+  $ HGENCODING=utf-8 check 'keyword(caf)'
+  3 caf\xc3\xa9 \xe2\x84\xaaelvin (esc)
+  $ HGENCODING=utf-8 check 'keyword(kelvin)'
+  3 caf\xc3\xa9 \xe2\x84\xaaelvin (esc)
+  $ HGENCODING=ascii check 'keyword("caf?")'
+  3 caf? ?elvin
+
+Stripped changesets are indexed again
+
+  $ hg strip -q 4
+  $ echo 4 > gamma
+  $ hg commit -Aqm 'add another gamma' -u dave
+  $ check 'keyword(gamma)'
+  4 add another gamma
+
+The keyword search of hgweb only checks the candidate changesets
+
+  $ hg serve -n test -p $HGPORT -d --pid-file=hg.pid -E errors.log
+  $ cat hg.pid >> $DAEMON_PIDS
+  $ get-with-headers.py $LOCALIP:$HGPORT 'log?rev=fix+alpha&style=raw' \
+  >   | grep 'revision:'
+  revision:    2
+  $ get-with-headers.py $LOCALIP:$HGPORT 'log?rev=bug&style=raw' \
+  >   | grep 'revision:'
+  revision:    2
+  revision:    1
+  $ cat errors.log
@@ -0,0 +1,132 @@
+Test the directory keyed, appendable dirstate format
+
+  $ cat >> $HGRCPATH << EOF
+  > [experimental]
+  > treedirstate=yes
+  > EOF
+
+  $ hg init repo
+  $ cd repo
+  $ grep treedirstate .hg/requires
+  exp-treedirstate
+  $ mkdir -p a/b
+  $ echo a > a/b/g
+  $ echo f > a/f
+  $ echo top > top
+  $ hg commit -Aqm 0
+
+Make sure no file has an unset timestamp, so that status does not have to
+update the entries anymore; the refreshed entries are appended to the file
+
+  $ touch -t 200001010000 a/b/g a/f top
+  $ hg debugrebuildstate
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=178
+  $ hg status
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=292
+  $ hg status
+  $ hg debugstate --nodates
+  n 644          2 set                 a/b/g
+  n 644          2 set                 a/f
+  n 644          4 set                 top
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=292
+
+Changes outside of a transaction are appended to the file
+
+  $ echo top2 > top2
+  $ hg add top2
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=365
+
+The file is rewritten once the appended entries outnumber the live ones
+
+  $ hg cp a/f a/f2
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=224
+  $ hg status -C
+  A a/f2
+    a/f
+  A top2
+  $ hg forget top2
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=297
+  $ hg status -C
+  A a/f2
+    a/f
+  ? top2
+  $ hg debugstate --nodates
+  n 644          2 set                 a/b/g
+  n 644          2 set                 a/f
+  a   0         -1 unset               a/f2
+  n 644          4 set                 top
+  copy: a/f -> a/f2
+
+An interrupted append is ignored, and the file is rewritten by the next
+change
+
+  >>> with open('.hg/dirstate', 'ab') as fp:
+  ...     fp.write('HGDA\0\0\1\0\0\0\0\1')
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=309
+  $ hg status -C
+  A a/f2
+    a/f
+  ? top2
+  $ hg add top2
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=224
+  $ hg status -C
+  A a/f2
+    a/f
+  A top2
+
+Committing rewrites the file
+
+  $ hg commit -qm 1
+  $ hg status -C
+  $ hg debugstate --nodates | awk '{print $1, $NF}'
+  n a/b/g
+  n a/f
+  n a/f2
+  n top
+  n top2
+  $ hg log -r . -T '{file_copies}\n'
+  a/f2 (a/f)
+
+Modifications are seen
+
+  $ echo modified > a/b/g
+  $ hg rm -q top
+  $ hg status
+  M a/b/g
+  R top
+  $ hg revert -q --all --no-backup
+  $ hg status
+
+The format can be dropped and added with an upgrade
+
+  $ hg cp a/f a/f3
+  $ hg debugupgraderepo --run --config experimental.treedirstate=no 2> /dev/null \
+  >   | grep -e removed -e converting
+     removed: exp-treedirstate
+  converting working directory state
+  $ grep treedirstate .hg/requires
+  [1]
+  $ hg status -C
+  A a/f3
+    a/f
+  $ hg debugupgraderepo --run 2> /dev/null | grep -e added -e converting
+     added: exp-treedirstate
+  converting working directory state
+  $ grep treedirstate .hg/requires
+  exp-treedirstate
+  $ hg status -C
+  A a/f3
+    a/f
+  $ f --size .hg/dirstate
+  .hg/dirstate: size=245
+  $ hg forget a/f3
+  $ hg status
+  ? a/f3
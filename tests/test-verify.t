@@ -361,3 +361,63 @@ test flag processor and skipflags
   checking files
   1 files, 1 changesets, 1 total revisions
 
+
+test checking files in worker processes, the output is the same as the one of
+a serial verify
+
+  $ cd $TESTTMP
+  $ hg init parallel
+  $ cd parallel
+  $ for i in `$PYTHON -c 'for i in range(200): print(i)'`; do
+  >   echo $i > f$i
+  > done
+  $ hg ci -Aqm0
+  $ echo changed > f42
+  $ hg cp f42 copied
+  $ hg ci -qm1
+  $ rm .hg/store/data/f7.i
+  $ echo broken > .hg/store/data/f150.i
+  $ hg verify > serial.out 2>&1
+  [1]
+  $ hg verify --config experimental.verify-workers=yes \
+  >   --config worker.numcpus=4 > parallel.out 2>&1
+  [1]
+  $ cmp serial.out parallel.out
+  $ cat parallel.out
+  checking changesets
+  checking manifests
+  crosschecking files in changesets and manifests
+  checking files
+   f150@0: broken revlog! (unknown version (28523) in revlog data/f150.i)
+   warning: revlog 'data/f7.i' not in fncache!
+   0: empty or missing f7
+   f7@0: manifest refers to unknown revision 1ef88e2fdf14
+  warning: orphan revlog 'data/f150.i'
+  201 files, 2 changesets, 200 total revisions
+  2 warnings encountered!
+  hint: run "hg debugrebuildfncache" to recover from corrupt fncache
+  3 integrity errors encountered!
+  (first damaged changeset appears to be 0)
+
+the errors of badly damaged filelogs, more than what can be written at once
+to a pipe, don't get mixed up
+
+  $ cd $TESTTMP
+  $ hg init damaged
+  $ hg -R damaged debugbuilddag -o '+300'
+  $ cd parallel
+  $ for i in 3 60 120 180; do
+  >   cp ../damaged/.hg/store/data/of.i .hg/store/data/f$i.i
+  > done
+  $ hg verify > serial.out 2>&1
+  [1]
+  $ hg verify --config experimental.verify-workers=yes \
+  >   --config worker.numcpus=4 > parallel.out 2>&1
+  [1]
+  $ cmp serial.out parallel.out
+  $ tail -5 parallel.out
+  201 files, 2 changesets, 1396 total revisions
+  1198 warnings encountered!
+  hint: run "hg debugrebuildfncache" to recover from corrupt fncache
+  2403 integrity errors encountered!
+  (first damaged changeset appears to be 0)